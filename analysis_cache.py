@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "music2")
+DEFAULT_MAX_BYTES = 2 << 30  # 2 GiB
+
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_BLOCK = 64 << 10
+
+
+def file_fingerprint(path):
+    """Fast content hash: the file size plus evenly spaced 64 KiB blocks.
+
+    Reads about 1 MiB regardless of file size, so it is cheap enough to run
+    on every open while still changing whenever the audio is re-exported.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= FINGERPRINT_SAMPLES * FINGERPRINT_BLOCK:
+            digest.update(f.read())
+        else:
+            step = (size - FINGERPRINT_BLOCK) // (FINGERPRINT_SAMPLES - 1)
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(i * step)
+                digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+
+def artifact_key(fingerprint, kind, **params):
+    """Cache key for one kind of artifact derived with the given parameters."""
+    spec = json.dumps([fingerprint, kind, params], sort_keys=True)
+    return hashlib.blake2b(spec.encode(), digest_size=16).hexdigest()
+
+
+class AnalysisCache:
+    """On-disk store of derived analysis artifacts with an LRU size budget.
+
+    Each entry is a directory holding a small JSON metadata dict and any
+    number of arrays saved as .npy files, which load memory-mapped. A SQLite
+    index tracks entry sizes and last use; storing past `max_bytes` evicts
+    the least recently used entries.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.environ.get(
+            "MUSIC2_CACHE_DIR", DEFAULT_CACHE_DIR
+        )
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(self.directory, "index.sqlite"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, size INTEGER, meta TEXT, last_used REAL)"
+            )
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, key):
+        """Return (meta, arrays) for `key`, or None if it is not cached."""
+        row = self._db.execute(
+            "SELECT meta FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry_dir = self._entry_dir(key)
+        try:
+            arrays = {
+                name[:-4]: np.load(os.path.join(entry_dir, name), mmap_mode="r")
+                for name in os.listdir(entry_dir)
+                if name.endswith(".npy")
+            }
+        except (OSError, ValueError):
+            # Removed or truncated behind our back; forget it
+            self.discard(key)
+            return None
+        with self._db:
+            self._db.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0]), arrays
+
+    def begin(self, key):
+        """Start writing an entry; returns a scratch directory to fill.
+
+        Lets large arrays be written in place (e.g. with open_memmap) instead
+        of being built in memory first. Finish with commit().
+        """
+        tmp_dir = f"{self._entry_dir(key)}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_dir)
+        return tmp_dir
+
+    def commit(self, key, tmp_dir, meta=None):
+        entry_dir = self._entry_dir(key)
+        size = sum(
+            os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir)
+        )
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+            # Another process committed the same key in between; its entry
+            # holds the same artifact, so keep that one
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, size, json.dumps(meta or {}), time.time()),
+            )
+        self.evict(keep=key)
+
+    def store(self, key, meta=None, **arrays):
+        tmp_dir = self.begin(key)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(array))
+        self.commit(key, tmp_dir, meta)
+
+    def discard(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        with self._db:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def total_bytes(self):
+        return self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def evict(self, max_bytes=None, keep=None):
+        budget = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_bytes()
+        if total <= budget:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM entries ORDER BY last_used ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= budget:
+                break
+            if key == keep:
+                continue
+            self.discard(key)
+            total -= size
+
+    def close(self):
+        self._db.close()
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AnalysisCache()
+    return _default_cache
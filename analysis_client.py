@@ -0,0 +1,95 @@
+"""Client for the local analysis service (analysis_service.py).
+
+    from analysis_client import AnalysisClient
+
+    with AnalysisClient() as client:
+        tempo = client.tempo("song.wav")
+        keys = client.spectrogram("song.wav").magnitudes
+
+Only needs numpy: the analysis, and scipy, stay in the service. Results
+come back as the same types the in-process analysis returns.
+"""
+
+import os
+import socket
+from collections import namedtuple
+
+from loudness import Loudness
+from service_protocol import DEFAULT_SOCKET, recv_message, send_message
+from tempo import Tempo
+from transcribe import Note
+
+# (frames, 88 keys or n_fft // 2 + 1 bins); frame i starts at i * hop samples
+# of the signal at `sample_rate`
+Spectrogram = namedtuple("Spectrogram", ["magnitudes", "sample_rate", "hop"])
+
+
+class AnalysisServiceError(RuntimeError):
+    """The service could not answer a request, e.g. for a missing file."""
+
+
+class AnalysisClient:
+    """Blocking connection to the analysis service.
+
+    One request is in flight per client at a time; use a client per thread
+    to have several.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+
+    def request(self, op, path=None, **params):
+        """(meta, arrays) the service returns for `op` on the file at `path`."""
+        header = {"op": op, "params": params}
+        if path is not None:
+            # The service runs in its own working directory
+            header["path"] = os.path.abspath(path)
+        send_message(self.sock, header)
+        response, arrays = recv_message(self.sock)
+        if not response["ok"]:
+            raise AnalysisServiceError(response["error"])
+        return response["meta"], arrays
+
+    def ping(self):
+        self.request("ping")
+
+    def stats(self):
+        """The service's telemetry snapshot, with its in-flight request count."""
+        return self.request("stats")[0]
+
+    def spectrogram(self, path, **params):
+        """Spectrogram at the decimated analysis rate; see file_spectrogram."""
+        meta, arrays = self.request("spectrogram", path, **params)
+        return Spectrogram(arrays["spectrogram"], meta["sample_rate"], meta["hop"])
+
+    def tempo(self, path, **params):
+        """Tempo and beats; see tempo.TempoEstimator for the parameters."""
+        meta, arrays = self.request("tempo", path, **params)
+        return Tempo(meta["bpm"], arrays["beats"])
+
+    def notes(self, path):
+        """Transcribed notes, as transcribe.transcribe would return them."""
+        _, arrays = self.request("notes", path)
+        return [Note(*note) for note in arrays["notes"].tolist()]
+
+    def loudness(self, path):
+        meta, arrays = self.request("loudness", path)
+        return Loudness(
+            meta["integrated"],
+            meta["loudness_range"],
+            meta["true_peak"],
+            meta["step"],
+            arrays["steps"],
+        )
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
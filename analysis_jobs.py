@@ -0,0 +1,162 @@
+"""Analysis jobs that run in worker processes.
+
+Kept free of Qt so spawned workers only import numpy/scipy. Workers find
+the decoded mono waveform in a shared memory block by name instead of
+receiving it pickled. The whole-file jobs used by the analysis service read
+the file themselves and return (meta, arrays) ready for the cache.
+"""
+
+import importlib
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import loudness
+from chroma import chroma
+from decimate import Decimator
+from peak_pyramid import PeakPyramid
+from piano_filterbank import get_filterbank
+from stft import STFT, StreamingSTFT
+from tempo import TempoEstimator, onset_strength
+from wav_file import WavFile
+
+PYRAMID_BASE_LEVEL = 6
+TEMPO_N_FFT, TEMPO_HOP = 1024, 512
+CHROMA_N_FFT, CHROMA_HOP = 8192, 2048
+# Chunks are whole multiples of every hop and of the pyramid bucket, and much
+# longer than any FFT, so a chunk's frames only reach into the next chunk
+CHUNK_FRAMES = CHROMA_HOP * 256
+READ_FRAMES = 1 << 20
+SPECTROGRAM_N_FFT, SPECTROGRAM_HOP = 4096, 256  # At the decimated rate
+NOTE_DTYPE = np.dtype(
+    [
+        ("pitch", np.uint8),
+        ("start", np.float64),
+        ("end", np.float64),
+        ("velocity", np.uint8),
+    ]
+)
+
+
+def warm_up():
+    """Import what the jobs need, so a worker's first job does not pay for it."""
+    for name in ("scipy.fft", "scipy.signal", "scipy.sparse", "transcribe"):
+        importlib.import_module(name)
+
+
+def attach_shared(name, length):
+    """Attach to a float32 shared memory block created by another process."""
+    # Spawned workers share the parent's resource tracker, so attaching here
+    # does not make the block's lifetime depend on the worker
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+
+
+def decode_chunk(path, shm_name, start, stop):
+    """Mix frames [start, stop) of a WAV file into the shared mono buffer.
+
+    Returns the chunk's peak pyramid base-level summaries over its planar
+    frames, for PeakPyramid.from_summaries.
+    """
+    wav = WavFile(path)
+    planar = wav.decode(start, stop)
+
+    shm, mono = attach_shared(shm_name, wav.nframes)
+    try:
+        np.mean(planar, axis=0, out=mono[start:stop])
+    finally:
+        del mono
+        shm.close()
+
+    return PeakPyramid.summarize(planar, 1 << PYRAMID_BASE_LEVEL)
+
+
+def _frame_range(stft, start, stop, nframes):
+    first = start // stft.hop
+    last = min(stop // stft.hop, stft.num_frames(nframes))
+    return first, max(first, last)
+
+
+def analyze_chunk(shm_name, nframes, sample_rate, start, stop):
+    """Onset envelope and chroma for the frames that start in [start, stop)."""
+    shm, mono = attach_shared(shm_name, nframes)
+    try:
+        return _analyze(mono, nframes, sample_rate, start, stop)
+    finally:
+        del mono
+        shm.close()
+
+
+def _analyze(mono, nframes, sample_rate, start, stop):
+    tempo_stft = STFT(TEMPO_N_FFT, TEMPO_HOP)
+    first, last = _frame_range(tempo_stft, start, stop, nframes)
+    # One extra frame in front so the first flux value has a predecessor
+    lead = 1 if first > 0 else 0
+    window = mono[(first - lead) * TEMPO_HOP : (last - 1) * TEMPO_HOP + TEMPO_N_FFT]
+    envelope, _ = onset_strength(tempo_stft.compute(window))
+
+    chroma_stft = STFT(CHROMA_N_FFT, CHROMA_HOP)
+    first, last = _frame_range(chroma_stft, start, stop, nframes)
+    window = mono[first * CHROMA_HOP : (last - 1) * CHROMA_HOP + CHROMA_N_FFT]
+    chroma_frames = chroma(chroma_stft.compute(window), sample_rate, CHROMA_N_FFT)
+
+    return {"envelope": envelope[lead:], "chroma": chroma_frames}
+
+
+def file_spectrogram(path, n_fft=SPECTROGRAM_N_FFT, hop=SPECTROGRAM_HOP, scale="keys"):
+    """Magnitude spectrogram of a WAV file at the decimated analysis rate.
+
+    With scale "keys" the bins are summed into the 88 piano keys, which is
+    what the views show at a fraction of the size; "linear" keeps the bins.
+    """
+    if scale not in ("keys", "linear"):
+        raise ValueError(f"Unknown spectrogram scale: {scale}")
+    wav = WavFile(path)
+    decimator = Decimator(wav.framerate)
+    stft = StreamingSTFT(STFT(n_fft, hop))
+    filterbank = get_filterbank(decimator.rate, n_fft) if scale == "keys" else None
+    parts = []
+
+    def add(samples):
+        spectrogram = stft.feed(samples)
+        if filterbank is not None:
+            spectrogram = filterbank.apply(spectrogram).astype(np.float32)
+        parts.append(spectrogram)
+
+    for start in range(0, wav.nframes, READ_FRAMES):
+        add(decimator.feed(wav.read_mono(start, start + READ_FRAMES)))
+    add(decimator.flush())
+    meta = {"sample_rate": decimator.rate, "n_fft": n_fft, "hop": hop, "scale": scale}
+    return meta, {"spectrogram": np.concatenate(parts)}
+
+
+def file_tempo(path, **params):
+    """Tempo of a whole file; `params` are passed on to TempoEstimator."""
+    wav = WavFile(path)
+    estimator = TempoEstimator(wav.framerate, **params)
+    for start in range(0, wav.nframes, READ_FRAMES):
+        estimator.feed(wav.read_mono(start, start + READ_FRAMES))
+    tempo = estimator.result()
+    return {"bpm": float(tempo.bpm)}, {
+        "beats": tempo.beats,
+        "envelope": estimator.envelope,
+    }
+
+
+def file_notes(path):
+    from transcribe import transcribe
+
+    notes = transcribe(path)
+    return {}, {"notes": np.array([tuple(note) for note in notes], NOTE_DTYPE)}
+
+
+def file_loudness(path, step_seconds=loudness.STEP_SECONDS):
+    # Same meta and arrays as the analysis scheduler caches
+    result = loudness.measure_file(path, step_seconds)
+    meta = {
+        "integrated": result.integrated,
+        "loudness_range": result.loudness_range,
+        "true_peak": result.true_peak,
+        "step": result.step,
+    }
+    return meta, {"steps": result.steps}
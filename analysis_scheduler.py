@@ -0,0 +1,387 @@
+import importlib
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+
+import analysis_jobs
+from analysis_cache import artifact_key, default_cache, file_fingerprint
+from chroma import ChordTracker, Timeline, estimate_key
+from loudness import STEP_SECONDS, Loudness
+from peak_pyramid import PeakPyramid
+from telemetry import telemetry
+from tempo import Tempo, beat_grid, estimate_tempo, onset_times
+
+# While merging, tempo is re-estimated once the envelope has grown this much
+TEMPO_UPDATE_GROWTH = 1.25
+
+
+def _preload_scipy():
+    for name in ("scipy.fft", "scipy.signal"):
+        importlib.import_module(name)
+
+
+class AnalysisScheduler(QObject):
+    """Runs file analysis on a process pool and streams results back.
+
+    The file is split into chunks. Each chunk is first decoded by a worker
+    into a shared memory mono buffer, then analyzed by a worker reading that
+    buffer. Results for the decoded-and-analyzed prefix of the file are
+    merged on the GUI thread and emitted as they grow: key and chords are
+    kept up to date incrementally, and tempo, which needs the whole onset
+    envelope, is re-estimated only as the envelope grows by a fixed factor.
+    Loudness needs one sequential pass, so a single job streams the whole
+    file for it alongside the chunk jobs. Starting a new file bumps the
+    generation, cancels queued jobs and drops late results.
+
+    Finished results are stored in the analysis cache, keyed by the file's
+    content, and a file seen before is answered from there without jobs.
+    If a worker dies, the pool is replaced and the file reports an error.
+    """
+
+    # generation, kind ("pyramid", "tempo", "key", "chords", "loudness" or
+    # "error"), value
+    result_ready = Signal(int, str, object)
+    progress_changed = Signal(int, float)
+    finished = Signal(int)
+    _jobs_done = Signal()
+
+    def __init__(self, parent=None, max_workers=None, cache=None):
+        super().__init__(parent)
+        self.max_workers = max_workers
+        self.cache = cache
+        self.executor = None
+        self.generation = 0
+        self.futures = []
+        self.shm = None
+        self.wav = None
+        self._done = queue.SimpleQueue()
+        self._jobs_done.connect(self._drain_done)
+
+    def _executor(self):
+        if self.executor is None:
+            # Results are merged with scipy on the GUI thread; load it in the
+            # background while the workers spin up instead of stalling then
+            threading.Thread(target=_preload_scipy, daemon=True).start()
+            # Spawned rather than forked workers: forking a process that runs
+            # Qt and audio threads is not safe
+            self.executor = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.executor
+
+    def _discard_executor(self):
+        # A pool whose worker died takes no more jobs; the next one is new
+        telemetry.count("analysis.pool_broken")
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def start(self, wav):
+        self.cancel()
+        self.wav = wav
+        if self.cache is None:
+            self.cache = default_cache()
+        fingerprint = file_fingerprint(wav.path)
+        self.pyramid_key = artifact_key(
+            fingerprint,
+            "pyramid",
+            base_level=analysis_jobs.PYRAMID_BASE_LEVEL,
+            layout="planar",
+        )
+        self.analysis_key = artifact_key(
+            fingerprint,
+            "analysis",
+            tempo=[analysis_jobs.TEMPO_N_FFT, analysis_jobs.TEMPO_HOP],
+            chroma=[analysis_jobs.CHROMA_N_FFT, analysis_jobs.CHROMA_HOP],
+        )
+        self.loudness_key = artifact_key(
+            fingerprint, "loudness", step_seconds=STEP_SECONDS
+        )
+        self.loudness_done = self._emit_cached_loudness()
+        if not self.loudness_done:
+            self._submit("loudness", 0, analysis_jobs.file_loudness, wav.path)
+        self.analysis_done = self._emit_cached()
+        if self.analysis_done:
+            self.progress_changed.emit(self.generation, 1.0)
+            self._maybe_finish()
+            return self.generation
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(4, wav.nframes * 4))
+
+        chunk = analysis_jobs.CHUNK_FRAMES
+        self.chunks = [
+            (start, min(start + chunk, wav.nframes))
+            for start in range(0, wav.nframes, chunk)
+        ]
+        self.summaries = [None] * len(self.chunks)
+        self.analyses = [None] * len(self.chunks)
+        self.analysis_submitted = set()
+        self.jobs_done = 0
+        self.analyzed_prefix = 0
+        self.envelopes = []
+        self.envelope_frames = 0
+        self.chroma_parts = []
+        self.chroma_sum = np.zeros(12)
+        self.chroma_frames = 0
+        self.chords = ChordTracker(analysis_jobs.CHROMA_HOP)
+        self.tempo = Tempo(0.0, np.zeros(0))
+        self.tempo_frames = 0  # Envelope length `tempo` was estimated from
+
+        for index, (start, stop) in enumerate(self.chunks):
+            self._submit(
+                "decode",
+                index,
+                analysis_jobs.decode_chunk,
+                wav.path,
+                self.shm.name,
+                start,
+                stop,
+            )
+        if not self.chunks:
+            self.analysis_done = True
+            self._maybe_finish()
+        return self.generation
+
+    def _submit(self, kind, index, fn, *args):
+        generation = self.generation
+        submitted = time.perf_counter()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_executor()
+            future = self._executor().submit(fn, *args)
+        future.add_done_callback(
+            lambda f: self._on_future_done(generation, kind, index, submitted, f)
+        )
+        self.futures.append(future)
+
+    def _on_future_done(self, *job):
+        # Runs on an executor thread: hand the job over through a queue and
+        # only wake the GUI thread with an argument-less queued signal.
+        # Stale jobs are dropped here already, since after shutdown() the Qt
+        # side of this object may be gone
+        if job[0] != self.generation:
+            return
+        self._done.put(job)
+        self._jobs_done.emit()
+
+    def _drain_done(self):
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._on_job_done(*job)
+
+    def _on_job_done(self, generation, kind, index, submitted, future):
+        if generation != self.generation or future.cancelled():
+            return
+        # From submission until the result reaches the GUI thread
+        telemetry.record(f"analysis.{kind}", time.perf_counter() - submitted)
+        error = future.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self._discard_executor()
+            self.result_ready.emit(generation, "error", error)
+            self.cancel()
+            return
+        if kind == "loudness":
+            self._on_loudness(*future.result())
+            return
+
+        self.jobs_done += 1
+        self.progress_changed.emit(generation, self.jobs_done / (2 * len(self.chunks)))
+        if kind == "decode":
+            self.summaries[index] = future.result()
+            for ready in (index - 1, index):
+                self._maybe_submit_analysis(ready)
+            if not self.pyramid_cached and all(
+                summary is not None for summary in self.summaries
+            ):
+                self._emit_pyramid()
+        else:
+            self.analyses[index] = future.result()
+            self._merge_analyses()
+
+    def _maybe_submit_analysis(self, index):
+        # A chunk's last frames overlap the start of the next chunk
+        if index < 0 or index in self.analysis_submitted:
+            return
+        if self.summaries[index] is None:
+            return
+        if index + 1 < len(self.chunks) and self.summaries[index + 1] is None:
+            return
+        self.analysis_submitted.add(index)
+        start, stop = self.chunks[index]
+        self._submit(
+            "analyze",
+            index,
+            analysis_jobs.analyze_chunk,
+            self.shm.name,
+            self.wav.nframes,
+            self.wav.framerate,
+            start,
+            stop,
+        )
+
+    def _emit_cached(self):
+        """Emit whatever is cached; True if nothing is left to compute."""
+        pyramid = self.cache.load(self.pyramid_key)
+        # Emitted once: the chunk jobs do not emit it again
+        self.pyramid_cached = pyramid is not None
+        if pyramid is not None:
+            meta, arrays = pyramid
+            self.result_ready.emit(
+                self.generation,
+                "pyramid",
+                PeakPyramid.from_summaries(
+                    meta["length"],
+                    arrays["mins"],
+                    arrays["maxs"],
+                    arrays["sumsq"],
+                    meta["base_level"],
+                ),
+            )
+
+        analysis = self.cache.load(self.analysis_key)
+        if analysis is None or pyramid is None:
+            return False
+        meta, arrays = analysis
+        self._emit_analysis(
+            Tempo(meta["bpm"], arrays["beats"]),
+            meta["key"],
+            Timeline(arrays["chord_starts"], meta["chord_labels"]),
+        )
+        return True
+
+    def _emit_cached_loudness(self):
+        cached = self.cache.load(self.loudness_key)
+        if cached is None:
+            return False
+        self._emit_loudness(*cached)
+        return True
+
+    def _on_loudness(self, meta, arrays):
+        self.cache.store(self.loudness_key, meta, **arrays)
+        self._emit_loudness(meta, arrays)
+        self.loudness_done = True
+        self._maybe_finish()
+
+    def _emit_loudness(self, meta, arrays):
+        loudness = Loudness(
+            meta["integrated"],
+            meta["loudness_range"],
+            meta["true_peak"],
+            meta["step"],
+            arrays["steps"],
+        )
+        self.result_ready.emit(self.generation, "loudness", loudness)
+
+    def _maybe_finish(self):
+        if self.analysis_done and self.loudness_done:
+            self.finished.emit(self.generation)
+
+    def _emit_analysis(self, tempo, key, chords):
+        self.result_ready.emit(self.generation, "tempo", tempo)
+        self.result_ready.emit(self.generation, "key", key)
+        self.result_ready.emit(self.generation, "chords", chords)
+
+    def _emit_pyramid(self):
+        mins, maxs, sumsq = (np.concatenate(part) for part in zip(*self.summaries))
+        self.cache.store(
+            self.pyramid_key,
+            {
+                "length": self.wav.nframes,
+                "base_level": analysis_jobs.PYRAMID_BASE_LEVEL,
+            },
+            mins=mins,
+            maxs=maxs,
+            sumsq=sumsq,
+        )
+        pyramid = PeakPyramid.from_summaries(
+            self.wav.nframes,
+            mins,
+            maxs,
+            sumsq,
+            analysis_jobs.PYRAMID_BASE_LEVEL,
+        )
+        self.result_ready.emit(self.generation, "pyramid", pyramid)
+
+    def _merge_analyses(self):
+        prefix = self.analyzed_prefix
+        while prefix < len(self.analyses) and self.analyses[prefix] is not None:
+            # Only the new chunks are folded in
+            part = self.analyses[prefix]
+            self.envelopes.append(part["envelope"])
+            self.envelope_frames += len(part["envelope"])
+            self.chroma_parts.append(part["chroma"])
+            self.chroma_sum += part["chroma"].sum(axis=0)
+            self.chroma_frames += len(part["chroma"])
+            self.chords.feed(part["chroma"])
+            prefix += 1
+        if prefix == self.analyzed_prefix:
+            return
+        self.analyzed_prefix = prefix
+        done = prefix == len(self.chunks)
+
+        frame_rate = self.wav.framerate / analysis_jobs.TEMPO_HOP
+        frames = self.envelope_frames
+        if done or frames >= TEMPO_UPDATE_GROWTH * self.tempo_frames:
+            envelope = np.concatenate(self.envelopes)
+            self.envelopes = [envelope]
+            bpm = estimate_tempo(envelope, frame_rate)
+            self.tempo = Tempo(bpm, beat_grid(envelope, frame_rate, bpm))
+            self.tempo_frames = frames
+        # The mean chroma is all estimate_key looks at
+        key, _ = estimate_key(self.chroma_sum[None] / max(1, self.chroma_frames))
+        if done:
+            self.chords.flush()
+        chords = self.chords.timeline()
+        self._emit_analysis(self.tempo, key, chords)
+
+        if done:
+            self._release_shared()
+            envelope = self.envelopes[0]
+            self.cache.store(
+                self.analysis_key,
+                {
+                    "bpm": float(self.tempo.bpm),
+                    "key": key,
+                    "chord_labels": chords.labels,
+                },
+                beats=self.tempo.beats,
+                envelope=envelope,
+                onsets=onset_times(envelope, frame_rate),
+                chroma=np.concatenate(self.chroma_parts),
+                chord_starts=chords.starts,
+            )
+            self.analysis_done = True
+            self._maybe_finish()
+
+    def _release_shared(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def cancel(self):
+        # Results of anything already running are dropped by generation
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        # Workers still running keep their own mapping until they finish
+        self._release_shared()
+
+    def shutdown(self):
+        self.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
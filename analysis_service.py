@@ -0,0 +1,221 @@
+"""Long-running local analysis service on a Unix socket.
+
+    python analysis_service.py [--socket PATH] [-j WORKERS]
+
+Tools talk to it through analysis_client instead of importing scipy and
+analyzing files themselves. Requests run on a process pool whose workers
+are started and warmed up front, results are kept in the shared analysis
+cache, and identical requests that arrive while one is being computed wait
+for that one instead of starting their own. See service_protocol for the
+wire format.
+"""
+
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import analysis_jobs
+from analysis_cache import artifact_key, default_cache, file_fingerprint
+from loudness import STEP_SECONDS
+from tempo import MAX_BPM, MIN_BPM, PRIOR_BPM
+from service_protocol import DEFAULT_SOCKET, read_message, write_message
+from telemetry import telemetry
+
+# op: (job, cache kind, parameters with their defaults)
+OPS = {
+    "spectrogram": (
+        analysis_jobs.file_spectrogram,
+        "spectrogram",
+        {
+            "n_fft": analysis_jobs.SPECTROGRAM_N_FFT,
+            "hop": analysis_jobs.SPECTROGRAM_HOP,
+            "scale": "keys",
+        },
+    ),
+    # Every estimator setting is in the key, so changing a default is a miss
+    "tempo": (
+        analysis_jobs.file_tempo,
+        "tempo",
+        {
+            "n_fft": analysis_jobs.TEMPO_N_FFT,
+            "hop": analysis_jobs.TEMPO_HOP,
+            "min_bpm": MIN_BPM,
+            "max_bpm": MAX_BPM,
+            "prior_bpm": PRIOR_BPM,
+        },
+    ),
+    "notes": (analysis_jobs.file_notes, "notes", {}),
+    # Keyed like the GUI's analysis scheduler, so either fills it for both
+    "loudness": (
+        analysis_jobs.file_loudness,
+        "loudness",
+        {"step_seconds": STEP_SECONDS},
+    ),
+}
+
+
+class AnalysisService:
+    def __init__(self, max_workers=None, cache=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache = cache or default_cache()
+        # Spawned like the GUI's pool; every worker imports scipy on start
+        self.pool = ProcessPoolExecutor(
+            self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=analysis_jobs.warm_up,
+        )
+        # The cache's SQLite connection is only ever used from this thread
+        self.io = ThreadPoolExecutor(1)
+        self.inflight = {}  # Cache key -> task computing it
+
+    async def warm_up(self):
+        # One job per worker makes the pool start all of them now
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self.pool, analysis_jobs.warm_up)
+                for _ in range(self.max_workers)
+            )
+        )
+
+    async def handle(self, request):
+        """(meta, arrays) answering one request header."""
+        op = request.get("op")
+        if op == "ping":
+            return {}, {}
+        if op == "stats":
+            snapshot = telemetry.snapshot()
+            snapshot["inflight"] = len(self.inflight)
+            snapshot["workers"] = self.max_workers
+            return snapshot, {}
+        if op not in OPS:
+            raise ValueError(f"Unknown op: {op}")
+        job, kind, defaults = OPS[op]
+        params = dict(defaults)
+        for name, value in request.get("params", {}).items():
+            if name not in defaults:
+                raise ValueError(f"Unknown parameter for {op}: {name}")
+            params[name] = type(defaults[name])(value)
+
+        loop = asyncio.get_running_loop()
+        fingerprint = await loop.run_in_executor(
+            None, file_fingerprint, request["path"]
+        )
+        key = artifact_key(fingerprint, kind, **params)
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._compute(key, job, request["path"], params)
+            )
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            telemetry.count("service.coalesced")
+        # Shielded, so a client hanging up does not cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, job, path, params):
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(self.io, self.cache.load, key)
+        if cached is not None:
+            telemetry.count("service.cache_hit")
+            return cached
+        telemetry.count("service.computed")
+        with telemetry.timer(f"service.job.{job.__name__}"):
+            meta, arrays = await loop.run_in_executor(
+                self.pool, functools.partial(job, path, **params)
+            )
+        await loop.run_in_executor(
+            self.io, functools.partial(self.cache.store, key, meta, **arrays)
+        )
+        return meta, arrays
+
+    async def serve_client(self, reader, writer):
+        # Each connection sends requests one after another and reads the
+        # response to each before the next
+        try:
+            while True:
+                try:
+                    request, _ = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                started = time.perf_counter()
+                telemetry.count("service.requests")
+                try:
+                    meta, arrays = await self.handle(request)
+                    response = {"ok": True, "meta": meta}
+                except Exception as e:
+                    telemetry.count("service.errors")
+                    meta, arrays = {}, {}
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                await write_message(writer, response, arrays)
+                telemetry.record(
+                    f"service.{request.get('op')}", time.perf_counter() - started
+                )
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.io.shutdown(wait=False)
+
+
+def _claim_socket(path):
+    """Remove a stale socket file; fail if a service is still listening on it."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise RuntimeError(f"an analysis service is already listening on {path}")
+    finally:
+        probe.close()
+
+
+async def serve(path=DEFAULT_SOCKET, max_workers=None):
+    _claim_socket(path)
+    service = AnalysisService(max_workers)
+    server = await asyncio.start_unix_server(service.serve_client, path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        started = time.perf_counter()
+        await service.warm_up()
+        print(
+            f"Listening on {path} with {service.max_workers} workers "
+            f"(warm after {time.perf_counter() - started:.1f} s)",
+            file=sys.stderr,
+        )
+        await stop.wait()
+    finally:
+        server.close()
+        service.shutdown()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.socket, args.workers))
+
+
+if __name__ == "__main__":
+    main()
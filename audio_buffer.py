@@ -0,0 +1,83 @@
+import numpy as np
+
+from wav_file import PlanarView
+
+
+class AudioBuffer:
+    """Decoded audio as a planar (channels, frames) float32 array.
+
+    Each channel is a contiguous row, so per-channel access is a view.
+    Positions and lengths are in frames throughout. A buffer opened with
+    open() converts from the file on every access instead; its `data` can
+    be swapped for a decoded copy later, e.g. once one is ready in memory.
+    """
+
+    def __init__(self, data, framerate):
+        self.data = data
+        self.framerate = framerate
+
+    @classmethod
+    def open(cls, wav):
+        """A buffer reading a WavFile's memory map, converting per access.
+
+        Instant and holds no samples, whatever the size of the file.
+        """
+        return cls(PlanarView(wav), wav.framerate)
+
+    @classmethod
+    def in_memory(cls, wav):
+        """Decode a whole WavFile into memory.
+
+        For buffers that must not page in from disk when first used, such as
+        the tracks a session preloads.
+        """
+        return cls(wav.decode(0, wav.nframes), wav.framerate)
+
+    @property
+    def lazy(self):
+        return isinstance(self.data, PlanarView)
+
+    @property
+    def nchannels(self):
+        return self.data.shape[0]
+
+    @property
+    def nframes(self):
+        return self.data.shape[1]
+
+    def __len__(self):
+        return self.nframes
+
+    def channel(self, index):
+        return self.data[index]
+
+    def mono(self, start=0, stop=None, out=None):
+        """Channel average over [start, stop), written into `out` if given."""
+        window = self.data[:, start:stop]
+        if self.nchannels == 1:
+            if out is None:
+                return window[0]
+            out[...] = window[0]
+            return out
+        return np.mean(window, axis=0, out=out)
+
+    def mid(self, start=0, stop=None, out=None):
+        """(L + R) / 2 over [start, stop); the channel itself for mono."""
+        if self.nchannels == 1:
+            return self.mono(start, stop, out)
+        return self._sum_halves(np.add, start, stop, out)
+
+    def side(self, start=0, stop=None, out=None):
+        """(L - R) / 2 over [start, stop); silence for mono."""
+        if self.nchannels == 1:
+            window = self.data[0, start:stop]
+            if out is None:
+                return np.zeros_like(window)
+            out[...] = 0
+            return out
+        return self._sum_halves(np.subtract, start, stop, out)
+
+    def _sum_halves(self, ufunc, start, stop, out):
+        out = ufunc(self.data[0, start:stop], self.data[1, start:stop], out=out)
+        out *= np.float32(0.5)
+        return out
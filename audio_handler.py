@@ -1,21 +1,29 @@
-import pyaudio
-import wave
-import threading
-import numpy as np
-
 from PySide6.QtCore import QObject, Signal
 
+from audio_buffer import AudioBuffer
+from playback_engine import PlaybackEngine
+from wav_file import WavFile
+
 
 class AudioHandler(QObject):
     playback_position_changed = Signal(int)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, frames_per_buffer=1024):
         super().__init__(parent)
         self.audio_file = None
-        self.is_playing = False
-        self.play_thread = None
+        self.wav = None
         self.waveform = None
-        self.current_position = 0
+        # Larger buffers trade latency for more headroom against underruns
+        self.engine = PlaybackEngine(frames_per_buffer)
+
+    @property
+    def is_playing(self):
+        return self.engine.playing
+
+    @property
+    def current_position(self):
+        # What is being heard, not how far the audio callback has read
+        return self.engine.playback_position()
 
     def load_file(self, file_path):
         self.audio_file = file_path
@@ -23,58 +31,47 @@ class AudioHandler(QObject):
 
     def load_waveform(self):
         if self.audio_file:
-            with wave.open(self.audio_file, "rb") as wf:
-                self.waveform = np.frombuffer(
-                    wf.readframes(wf.getnframes()), dtype=np.int16
-                )
-                self.waveform = (
-                    self.waveform.astype(np.float32) / 32768.0
-                )  # Normalize to [-1, 1]
+            # Read straight from the file's memory map and converted per
+            # window, so opening takes no time; positions are in frames
+            wav = WavFile(self.audio_file)
+            self.load_buffer(wav, AudioBuffer.open(wav))
+
+    def load_buffer(self, wav, waveform):
+        """Play `waveform`, an AudioBuffer of `wav`, e.g. from a session."""
+        self.audio_file = wav.path
+        self.wav = wav
+        self.waveform = waveform
+        self.engine.load(waveform.data, wav.framerate)
+
+    def refresh_waveform(self):
+        """Play from the waveform's data again, once it was swapped for a copy."""
+        if self.waveform is not None:
+            self.engine.replace_samples(self.waveform.data)
 
     def get_current_position(self):
         return self.current_position
 
     def play(self):
-        if not self.audio_file or self.is_playing:
+        if not self.audio_file:
             return
+        self.engine.play()
 
-        self.is_playing = True
-        self.play_thread = threading.Thread(target=self._play_audio_thread)
-        self.play_thread.start()
-
-    def _play_audio_thread(self):
-        chunk = 1024
-        wf = wave.open(self.audio_file, "rb")
-        p = pyaudio.PyAudio()
-
-        stream = p.open(
-            format=p.get_format_from_width(wf.getsampwidth()),
-            channels=wf.getnchannels(),
-            rate=wf.getframerate(),
-            output=True,
-        )
+    def seek(self, position):
+        if self.audio_file:
+            self.engine.seek(position)
+            self.playback_position_changed.emit(position)
 
-        data = wf.readframes(chunk)
+    def stop(self):
+        self.engine.stop()
 
-        while data and self.is_playing:
-            stream.write(data)
-            data = wf.readframes(chunk)
-            self.current_position += chunk
-            self.playback_position_changed.emit(self.current_position)
+    def set_speed(self, speed):
+        self.engine.set_speed(speed)
 
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        self.is_playing = False
+    def set_loop(self, start, stop):
+        self.engine.set_loop(start, stop)
 
-    def seek(self, position):
-        if self.audio_file:
-            with wave.open(self.audio_file, "rb") as wf:
-                wf.setpos(position)
-            self.current_position = position
-            self.playback_position_changed.emit(self.current_position)
+    def clear_loop(self):
+        self.engine.clear_loop()
 
-    def stop(self):
-        self.is_playing = False
-        if self.play_thread:
-            self.play_thread.join()
+    def close(self):
+        self.engine.close()
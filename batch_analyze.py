@@ -0,0 +1,354 @@
+"""Headless batch analysis of every WAV file under a directory.
+
+    python batch_analyze.py MUSIC_DIR -o results.jsonl [-j WORKERS]
+
+Files are analyzed on a process pool and one record per file is appended to
+the output (JSON Lines, or CSV when the output ends in .csv) as soon as it
+is done. Rerunning with the same output skips files already recorded there,
+so an interrupted run picks up where it stopped; files that failed are
+retried, and their earlier error records are dropped from the output first,
+so it ends up with one record per file. A worker that dies takes the files
+in flight with it: they are recorded as failed and the run goes on with a
+new pool. Tempo and loudness are shared with the analysis cache: whatever
+the GUI or the analysis service already stored for a file is reused, and
+what is computed here is stored for them.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+FIELDS = [
+    "path",
+    "duration",
+    "sample_rate",
+    "channels",
+    "bpm",
+    "key",
+    "dominant_notes",
+    "loudness",
+    "loudness_range",
+    "true_peak",
+    "error",
+]
+READ_FRAMES = 1 << 20
+NOTE_FFT = 16384  # At the analysis rate, 0.67 Hz bins: A0 and A#0 resolve
+
+
+def find_wav_files(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".wav"):
+                yield os.path.join(root, name)
+
+
+def _cached_bpm(cache, fingerprint, tempo_params):
+    # The service's tempo artifact, else the GUI's whole-file analysis, which
+    # runs the same estimator over the same onset envelope
+    from analysis_cache import artifact_key
+    from analysis_jobs import CHROMA_HOP, CHROMA_N_FFT, TEMPO_HOP, TEMPO_N_FFT
+
+    for key in (
+        artifact_key(fingerprint, "tempo", **tempo_params),
+        artifact_key(
+            fingerprint,
+            "analysis",
+            tempo=[TEMPO_N_FFT, TEMPO_HOP],
+            chroma=[CHROMA_N_FFT, CHROMA_HOP],
+        ),
+    ):
+        cached = cache.load(key)
+        if cached is not None:
+            return cached[0]["bpm"]
+    return None
+
+
+def analyze_file(path, cache=None):
+    """Tempo, key, dominant notes and loudness of one file, read in bounded chunks.
+
+    Tempo and loudness come from `cache` (the default analysis cache if not
+    given) when it has them, and are stored there when it does not.
+    """
+    from analysis_cache import artifact_key, default_cache, file_fingerprint
+    from analysis_jobs import TEMPO_HOP, TEMPO_N_FFT
+    from chroma import ChromaExtractor, estimate_key
+    from decimate import Decimator
+    from loudness import STEP_SECONDS, LoudnessMeter
+    from notes import find_dominant_notes, generate_piano_frequencies
+    from stft import STFT, StreamingSTFT
+    from tempo import MAX_BPM, MIN_BPM, PRIOR_BPM, TempoEstimator
+    from wav_file import WavFile
+
+    wav = WavFile(path)
+    cache = cache or default_cache()
+    fingerprint = file_fingerprint(path)
+    # Keyed exactly like the analysis service's "tempo" and "loudness" ops
+    tempo_params = {
+        "n_fft": TEMPO_N_FFT,
+        "hop": TEMPO_HOP,
+        "min_bpm": MIN_BPM,
+        "max_bpm": MAX_BPM,
+        "prior_bpm": PRIOR_BPM,
+    }
+    loudness_key = artifact_key(fingerprint, "loudness", step_seconds=STEP_SECONDS)
+
+    bpm = _cached_bpm(cache, fingerprint, tempo_params)
+    tempo = None if bpm is not None else TempoEstimator(wav.framerate, **tempo_params)
+    cached_loudness = cache.load(loudness_key)
+    loudness = None
+    if cached_loudness is None:
+        loudness = LoudnessMeter(wav.framerate, wav.nchannels, STEP_SECONDS)
+        loudness_steps = []
+    # Pitch analysis only needs the piano range, so it runs on a decimated
+    # stream where long windows are cheap; onsets keep the full rate
+    decimator = Decimator(wav.framerate)
+    chroma = ChromaExtractor(decimator.rate)
+    # Long-window spectrum averaged over the whole file
+    spectrum = StreamingSTFT(STFT(NOTE_FFT))
+    magnitude_sum = np.zeros(spectrum.stft.n_bins)
+
+    def feed_pitch(low):
+        nonlocal magnitude_sum
+        chroma.feed(low)
+        magnitude_sum += spectrum.feed(low).sum(axis=0)
+
+    for start in range(0, wav.nframes, READ_FRAMES):
+        planar = wav.decode(start, start + READ_FRAMES)
+        if loudness is not None:
+            loudness_steps.append(loudness.feed(planar))
+        mono = planar.mean(axis=0)
+        if tempo is not None:
+            tempo.feed(mono)
+        feed_pitch(decimator.feed(mono))
+    feed_pitch(decimator.flush())
+
+    if tempo is not None:
+        result = tempo.result()
+        bpm = float(result.bpm)
+        cache.store(
+            artifact_key(fingerprint, "tempo", **tempo_params),
+            {"bpm": bpm},
+            beats=result.beats,
+            envelope=tempo.envelope,
+        )
+    if loudness is not None:
+        loudness_steps.append(loudness.flush())
+        result = loudness.result(np.concatenate(loudness_steps))
+        loudness_meta = {
+            "integrated": result.integrated,
+            "loudness_range": result.loudness_range,
+            "true_peak": result.true_peak,
+            "step": result.step,
+        }
+        cache.store(loudness_key, loudness_meta, steps=result.steps)
+    else:
+        loudness_meta = cached_loudness[0]
+
+    key, _ = estimate_key(chroma.frames)
+    notes = []
+    if magnitude_sum.any():
+        freqs = spectrum.stft.frequencies(decimator.rate)
+        notes = find_dominant_notes(freqs, magnitude_sum, generate_piano_frequencies())
+    return {
+        "path": path,
+        "duration": wav.nframes / wav.framerate,
+        "sample_rate": wav.framerate,
+        "channels": wav.nchannels,
+        "bpm": round(bpm, 2),
+        "key": key,
+        "dominant_notes": notes,
+        "loudness": round(loudness_meta["integrated"], 2),
+        "loudness_range": round(loudness_meta["loudness_range"], 2),
+        "true_peak": round(loudness_meta["true_peak"], 2),
+    }
+
+
+def _analyze_or_report(path):
+    try:
+        return analyze_file(path)
+    except Exception as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}"}
+
+
+def _result_or_report(future, path):
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}"}
+
+
+def _pool(workers):
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class JsonLinesWriter:
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.file, FIELDS, extrasaction="ignore")
+        if new:
+            self.writer.writeheader()
+
+    def write(self, record):
+        row = dict(record)
+        row["dominant_notes"] = " ".join(record.get("dominant_notes", []))
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(output, is_csv):
+    """The records an earlier run wrote to `output`, in order."""
+    if not os.path.exists(output):
+        return []
+    with open(output, encoding="utf-8", newline="") as f:
+        if is_csv:
+            return list(csv.DictReader(f))
+        # A run killed mid-write can leave a truncated last line
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+        return records
+
+
+def rewrite_records(output, records, is_csv):
+    """Replace `output` with `records`, atomically."""
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        if is_csv:
+            # Rows as read back, so dominant_notes is already joined
+            writer = csv.DictWriter(f, FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+    os.replace(tmp, output)
+
+
+class Throughput:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.files = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+
+    def add(self, record):
+        self.files += 1
+        if record.get("error"):
+            self.failed += 1
+        self.audio_seconds += record.get("duration", 0.0)
+
+    def summary(self, remaining):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.files} done, {self.failed} failed, {remaining} left | "
+            f"{self.files / elapsed:.2f} files/s, "
+            f"{self.audio_seconds / 3600 / elapsed:.4f} audio-hours/s"
+        )
+
+    def maybe_report(self, remaining):
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(self.summary(remaining), file=sys.stderr)
+
+
+def run(directory, output, workers=None, output_format=None):
+    is_csv = (output_format or os.path.splitext(output)[1].lstrip(".")) == "csv"
+    records = read_records(output, is_csv)
+    done = {r["path"] for r in records if not r.get("error")}
+    pending = [p for p in find_wav_files(directory) if p not in done]
+    # Failed files are retried; drop their old error records, and any left
+    # next to a success by an older run, so the output keeps a single, final
+    # record per file
+    superseded = done.union(pending)
+    kept = [r for r in records if not (r.get("error") and r["path"] in superseded)]
+    if len(kept) < len(records):
+        rewrite_records(output, kept, is_csv)
+    print(
+        f"{len(pending)} files to analyze ({len(done)} already in {output})",
+        file=sys.stderr,
+    )
+
+    writer = CsvWriter(output) if is_csv else JsonLinesWriter(output)
+    stats = Throughput()
+    # Keep a bounded number of files in flight so huge libraries do not
+    # queue thousands of futures up front
+    workers = workers or os.cpu_count() or 1
+    paths = iter(pending)
+    in_flight = {}  # Future -> path
+    executor = _pool(workers)
+    try:
+        while True:
+            while len(in_flight) < 2 * workers:
+                path = next(paths, None)
+                if path is None:
+                    break
+                in_flight[executor.submit(_analyze_or_report, path)] = path
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            if any(isinstance(f.exception(), BrokenProcessPool) for f in finished):
+                # A worker died (out of memory, a crash in native code) and
+                # took the pool with it. Which file did is unknown, so every
+                # file in flight is recorded as failed, for the next run to
+                # retry, and the rest go to a new pool
+                print("A worker died; restarting the pool", file=sys.stderr)
+                finished, _ = wait(in_flight)
+                executor.shutdown(wait=False)
+                executor = _pool(workers)
+            for future in finished:
+                record = _result_or_report(future, in_flight.pop(future))
+                writer.write(record)
+                stats.add(record)
+            stats.maybe_report(len(pending) - stats.files)
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    print(stats.summary(len(pending) - stats.files), file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", default="analysis.jsonl")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None)
+    args = parser.parse_args(argv)
+    stats = run(args.directory, args.output, args.workers, args.format)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
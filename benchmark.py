@@ -0,0 +1,346 @@
+"""Benchmarks for the hot paths, run against synthetic audio fixtures.
+
+    python benchmark.py [-o results.json] [--durations 10,60,600,3600]
+                        [--compare baseline.json]
+
+Fixtures are deterministic WAVs (a sine chord, white noise and a click
+track; mono and stereo) generated once into --fixtures and reused. Each
+benchmark is repeated until it has run for a while and its min, median and
+mean times are written to a JSON file along with the commit they were
+measured at. --compare prints the ratio against an earlier results file.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+KINDS = ["chord", "noise", "clicks"]
+CHORD_FREQS = [261.63, 329.63, 392.00]  # C major
+CLICK_INTERVAL = 0.5  # seconds, i.e. 120 BPM
+BLOCK_SECONDS = 10
+ZOOM_LEVELS = [1, 32, 1024]
+WIDGET_SIZE = (1200, 200)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _fixture_block(kind, start, n, rng):
+    t = (start + np.arange(n)) / SAMPLE_RATE
+    if kind == "chord":
+        return sum(np.sin(2 * np.pi * f * t) for f in CHORD_FREQS) * 0.25
+    if kind == "noise":
+        return np.clip(rng.normal(0, 0.2, n), -1, 1)
+    if kind == "clicks":
+        since_click = t % CLICK_INTERVAL
+        return 0.8 * np.exp(-since_click * 400) * np.sin(2 * np.pi * 1000 * t)
+    raise ValueError(f"Unknown fixture kind: {kind}")
+
+
+def make_fixture(path, kind, seconds, channels, seed=0):
+    """Write a deterministic 16-bit WAV, streaming it in 10 s blocks."""
+    total = int(seconds * SAMPLE_RATE)
+    block = BLOCK_SECONDS * SAMPLE_RATE
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        for start in range(0, total, block):
+            n = min(block, total - start)
+            rng = np.random.default_rng([seed, start // block])
+            mono = _fixture_block(kind, start, n, rng)
+            # Slightly different right channel so stereo is not a copy
+            frames = np.stack([mono * (1 - 0.2 * c) for c in range(channels)], 1)
+            wf.writeframes((frames * 32767).astype(np.int16).tobytes())
+
+
+def fixture(directory, kind, seconds, channels):
+    name = f"{kind}-{seconds}s-{'stereo' if channels == 2 else 'mono'}.wav"
+    path = os.path.join(directory, name)
+    expected_size = 44 + int(seconds * SAMPLE_RATE) * channels * 2
+    if not os.path.exists(path) or os.path.getsize(path) != expected_size:
+        make_fixture(path, kind, seconds, channels)
+    return path
+
+
+def measure(fn, min_time=0.5, min_repeat=5, max_repeat=200):
+    """Per-call durations of fn() after one warm-up call."""
+    fn()
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_repeat and (
+        len(times) < min_repeat or time.perf_counter() - started < min_time
+    ):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def _result(name, params, times):
+    return {
+        "name": name,
+        "params": params,
+        "repeats": len(times),
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+
+
+def _skipped(name, error):
+    return {"name": name, "skipped": f"{type(error).__name__}: {error}"}
+
+
+def bench_load_waveform(fixtures, durations):
+    try:
+        from audio_handler import AudioHandler
+
+        handler = AudioHandler()
+    except Exception as e:
+        # Needs pyaudio and an output device
+        return [_skipped("load_waveform", e)]
+    results = []
+    for seconds in durations:
+        for channels in (1, 2):
+            handler.audio_file = fixture(fixtures, "chord", seconds, channels)
+            times = measure(handler.load_waveform)
+            params = {"seconds": seconds, "channels": channels}
+            results.append(_result("load_waveform", params, times))
+    handler.close()
+    return results
+
+
+def bench_paint(fixtures, durations):
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PySide6.QtGui import QImage
+        from PySide6.QtWidgets import QApplication
+
+        from audio_buffer import AudioBuffer
+        from peak_pyramid import PeakPyramid
+        from waveform_widget import WaveformWidget
+        from wav_file import WavFile
+    except ImportError as e:
+        return [_skipped("paint", e)]
+
+    app = QApplication.instance() or QApplication([])
+    widget = WaveformWidget()
+    widget.resize(*WIDGET_SIZE)
+    image = QImage(*WIDGET_SIZE, QImage.Format_ARGB32_Premultiplied)
+    results = []
+    for seconds in durations:
+        wav = WavFile(fixture(fixtures, "chord", seconds, 2))
+        # Decoded up front, so that only drawing is timed
+        samples = np.asarray(AudioBuffer.open(wav).data)
+        widget.set_waveform(samples, PeakPyramid(samples))
+        for zoom in ZOOM_LEVELS:
+            widget.set_horizontal_zoom(zoom)
+            widget.set_scroll(widget.get_max_scroll() // 2)
+            times = measure(lambda: widget.render(image))
+            params = {"seconds": seconds, "zoom": zoom}
+            results.append(_result("paint", params, times))
+    app.processEvents()
+    return results
+
+
+def bench_frame(fixtures):
+    """Per-frame work of the play_wave view, on 100 ms segments of each kind."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from filters import rc_high_pass_filter
+    from notes import calculate_fft, find_dominant_notes, generate_piano_frequencies
+    from play_wave import create_plot, read_mono
+
+    piano_freqs = generate_piano_frequencies()
+    segment_len = SAMPLE_RATE // 10
+    results = []
+    for kind in KINDS:
+        path = fixture(fixtures, kind, 10, 2)
+        mono_samples, _, framerate = read_mono(path)
+        # Walk through the file so every call sees a different segment
+        positions = itertools.cycle(
+            range(0, len(mono_samples) - segment_len, segment_len)
+        )
+
+        def segment():
+            start = next(positions)
+            return mono_samples[start : start + segment_len]
+
+        freqs, magnitudes = calculate_fft(segment(), framerate)
+        params = {"kind": kind, "segment": segment_len}
+        cases = [
+            ("calculate_fft", lambda: calculate_fft(segment(), framerate)),
+            (
+                "find_dominant_notes",
+                lambda: find_dominant_notes(freqs, magnitudes, piano_freqs),
+            ),
+            (
+                "rc_high_pass_filter",
+                lambda: rc_high_pass_filter(segment(), 1000, framerate),
+            ),
+        ]
+        for name, fn in cases:
+            results.append(_result(name, params, measure(fn)))
+
+        position = [0]
+        fig, update_plot, close_plot = create_plot(
+            path, mono_samples, framerate, lambda: position[0]
+        )
+
+        def frame():
+            position[0] = next(positions)
+            update_plot(0)
+
+        results.append(_result("update_plot", params, measure(frame)))
+        close_plot()
+        plt.close(fig)
+    return results
+
+
+def bench_transcribe(fixtures, durations):
+    """Whole-file transcription; realtime is audio seconds per second taken."""
+    from transcribe import transcribe
+
+    results = []
+    for seconds in durations:
+        path = fixture(fixtures, "chord", seconds, 2)
+        times = measure(lambda: transcribe(path), min_time=0, min_repeat=3)
+        result = _result("transcribe", {"seconds": seconds}, times)
+        result["realtime"] = seconds / result["median"]
+        results.append(result)
+    return results
+
+
+def bench_decimate(fixtures, durations):
+    """Whole-file decimation to the analysis rate."""
+    from decimate import decimate
+    from wav_file import WavFile
+
+    results = []
+    for seconds in durations:
+        wav = WavFile(fixture(fixtures, "chord", seconds, 2))
+        mono = wav.read_mono(0, wav.nframes)
+        times = measure(lambda: decimate(mono, wav.framerate), min_time=0)
+        result = _result("decimate", {"seconds": seconds}, times)
+        result["realtime"] = seconds / result["median"]
+        results.append(result)
+    return results
+
+
+def bench_loudness(fixtures, durations):
+    """Whole-file loudness, RMS and true-peak, streamed from disk."""
+    from loudness import measure_file
+
+    results = []
+    for seconds in durations:
+        path = fixture(fixtures, "chord", seconds, 2)
+        times = measure(lambda: measure_file(path), min_time=0)
+        result = _result("loudness", {"seconds": seconds}, times)
+        result["realtime"] = seconds / result["median"]
+        results.append(result)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(fixtures, durations):
+    os.makedirs(fixtures, exist_ok=True)
+    results = []
+    for bench in (
+        lambda: bench_load_waveform(fixtures, durations),
+        lambda: bench_paint(fixtures, durations),
+        lambda: bench_frame(fixtures),
+        lambda: bench_transcribe(fixtures, durations),
+        lambda: bench_decimate(fixtures, durations),
+        lambda: bench_loudness(fixtures, durations),
+    ):
+        for result in bench():
+            results.append(result)
+            print(_format(result), file=sys.stderr)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+
+
+def _label(result):
+    params = ", ".join(f"{k}={v}" for k, v in result.get("params", {}).items())
+    return f"{result['name']}({params})"
+
+
+def _format(result):
+    if "skipped" in result:
+        return f"{_label(result):50} skipped: {result['skipped']}"
+    return (
+        f"{_label(result):50} min {result['min'] * 1e3:9.3f} ms  "
+        f"median {result['median'] * 1e3:9.3f} ms  ({result['repeats']} runs)"
+    )
+
+
+def compare(baseline, current):
+    """Print median time ratios (current / baseline) for matching benchmarks."""
+    before = {_label(r): r for r in baseline["results"] if "median" in r}
+    print(f"Compared with {baseline.get('commit')}:")
+    for result in current["results"]:
+        old = before.get(_label(result))
+        if old is None or "median" not in result:
+            continue
+        ratio = result["median"] / old["median"]
+        flag = "  SLOWER" if ratio > 1.1 else "  faster" if ratio < 0.9 else ""
+        print(f"{_label(result):50} {ratio:6.2f}x{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--durations",
+        default="10,60,600",
+        help="comma-separated fixture lengths in seconds, e.g. 10,60,600,3600",
+    )
+    parser.add_argument(
+        "--fixtures", default=os.path.join(tempfile.gettempdir(), "music2-bench")
+    )
+    parser.add_argument("--compare", metavar="BASELINE")
+    args = parser.parse_args(argv)
+
+    durations = [int(d) for d in args.durations.split(",")]
+    results = run(args.fixtures, durations)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+from functools import lru_cache
+
+import numpy as np
+
+from piano_filterbank import NUM_KEYS, get_filterbank
+from stft import STFT, StreamingSTFT
+
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+)
+MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+)
+
+SILENCE = "N"
+
+
+def _rotations(profile):
+    return np.stack([np.roll(profile, tonic) for tonic in range(12)])
+
+
+def _zscore(rows):
+    rows = rows - rows.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(rows, axis=-1, keepdims=True)
+    return rows / np.maximum(norm, 1e-12)
+
+
+KEY_NAMES = [f"{pc} major" for pc in PITCH_CLASSES] + [
+    f"{pc} minor" for pc in PITCH_CLASSES
+]
+KEY_PROFILES = _zscore(
+    np.concatenate([_rotations(MAJOR_PROFILE), _rotations(MINOR_PROFILE)])
+)
+
+CHORD_NAMES = PITCH_CLASSES + [f"{pc}m" for pc in PITCH_CLASSES]
+_major_triad = np.zeros(12)
+_major_triad[[0, 4, 7]] = 1
+_minor_triad = np.zeros(12)
+_minor_triad[[0, 3, 7]] = 1
+CHORD_TEMPLATES = _zscore(
+    np.concatenate([_rotations(_major_triad), _rotations(_minor_triad)])
+)
+
+
+@lru_cache(maxsize=16)
+def get_chroma_matrix(sample_rate, n_fft):
+    """Sparse (12 x n_bins) matrix folding rfft bins onto pitch classes."""
+    from scipy.sparse import csr_matrix
+
+    pitch_class = (np.arange(NUM_KEYS) + 9) % 12  # Key 0 is A0
+    fold = csr_matrix(
+        (np.ones(NUM_KEYS), (pitch_class, np.arange(NUM_KEYS))), shape=(12, NUM_KEYS)
+    )
+    return (fold @ get_filterbank(sample_rate, n_fft).matrix).tocsr()
+
+
+def chroma(spectrogram, sample_rate, n_fft, silence=1e-3):
+    """(n_frames, 12) chroma of a magnitude spectrogram, each frame max-normalized.
+
+    Frames whose strongest pitch class is below `silence` are left at zero.
+    """
+    spectrogram = np.asarray(spectrogram)
+    frames = np.asarray(get_chroma_matrix(sample_rate, n_fft) @ spectrogram.T).T
+    peak = frames.max(axis=1, keepdims=True) if len(frames) else frames[:, :1]
+    return np.where(peak > silence, frames / np.maximum(peak, 1e-12), 0).astype(
+        np.float32
+    )
+
+
+def estimate_key(chroma_frames):
+    """Best matching key name and its profile correlation in [-1, 1]."""
+    if len(chroma_frames) == 0 or not np.any(chroma_frames):
+        return None, 0.0
+    scores = KEY_PROFILES @ _zscore(chroma_frames.mean(axis=0))
+    best = int(np.argmax(scores))
+    return KEY_NAMES[best], float(scores[best])
+
+
+class Timeline:
+    """Labels over consecutive segments, queryable by sample position."""
+
+    def __init__(self, starts, labels):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.labels = list(labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def at(self, position):
+        index = int(np.searchsorted(self.starts, position, side="right")) - 1
+        return self.labels[index] if index >= 0 else None
+
+
+def _segment_means(chroma_frames, segment_frames):
+    starts = np.arange(0, len(chroma_frames), segment_frames)
+    sums = np.add.reduceat(chroma_frames, starts, axis=0)
+    counts = np.diff(np.append(starts, len(chroma_frames)))
+    return starts, sums / counts[:, None]
+
+
+def _timeline(starts, labels, hop):
+    # Merge runs of identical labels into single segments
+    keep = [0] + [i for i in range(1, len(labels)) if labels[i] != labels[i - 1]]
+    return Timeline(starts[keep] * hop, [labels[i] for i in keep])
+
+
+def chord_timeline(chroma_frames, hop, segment_frames=4):
+    """Major/minor triad per segment of `segment_frames` chroma frames."""
+    if len(chroma_frames) == 0:
+        return Timeline([], [])
+    starts, means = _segment_means(chroma_frames, segment_frames)
+    best = np.argmax(_zscore(means) @ CHORD_TEMPLATES.T, axis=1)
+    silent = ~np.any(means > 0, axis=1)
+    labels = [SILENCE if s else CHORD_NAMES[b] for b, s in zip(best, silent)]
+    return _timeline(starts, labels, hop)
+
+
+class ChordTracker:
+    """chord_timeline over chroma frames fed in consecutive chunks.
+
+    Whole segments are labeled as they arrive and never revisited, so each
+    feed costs only its own frames and the timeline matches chord_timeline
+    over everything fed once flush() has labeled the last partial segment.
+    """
+
+    def __init__(self, hop, segment_frames=4):
+        self.hop = hop
+        self.segment_frames = segment_frames
+        self.starts = []
+        self.labels = []
+        self._pending = np.zeros((0, 12), np.float32)
+        self._offset = 0  # Chroma frame index of the first pending frame
+
+    def feed(self, chroma_frames):
+        frames = np.concatenate([self._pending, chroma_frames])
+        whole = len(frames) // self.segment_frames * self.segment_frames
+        self._add(frames[:whole])
+        self._pending = frames[whole:]
+
+    def flush(self):
+        self._add(self._pending)
+        self._pending = self._pending[:0]
+
+    def _add(self, frames):
+        if not len(frames):
+            return
+        part = chord_timeline(frames, self.hop, self.segment_frames)
+        for start, label in zip(part.starts, part.labels):
+            # Runs of one label stay a single segment across feeds
+            if not self.labels or label != self.labels[-1]:
+                self.starts.append(int(start) + self._offset * self.hop)
+                self.labels.append(label)
+        self._offset += len(frames)
+
+    def timeline(self):
+        return Timeline(self.starts, self.labels)
+
+
+def key_timeline(chroma_frames, hop, segment_frames=128):
+    """Local key per segment of `segment_frames` chroma frames."""
+    if len(chroma_frames) == 0:
+        return Timeline([], [])
+    starts, means = _segment_means(chroma_frames, segment_frames)
+    best = np.argmax(_zscore(means) @ KEY_PROFILES.T, axis=1)
+    silent = ~np.any(means > 0, axis=1)
+    labels = [SILENCE if s else KEY_NAMES[b] for b, s in zip(best, silent)]
+    return _timeline(starts, labels, hop)
+
+
+class ChromaExtractor:
+    """Incremental chroma over a mono signal fed in consecutive chunks."""
+
+    def __init__(self, sample_rate, n_fft=8192, hop=2048):
+        self.sample_rate = sample_rate
+        self.stft = StreamingSTFT(STFT(n_fft, hop))
+        self._frames = []
+
+    @property
+    def hop(self):
+        return self.stft.stft.hop
+
+    @property
+    def frames(self):
+        if len(self._frames) > 1:
+            self._frames = [np.concatenate(self._frames)]
+        return self._frames[0] if self._frames else np.zeros((0, 12), np.float32)
+
+    def feed(self, samples):
+        spectrogram = self.stft.feed(samples)
+        self._frames.append(chroma(spectrogram, self.sample_rate, self.stft.stft.n_fft))
+
+    def frames_between(self, start, stop):
+        """Chroma frames starting in the sample range [start, stop)."""
+        return self.frames[start // self.hop : max(start, stop) // self.hop]
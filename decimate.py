@@ -0,0 +1,94 @@
+import numpy as np
+
+ANALYSIS_RATE = 11025  # Piano fundamentals top out near 4.2 kHz
+TAPS_PER_PHASE = 16
+PASSBAND = 0.9  # Of the new Nyquist frequency
+KAISER_BETA = 8.0  # About 80 dB stopband
+
+
+def lowpass_taps(factor, taps_per_phase=TAPS_PER_PHASE, passband=PASSBAND):
+    """Kaiser-windowed sinc anti-aliasing filter for decimating by `factor`.
+
+    With `passband` 1 it is also an interpolation filter for upsampling by
+    `factor`: every factor-th tap but the centre one is zero.
+    """
+    n_taps = factor * taps_per_phase + 1  # Odd, so the delay is whole samples
+    cutoff = passband * 0.5 / factor  # In cycles per input sample
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(n_taps, KAISER_BETA)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class Decimator:
+    """Streaming polyphase low-pass and downsample to about `target_rate`.
+
+    The factor is the largest integer that keeps the rate at or above the
+    target, e.g. 4 for 44.1 kHz to 11025 Hz. Output sample k is centred on
+    input sample k * factor, and chunks fed one after another give exactly
+    the output of decimating the whole signal at once.
+
+    The filter is split into `factor` phases so only the kept outputs are
+    computed: input is viewed as rows of `factor` samples, and each output
+    is a sum of one small matrix-vector product per row of taps.
+    """
+
+    def __init__(self, sample_rate, target_rate=ANALYSIS_RATE):
+        self.factor = max(1, int(sample_rate // target_rate))
+        self.rate = sample_rate / self.factor
+        taps = lowpass_taps(self.factor)
+        self.delay = (len(taps) - 1) // 2
+        # Reversed and zero-padded to whole rows: (rows, factor)
+        self.n_rows = -(-len(taps) // self.factor)
+        padded = np.zeros(self.n_rows * self.factor, np.float32)
+        padded[: len(taps)] = taps[::-1]
+        self.phases = padded.reshape(self.n_rows, self.factor)
+        # Input from the start of the next output's window; the first window
+        # reaches back before the signal starts
+        self._buffer = np.zeros(len(taps) - 1 - self.delay, np.float32)
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def feed(self, samples):
+        """Decimated float32 output for every window `samples` completes."""
+        samples = np.asarray(samples)
+        chunk = samples.astype(np.float32)
+        if samples.dtype.kind == "i":
+            chunk /= np.iinfo(samples.dtype).max + 1
+        self.samples_in += len(chunk)
+        if self.factor == 1:
+            self.samples_out += len(chunk)
+            return chunk
+        self._buffer = np.concatenate([self._buffer, chunk])
+        return self._drain()
+
+    def flush(self):
+        """Outputs still owed for the end of the signal, zero padded."""
+        if self.factor == 1:
+            return np.zeros(0, np.float32)
+        owed = -(-self.samples_in // self.factor) - self.samples_out
+        padding = np.zeros((owed + self.n_rows) * self.factor, np.float32)
+        self._buffer = np.concatenate([self._buffer, padding])
+        return self._drain(owed)
+
+    def _drain(self, limit=None):
+        window = self.n_rows * self.factor
+        n_out = max(0, (len(self._buffer) - window) // self.factor + 1)
+        if limit is not None:
+            n_out = min(n_out, limit)
+        if n_out == 0:
+            return np.zeros(0, np.float32)
+        rows = self._buffer[: (n_out + self.n_rows - 1) * self.factor]
+        rows = rows.reshape(-1, self.factor)
+        out = rows[:n_out] @ self.phases[0]
+        for r in range(1, self.n_rows):
+            out += rows[r : r + n_out] @ self.phases[r]
+        self._buffer = self._buffer[n_out * self.factor :]
+        self.samples_out += n_out
+        return out
+
+
+def decimate(samples, sample_rate, target_rate=ANALYSIS_RATE):
+    """(samples at the reduced rate, that rate) for a whole mono signal."""
+    decimator = Decimator(sample_rate, target_rate)
+    out = np.concatenate([decimator.feed(samples), decimator.flush()])
+    return out, decimator.rate
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class FilterStage:
+    """An IIR filter in second-order sections that carries state across chunks.
+
+    Feeding a signal through process() one chunk at a time gives the same
+    output as filtering it in one piece, so a stage can sit in a streaming
+    path. Chunks are filtered along the last axis; leading axes (e.g.
+    channels) each get their own state.
+    """
+
+    def __init__(self, sos):
+        self.sos = np.asarray(sos, dtype=np.float64)
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def _initial_state(self, first):
+        from scipy.signal import sosfilt_zi
+
+        # Start in steady state for the first sample to avoid a turn-on thump
+        zi = sosfilt_zi(self.sos)
+        zi = zi.reshape((len(self.sos),) + (1,) * first.ndim + (2,))
+        return zi * first[np.newaxis, ..., np.newaxis]
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk)
+        if chunk.shape[-1] == 0:
+            return chunk.astype(np.float64)
+        from scipy.signal import sosfilt
+
+        if self.zi is None:
+            self.zi = self._initial_state(np.asarray(chunk[..., 0], dtype=np.float64))
+        y, self.zi = sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        return y
+
+    __call__ = process
+
+
+class RCHighPass(FilterStage):
+    """First-order RC high-pass: y[i] = alpha * (y[i - 1] + x[i] - x[i - 1])."""
+
+    def __init__(self, cutoff, fs):
+        rc = 1.0 / (cutoff * 2 * np.pi)
+        dt = 1.0 / fs
+        self.alpha = rc / (rc + dt)
+        from scipy.signal import tf2sos
+
+        super().__init__(tf2sos([self.alpha, -self.alpha], [1.0, -self.alpha]))
+
+    def _initial_state(self, first):
+        # Matches y[0] = x[0] of the sample-by-sample definition
+        zi = np.zeros((1,) + first.shape + (2,))
+        zi[0, ..., 0] = (1 - self.sos[0, 0]) * first
+        return zi
+
+
+def _butter_sos(order, cutoff, btype, fs):
+    from scipy.signal import butter
+
+    return butter(order, cutoff, btype=btype, fs=fs, output="sos")
+
+
+def highpass(cutoff, fs, order=5):
+    return FilterStage(_butter_sos(order, cutoff, "high", fs))
+
+
+def lowpass(cutoff, fs, order=5):
+    return FilterStage(_butter_sos(order, cutoff, "low", fs))
+
+
+def bandpass(low, high, fs, order=5):
+    return FilterStage(_butter_sos(order, [low, high], "band", fs))
+
+
+def rc_highpass(cutoff, fs):
+    return RCHighPass(cutoff, fs)
+
+
+def butter_highpass(cutoff, fs, order=5):
+    from scipy.signal import butter
+
+    nyq = 0.5 * fs
+    normal_cutoff = cutoff / nyq
+    b, a = butter(order, normal_cutoff, btype="high", analog=False)
+    return b, a
+
+
+def highpass_filter(data, cutoff, fs, order=5):
+    from scipy.signal import filtfilt
+
+    b, a = butter_highpass(cutoff, fs, order=order)
+    y = filtfilt(b, a, data)
+    return y
+
+
+def rc_high_pass_filter(data, cutoff, fs):
+    if len(data) == 0:
+        return np.zeros_like(data)
+    return rc_highpass(cutoff, fs).process(data).astype(data.dtype)
@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+
+from telemetry import telemetry
+
+
+class LookaheadAnalyzer:
+    """Computes analysis frames ahead of the playhead on a producer thread.
+
+    Frame i describes the audio at sample position i * hop and is computed
+    by `compute(position, out)`, which fills `out`, one element of `dtype`.
+    Frames live in a ring of `capacity` slots, each tagged with the frame
+    index it holds. The producer clears a slot's tag before overwriting it
+    and sets it after, so a reader that sees the same tag before and after
+    copying has a complete frame without taking a lock.
+
+    Readers only call read(position). The producer follows the last position
+    read: it fills up to `capacity - 1` frames past it, and when a read lands
+    outside that window (a seek) it restarts from there.
+    """
+
+    def __init__(self, compute, dtype, hop, capacity=256):
+        self.compute = compute
+        self.hop = hop
+        self.capacity = capacity
+        self.frames = np.zeros(capacity, dtype=dtype)
+        self.tags = np.full(capacity, -1, dtype=np.int64)
+        self.read_index = 0
+        self._wake = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def read(self, position):
+        """Copy of the frame for `position`, or None if it is not ready yet."""
+        index = max(0, int(position)) // self.hop
+        if index != self.read_index:
+            self.read_index = index
+            self._wake.set()
+        slot = index % self.capacity
+        if self.tags[slot] == index:
+            frame = self.frames[slot].copy()
+            if self.tags[slot] == index:
+                return frame
+        telemetry.count("lookahead.miss")
+        return None
+
+    def seek(self, position):
+        """Start refilling from `position` without waiting for the next read."""
+        self.read_index = max(0, int(position)) // self.hop
+        self._wake.set()
+
+    def _produce(self):
+        index = self.read_index
+        while self._running:
+            target = self.read_index
+            if not target <= index <= target + self.capacity - 1:
+                # Seeked, or fell behind the reader; frames already in the
+                # ring stay valid since they are tagged by index
+                index = target
+            if index == target + self.capacity - 1:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            slot = index % self.capacity
+            if self.tags[slot] != index:
+                self.tags[slot] = -1
+                with telemetry.timer("lookahead.frame"):
+                    self.compute(index * self.hop, self.frames[slot])
+                self.tags[slot] = index
+            index += 1
+
+    def close(self):
+        """Stop the producer; safe to call more than once."""
+        self._running = False
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,277 @@
+from collections import namedtuple
+
+import numpy as np
+
+from decimate import lowpass_taps
+from filters import FilterStage
+
+STEP_SECONDS = 0.1
+MOMENTARY_SECONDS = 0.4
+SHORT_TERM_SECONDS = 3.0
+TRUE_PEAK_RATE = 176400  # Oversampled rate for true-peak, 4x at 44.1 kHz
+TRUE_PEAK_TAPS = 12  # Per phase of the oversampling filter
+READ_FRAMES = 1 << 20
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU below the absolutely gated loudness
+RANGE_GATE = -20.0  # LU, for the loudness range
+HISTOGRAM_TOP = 10.0  # LUFS; blocks louder than this share the top bin
+HISTOGRAM_RESOLUTION = 100  # Bins per LU
+FLOOR_DB = -120.0  # Reported for digital silence instead of -inf
+
+# Per step, all in dB: LUFS for the loudness fields, dBFS for the rest
+STEP_DTYPE = np.dtype(
+    [
+        ("momentary", np.float32),
+        ("short_term", np.float32),
+        ("rms", np.float32),
+        ("true_peak", np.float32),
+    ]
+)
+
+# integrated LUFS, range LU, true_peak dBTP, step in samples, steps array
+Loudness = namedtuple(
+    "Loudness", ["integrated", "loudness_range", "true_peak", "step", "steps"]
+)
+
+
+def k_weighting_sos(sample_rate):
+    """ITU-R BS.1770 K-weighting as two second-order sections.
+
+    The shelf and high-pass are designed for `sample_rate` from the analog
+    prototype of the 48 kHz coefficients in the standard, so they match
+    those exactly at 48 kHz.
+    """
+    # High shelf, +4 dB above about 1.5 kHz: the acoustic effect of the head
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh**0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [
+        (vh + vb * k / q + k * k) / a0,
+        2 * (k * k - vh) / a0,
+        (vh - vb * k / q + k * k) / a0,
+        1.0,
+        2 * (k * k - 1) / a0,
+        (1 - k / q + k * k) / a0,
+    ]
+    # RLB high-pass at about 38 Hz
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+def _db(power):
+    return 10 * np.log10(np.maximum(power, 10 ** (FLOOR_DB / 10)))
+
+
+def _lufs(power):
+    return np.maximum(-0.691 + _db(power), FLOOR_DB)
+
+
+class _GatedHistogram:
+    """Block powers binned by loudness, for gating without keeping blocks."""
+
+    def __init__(self):
+        n_bins = int((HISTOGRAM_TOP - ABSOLUTE_GATE) * HISTOGRAM_RESOLUTION) + 1
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.powers = np.zeros(n_bins)
+
+    def add(self, power):
+        loudness = _lufs(power)
+        keep = loudness > ABSOLUTE_GATE
+        bins = (loudness[keep] - ABSOLUTE_GATE) * HISTOGRAM_RESOLUTION
+        bins = np.minimum(bins.astype(np.int64), len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.powers += np.bincount(bins, power[keep], minlength=len(self.counts))
+
+    def _bin(self, loudness):
+        offset = (loudness - ABSOLUTE_GATE) * HISTOGRAM_RESOLUTION
+        return int(np.clip(np.ceil(offset), 0, len(self.counts)))
+
+    def mean_loudness(self, above=ABSOLUTE_GATE):
+        """Loudness of the mean power of blocks louder than `above`."""
+        first = self._bin(above)
+        count = self.counts[first:].sum()
+        if count == 0:
+            return FLOOR_DB
+        return float(_lufs(self.powers[first:].sum() / count))
+
+    def percentile(self, q, above=ABSOLUTE_GATE):
+        """Loudness below which `q` percent of the blocks above `above` lie."""
+        first = self._bin(above)
+        cumulative = np.cumsum(self.counts[first:])
+        if len(cumulative) == 0 or cumulative[-1] == 0:
+            return FLOOR_DB
+        index = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        return ABSOLUTE_GATE + (first + index) / HISTOGRAM_RESOLUTION
+
+
+class LoudnessMeter:
+    """Streaming loudness, RMS and true-peak of a planar signal, per step.
+
+    Fed consecutive (channels, frames) chunks, it returns one STEP_DTYPE
+    record for every `step_seconds` of input the chunks complete. Momentary
+    and short-term loudness are BS.1770 K-weighted and cover the 400 ms and
+    3 s ending at each step; true-peak is the sample peak of the signal
+    oversampled 4x at 44.1 and 48 kHz, as in BS.1770 Annex 2. Everything is
+    computed per chunk with array operations, and only the last few steps
+    and two fixed-size histograms (for the gated integrated loudness and the
+    loudness range) are kept between chunks, so memory does not grow with
+    the signal.
+
+    Channels are weighted equally, which is the standard's weighting for
+    mono and stereo.
+    """
+
+    def __init__(self, sample_rate, nchannels, step_seconds=STEP_SECONDS):
+        self.sample_rate = sample_rate
+        self.nchannels = nchannels
+        self.step = max(1, int(round(sample_rate * step_seconds)))
+        self.momentary_steps = max(1, int(round(MOMENTARY_SECONDS / step_seconds)))
+        self.short_term_steps = max(1, int(round(SHORT_TERM_SECONDS / step_seconds)))
+        self.k_weighting = FilterStage(k_weighting_sos(sample_rate))
+        ratio = TRUE_PEAK_RATE / sample_rate
+        self.oversampling = 1 << max(0, int(np.ceil(np.log2(ratio) - 1e-9)))
+        if self.oversampling > 1:
+            # Polyphase components of the interpolation filter: output phase
+            # p of each input sample is a short FIR of the input, and phase 0
+            # passes the input through
+            taps = lowpass_taps(self.oversampling, TRUE_PEAK_TAPS, passband=1.0)
+            n_rows = -(-len(taps) // self.oversampling)
+            padded = np.zeros(n_rows * self.oversampling, np.float32)
+            padded[: len(taps)] = taps * self.oversampling
+            self.phases = padded.reshape(n_rows, self.oversampling).T.copy()
+            self._history = np.zeros((nchannels, n_rows - 1), np.float32)
+            self.peak_delay = TRUE_PEAK_TAPS // 2
+        else:
+            self.peak_delay = 0
+        self._peak_skip = self.peak_delay
+        self._power = np.zeros(0)
+        self._square = np.zeros(0)
+        self._peak = np.zeros(0, np.float32)
+        self._recent = np.zeros(0)  # Powers of the last steps, for the windows
+        self.momentary_blocks = _GatedHistogram()
+        self.short_term_blocks = _GatedHistogram()
+        self._max_peak = 0.0
+
+    def feed(self, samples):
+        """STEP_DTYPE records for the steps that `samples` completes."""
+        samples = np.asarray(samples)
+        chunk = np.atleast_2d(samples).astype(np.float32)
+        if samples.dtype.kind == "i":
+            chunk /= np.iinfo(samples.dtype).max + 1
+        weighted = self.k_weighting(chunk)
+        self._power = np.concatenate(
+            [self._power, np.einsum("ij,ij->j", weighted, weighted)]
+        )
+        self._square = np.concatenate(
+            [self._square, np.einsum("ij,ij->j", chunk, chunk) / self.nchannels]
+        )
+        self._add_peaks(chunk)
+        # True-peaks lag the input by `peak_delay` samples
+        return self._drain(min(len(self._power), len(self._peak)) // self.step)
+
+    def flush(self):
+        """The record for the final partial step, if there is one."""
+        if self.peak_delay:
+            # Run the last samples' peaks out of the oversampling filter
+            self._add_peaks(np.zeros((self.nchannels, self.peak_delay), np.float32))
+        return self._drain(-(-len(self._power) // self.step))
+
+    def _add_peaks(self, chunk):
+        n = chunk.shape[1]
+        if self.oversampling == 1 or n == 0:
+            peaks = np.abs(chunk).max(axis=0, initial=0)
+        else:
+            from scipy.signal import oaconvolve
+
+            padded = np.concatenate([self._history, chunk], axis=1)
+            self._history = padded[:, n:]
+            # (channels, phases, n): every oversampled value of the chunk
+            up = oaconvolve(padded[:, None, :], self.phases[None], "valid", axes=2)
+            peaks = np.abs(up).max(axis=(0, 1))
+            # Oversampled values lag the input by half the filter; drop those
+            # that fall before the start of the signal
+            skip = min(self._peak_skip, n)
+            peaks = peaks[skip:]
+            self._peak_skip -= skip
+        self._peak = np.concatenate([self._peak, peaks.astype(np.float32)])
+
+    def _drain(self, n_steps):
+        if n_steps == 0:
+            return np.zeros(0, STEP_DTYPE)
+        end = n_steps * self.step
+        edges = np.arange(0, end, self.step)
+        counts = np.diff(np.append(edges, min(end, len(self._power))))
+        power = np.add.reduceat(self._power[:end], edges) / counts
+        square = np.add.reduceat(self._square[:end], edges) / counts
+        peak = np.maximum.reduceat(self._peak[:end], edges)
+        self._power = self._power[end:]
+        self._square = self._square[end:]
+        self._peak = self._peak[end:]
+
+        # Window sums over the steps ending at each new one, including the
+        # kept powers of earlier steps; at the start they cover what exists
+        history = np.concatenate([self._recent, power])
+        total = np.concatenate([[0.0], np.cumsum(history)])
+        last = np.arange(len(self._recent), len(history)) + 1
+
+        def window(n):
+            first = np.maximum(0, last - n)
+            return (total[last] - total[first]) / (last - first)
+
+        momentary = window(self.momentary_steps)
+        short_term = window(self.short_term_steps)
+        self._recent = history[max(0, len(history) - self.short_term_steps + 1) :]
+        self.momentary_blocks.add(momentary[last >= self.momentary_steps])
+        self.short_term_blocks.add(short_term[last >= self.short_term_steps])
+        self._max_peak = max(self._max_peak, float(peak.max()))
+
+        steps = np.empty(n_steps, STEP_DTYPE)
+        steps["momentary"] = _lufs(momentary)
+        steps["short_term"] = _lufs(short_term)
+        steps["rms"] = _db(square)
+        steps["true_peak"] = 2 * _db(peak)
+        return steps
+
+    def integrated(self):
+        """Gated integrated loudness (LUFS) of everything fed so far."""
+        blocks = self.momentary_blocks
+        return blocks.mean_loudness(blocks.mean_loudness() + RELATIVE_GATE)
+
+    def loudness_range(self):
+        """EBU R 128 loudness range (LU) of the short-term loudness."""
+        blocks = self.short_term_blocks
+        gate = blocks.mean_loudness() + RANGE_GATE
+        return blocks.percentile(95, gate) - blocks.percentile(10, gate)
+
+    def true_peak(self):
+        """Highest true-peak (dBTP) of everything fed so far."""
+        return float(2 * _db(self._max_peak))
+
+    def result(self, steps):
+        """Loudness summary, with `steps` the records feed and flush returned."""
+        return Loudness(
+            self.integrated(),
+            self.loudness_range(),
+            self.true_peak(),
+            self.step,
+            steps,
+        )
+
+
+def measure_file(path, step_seconds=STEP_SECONDS):
+    """Loudness of a WAV file, read in bounded chunks."""
+    from wav_file import WavFile
+
+    wav = WavFile(path)
+    meter = LoudnessMeter(wav.framerate, wav.nchannels, step_seconds)
+    steps = [
+        meter.feed(wav.decode(start, start + READ_FRAMES))
+        for start in range(0, wav.nframes, READ_FRAMES)
+    ]
+    steps.append(meter.flush())
+    return meter.result(np.concatenate(steps))
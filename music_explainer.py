@@ -10,8 +10,18 @@ from PySide6.QtWidgets import (
     QScrollBar,
 )
 from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QFont, QKeySequence, QShortcut
+import os
+import time
 from waveform_widget import WaveformWidget
+from piano_roll_widget import PianoRollWidget
 from audio_handler import AudioHandler
+from analysis_scheduler import AnalysisScheduler
+from session import Session
+from telemetry import telemetry
+
+PLAYHEAD_INTERVAL_MS = 16  # About 60 fps
+TELEMETRY_DUMP_INTERVAL_MS = 10000
 
 
 class MusicExplainer(QMainWindow):
@@ -20,14 +30,34 @@ class MusicExplainer(QMainWindow):
         self.setWindowTitle("Music Explainer")
         self.setGeometry(100, 100, 800, 600)
 
-        self.audio_handler = AudioHandler()
         self.setup_ui()
         self.setup_audio_handler()
 
-        # Timer for updating playhead position
+        # The playhead follows the engine's interpolated audio clock on every
+        # display frame; each tick only repaints a couple of pixel columns
+        self.last_playhead_tick = None
         self.playhead_timer = QTimer(self)
-        self.playhead_timer.timeout.connect(self.update_playhead)
-        self.playhead_timer.start(50)  # Update every 50ms
+        self.playhead_timer.setTimerType(Qt.PreciseTimer)
+        self.playhead_timer.timeout.connect(self.on_playhead_tick)
+        self.playhead_timer.start(PLAYHEAD_INTERVAL_MS)
+
+        self.setup_telemetry()
+
+        # Decoding and analysis run on a worker pool; partial results refine
+        # the labels while the file is still being processed
+        self.key_name = None
+        self.chords = None
+        self.analysis_progress = 0.0
+        self.analysis_scheduler = AnalysisScheduler(self)
+        self.analysis_scheduler.result_ready.connect(self.on_analysis_result)
+        self.analysis_scheduler.progress_changed.connect(self.on_analysis_progress)
+        self.analysis_scheduler.finished.connect(self.on_analysis_finished)
+
+        # Opening several files makes a playlist; the next tracks are decoded
+        # and analyzed in the background once the current one is done
+        self.track = None
+        self.session = Session(self)
+        self.session.decoded.connect(self.on_track_decoded)
 
     def setup_ui(self):
         main_widget = QWidget()
@@ -36,6 +66,9 @@ class MusicExplainer(QMainWindow):
         self.waveform_widget = WaveformWidget()
         main_layout.addWidget(self.waveform_widget, 3)
 
+        self.piano_roll = PianoRollWidget()
+        main_layout.addWidget(self.piano_roll, 2)
+
         control_panel = self.create_control_panel()
         main_layout.addWidget(control_panel)
 
@@ -72,31 +105,72 @@ class MusicExplainer(QMainWindow):
         self.vertical_zoom_label.setText(f"{v_zoom:.2f}x")
         self.h_scroll.setRange(0, self.waveform_widget.get_max_scroll())
 
-    def open_file(self):
-        file_name, _ = QFileDialog.getOpenFileName(
-            self, "Open Audio File", "", "Audio Files (*.wav)"
-        )
-        if file_name:
-            self.audio_handler.load_file(file_name)
-            self.waveform_widget.set_waveform(self.audio_handler.waveform)
-            self.update_ui_for_new_file()
-
-    def update_ui_for_new_file(self):
-        self.time_slider.setEnabled(True)
-        self.time_slider.setRange(0, len(self.audio_handler.waveform))
-        self.h_scroll.setRange(0, self.waveform_widget.get_max_scroll())
-        self.update_zoom()
-
-    def update_zoom(self):
-        zoom_factor = self.zoom_slider.value() / 100
-        self.waveform_widget.set_zoom(zoom_factor)
-        self.h_scroll.setRange(0, self.waveform_widget.get_max_scroll())
+    def on_playhead_tick(self):
+        # Ticks arriving late mean the GUI thread was busy for that long
+        now = time.perf_counter()
+        if self.last_playhead_tick is not None:
+            late_ticks = round(
+                (now - self.last_playhead_tick) * 1000 / PLAYHEAD_INTERVAL_MS - 1
+            )
+            if late_ticks > 0:
+                telemetry.count("ui.playhead_dropped", late_ticks)
+        self.last_playhead_tick = now
+        with telemetry.timer("ui.playhead"):
+            self.update_playhead()
 
     def update_playhead(self):
         if self.audio_handler.is_playing:
             current_position = self.audio_handler.get_current_position()
             self.waveform_widget.set_playhead(current_position)
+            self.piano_roll.set_position(current_position)
             self.time_slider.setValue(current_position)
+            self.update_key_label(current_position)
+
+    def update_key_label(self, position):
+        text = f"Key: {self.key_name or ''}"
+        chord = self.chords.at(position) if self.chords is not None else None
+        if chord is not None:
+            text += f"    Chord: {chord}"
+        self.key_label.setText(text)
+
+    def setup_telemetry(self):
+        # F3 toggles an overlay with live playback and render timings
+        self.telemetry_overlay = QLabel(self)
+        self.telemetry_overlay.setFont(QFont("monospace", 8))
+        self.telemetry_overlay.setStyleSheet(
+            "background: rgba(0, 0, 0, 170); color: white; padding: 4px"
+        )
+        self.telemetry_overlay.hide()
+        QShortcut(QKeySequence("F3"), self, self.toggle_telemetry_overlay)
+        self.overlay_timer = QTimer(self)
+        self.overlay_timer.timeout.connect(self.update_telemetry_overlay)
+
+        # With MUSIC2_TELEMETRY_LOG set, snapshots are appended there as JSON
+        self.telemetry_log = os.environ.get("MUSIC2_TELEMETRY_LOG")
+        if self.telemetry_log:
+            self.telemetry_timer = QTimer(self)
+            self.telemetry_timer.timeout.connect(self.dump_telemetry)
+            self.telemetry_timer.start(TELEMETRY_DUMP_INTERVAL_MS)
+
+    def toggle_telemetry_overlay(self):
+        if self.telemetry_overlay.isVisible():
+            self.overlay_timer.stop()
+            self.telemetry_overlay.hide()
+        else:
+            self.update_telemetry_overlay()
+            self.telemetry_overlay.show()
+            self.telemetry_overlay.raise_()
+            self.overlay_timer.start(500)
+
+    def update_telemetry_overlay(self):
+        self.telemetry_overlay.setText(telemetry.format() or "No samples yet")
+        self.telemetry_overlay.adjustSize()
+        self.telemetry_overlay.move(
+            self.width() - self.telemetry_overlay.width() - 10, 10
+        )
+
+    def dump_telemetry(self):
+        telemetry.dump(self.telemetry_log)
 
     def update_scroll_bar(self, position):
         self.h_scroll.setValue(position)
@@ -117,40 +191,184 @@ class MusicExplainer(QMainWindow):
         self.stop_button.clicked.connect(self.stop_audio)
         control_layout.addWidget(self.stop_button)
 
-        self.open_button = QPushButton("Open File")
+        self.open_button = QPushButton("Open Files")
         self.open_button.clicked.connect(self.open_file)
         control_layout.addWidget(self.open_button)
 
+        self.previous_button = QPushButton("Previous")
+        self.previous_button.clicked.connect(self.previous_track)
+        control_layout.addWidget(self.previous_button)
+        QShortcut(QKeySequence("Ctrl+Left"), self, self.previous_track)
+
+        self.next_button = QPushButton("Next")
+        self.next_button.clicked.connect(self.next_track)
+        control_layout.addWidget(self.next_button)
+        QShortcut(QKeySequence("Ctrl+Right"), self, self.next_track)
+
         self.time_slider = QSlider(Qt.Horizontal)
         self.time_slider.setEnabled(False)
         control_layout.addWidget(self.time_slider)
 
+        # Practice controls: slower playback at the same pitch, and an A-B
+        # loop set from the playhead
+        self.speed_label = QLabel("Speed: 100%")
+        control_layout.addWidget(self.speed_label)
+        self.speed_slider = QSlider(Qt.Horizontal)
+        self.speed_slider.setRange(25, 200)
+        self.speed_slider.setSingleStep(5)
+        self.speed_slider.setValue(100)
+        self.speed_slider.setMaximumWidth(120)
+        self.speed_slider.valueChanged.connect(self.set_speed)
+        control_layout.addWidget(self.speed_slider)
+
+        self.loop_start = None
+        self.loop_button = QPushButton("Loop A")
+        self.loop_button.clicked.connect(self.toggle_loop)
+        control_layout.addWidget(self.loop_button)
+
         return control_panel
 
+    def set_speed(self, percent):
+        self.speed_label.setText(f"Speed: {percent}%")
+        self.audio_handler.set_speed(percent / 100)
+
+    def toggle_loop(self):
+        # Cycles through setting A, setting B (looping from then on), clearing
+        position = self.audio_handler.get_current_position()
+        if self.loop_button.text() == "Loop A":
+            self.loop_start = position
+            self.loop_button.setText("Loop B")
+        elif self.loop_button.text() == "Loop B":
+            start, stop = sorted((self.loop_start, position))
+            self.audio_handler.set_loop(start, stop)
+            self.loop_button.setText("Clear Loop")
+        else:
+            self.audio_handler.clear_loop()
+            self.loop_button.setText("Loop A")
+
     def create_analysis_panel(self):
         analysis_panel = QWidget()
         analysis_layout = QVBoxLayout(analysis_panel)
 
+        self.track_label = QLabel("Track: ")
+        analysis_layout.addWidget(self.track_label)
+
         self.bpm_label = QLabel("BPM: ")
         analysis_layout.addWidget(self.bpm_label)
 
         self.key_label = QLabel("Key: ")
         analysis_layout.addWidget(self.key_label)
 
+        self.loudness_label = QLabel("Loudness: ")
+        analysis_layout.addWidget(self.loudness_label)
+
         return analysis_panel
 
     def open_file(self):
-        file_name, _ = QFileDialog.getOpenFileName(
-            self, "Open Audio File", "", "Audio Files (*.wav)"
+        file_names, _ = QFileDialog.getOpenFileNames(
+            self, "Open Audio Files", "", "Audio Files (*.wav)"
+        )
+        if file_names:
+            self.session.set_playlist(file_names)
+            self.show_track(0)
+
+    def previous_track(self):
+        if self.session.index > 0:
+            self.show_track(self.session.index - 1)
+
+    def next_track(self):
+        if 0 <= self.session.index < len(self.session) - 1:
+            self.show_track(self.session.index + 1)
+
+    def show_track(self, index):
+        self.analysis_scheduler.cancel()
+        self.track = self.session.select(index)
+        audio = self.track.audio
+        self.audio_handler.load_buffer(self.track.wav, audio)
+        self.piano_roll.set_audio(audio)
+        self.loop_button.setText("Loop A")
+        self.time_slider.setEnabled(True)
+        self.time_slider.setRange(0, len(audio))
+        self.track_label.setText(
+            f"Track: {index + 1}/{len(self.session)}"
+            f"    {os.path.basename(self.track.path)}"
         )
-        if file_name:
-            self.audio_handler.load_file(file_name)
-            self.waveform_widget.set_waveform(self.audio_handler.waveform)
-            self.time_slider.setEnabled(True)
-            self.time_slider.setRange(0, len(self.audio_handler.waveform))
+
+        self.key_name = None
+        self.chords = None
+        self.analysis_progress = 1.0 if self.track.analyzed else 0.0
+        self.bpm_label.setText("BPM: ")
+        self.key_label.setText("Key: ")
+        self.loudness_label.setText("Loudness: ")
+        # The waveform is drawn once workers have summarized it, right away
+        # for a preloaded track
+        self.waveform_widget.set_waveform(None)
+        self.waveform_widget.set_loudness(None)
+        for kind, value in self.track.results.items():
+            self.show_result(kind, value)
+        if self.track.analyzed:
+            self.session.preload()
+        else:
+            self.analysis_scheduler.start(self.track.wav)
+
+    def on_track_decoded(self, track):
+        # Playing from the file until now; go on from the copy in memory
+        if track is self.track:
+            self.audio_handler.refresh_waveform()
+
+    def on_analysis_progress(self, generation, progress):
+        if generation == self.analysis_scheduler.generation:
+            self.analysis_progress = progress
+
+    def on_analysis_result(self, generation, kind, value):
+        if generation != self.analysis_scheduler.generation:
+            return
+        if kind != "error":
+            self.track.results[kind] = value
+        self.show_result(kind, value)
+
+    def on_analysis_finished(self, generation):
+        if generation != self.analysis_scheduler.generation:
+            return
+        self.track.analyzed = True
+        self.session.preload()
+
+    def show_result(self, kind, value):
+        if kind == "pyramid":
+            self.waveform_widget.set_waveform(self.audio_handler.waveform.data, value)
+            self.h_scroll.setRange(0, self.waveform_widget.get_max_scroll())
+        elif kind == "tempo":
+            text = f"BPM: {value.bpm:.1f}"
+            if self.analysis_progress < 1:
+                text += f" (analyzing, {100 * self.analysis_progress:.0f}%)"
+            self.bpm_label.setText(text)
+        elif kind == "key":
+            self.key_name = value
+            self.update_key_label(self.audio_handler.get_current_position())
+        elif kind == "chords":
+            self.chords = value
+            self.update_key_label(self.audio_handler.get_current_position())
+        elif kind == "loudness":
+            self.waveform_widget.set_loudness(value)
+            self.loudness_label.setText(
+                f"Loudness: {value.integrated:.1f} LUFS"
+                f"    Range: {value.loudness_range:.1f} LU"
+                f"    True peak: {value.true_peak:.1f} dBTP"
+            )
+        elif kind == "error":
+            self.bpm_label.setText(f"BPM: (analysis failed: {value})")
 
     def play_audio(self):
         self.audio_handler.play()
 
     def stop_audio(self):
         self.audio_handler.stop()
+
+    def closeEvent(self, event):
+        if self.telemetry_log:
+            self.dump_telemetry()
+        self.analysis_scheduler.shutdown()
+        self.session.shutdown()
+        self.piano_roll.shutdown()
+        self.audio_handler.close()
+        super().closeEvent(event)
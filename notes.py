@@ -0,0 +1,54 @@
+import numpy as np
+
+from piano_filterbank import nearest_key_indices
+
+
+def generate_piano_frequencies():
+    return [440 * (2 ** ((i - 49) / 12)) for i in range(88)]  # A4 is 49th key
+
+
+def calculate_fft(samples, sample_rate):
+    from scipy.fft import rfft, rfftfreq
+
+    fft_result = rfft(samples)
+    freqs = rfftfreq(len(samples), 1 / sample_rate)
+    return freqs[: len(samples) // 2], np.abs(fft_result[: len(samples) // 2])
+
+
+def dominant_key_indices(freqs, magnitudes, piano_freqs, num_notes=3):
+    """Indices into `piano_freqs` of the strongest spectral peaks, loudest first."""
+    from scipy.signal import find_peaks
+
+    peaks, _ = find_peaks(magnitudes, height=np.max(magnitudes) / 10)
+    dominant_freqs = freqs[peaks]
+    dominant_mags = magnitudes[peaks]
+
+    sorted_indices = np.argsort(dominant_mags)[::-1]
+    top_freqs = dominant_freqs[sorted_indices][:num_notes]
+    return nearest_key_indices(top_freqs, piano_freqs)
+
+
+def key_name(note_index):
+    note_name = ["A", "A#", "B", "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#"][
+        note_index % 12
+    ]
+    octave = note_index // 12
+    return f"{note_name}{octave}"
+
+
+def find_dominant_notes(freqs, magnitudes, piano_freqs, num_notes=3):
+    return [
+        key_name(i)
+        for i in dominant_key_indices(freqs, magnitudes, piano_freqs, num_notes)
+    ]
+
+
+def freq_to_pitch(freq):
+    return 12 * np.log2(freq / 440) + 49  # A4 is 49th key
+
+
+def pitch_to_note(pitch):
+    note_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+    octave = (pitch // 12) - 1
+    note = note_names[pitch % 12]
+    return f"{note}{octave}"
@@ -0,0 +1,142 @@
+import numpy as np
+
+
+class PeakPyramid:
+    """Min/max/RMS summaries of a waveform at 2^k samples per bucket.
+
+    Samples are either 1-D or planar (channels, frames); a planar waveform is
+    summarized per frame, with min/max over all channels and the RMS of
+    their mean power.
+    """
+
+    def __init__(self, samples, base_level=6, block_size=1 << 20):
+        summaries = self.summarize(samples, 1 << base_level, block_size)
+        self._build(np.shape(samples)[-1], base_level, *summaries)
+
+    @classmethod
+    def from_summaries(cls, length, mins, maxs, sumsq, base_level=6):
+        """Build from base-level summaries computed elsewhere, e.g. per chunk."""
+        pyramid = cls.__new__(cls)
+        pyramid._build(length, base_level, mins, maxs, sumsq)
+        return pyramid
+
+    def _build(self, length, base_level, mins, maxs, sumsq):
+        self.length = length
+        self.base_level = base_level
+        self.levels = []  # (bucket_size, mins, maxs, rms)
+
+        bucket = 1 << base_level
+        counts = np.full(len(mins), bucket, dtype=np.float64)
+        if len(counts):
+            counts[-1] = self.length - bucket * (len(counts) - 1)
+        self.levels.append(
+            (bucket, mins, maxs, np.sqrt(sumsq / counts).astype(np.float32))
+        )
+
+        while len(mins) > 1:
+            bucket *= 2
+            mins = self._pairwise(np.minimum, mins)
+            maxs = self._pairwise(np.maximum, maxs)
+            sumsq = self._pairwise(np.add, sumsq)
+            counts = self._pairwise(np.add, counts)
+            self.levels.append(
+                (bucket, mins, maxs, np.sqrt(sumsq / counts).astype(np.float32))
+            )
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for level in self.levels for a in level[1:])
+
+    @staticmethod
+    def summarize(samples, bucket, block_size=1 << 20):
+        """Per-bucket (mins, maxs, sum of squares), normalized to [-1, 1]."""
+        length = np.shape(samples)[-1]
+        n_buckets = -(-length // bucket)
+        mins = np.empty(n_buckets, dtype=np.float32)
+        maxs = np.empty(n_buckets, dtype=np.float32)
+        sumsq = np.empty(n_buckets, dtype=np.float64)
+
+        # Integer samples are normalized to [-1, 1] one block at a time so the
+        # full-size float copy never exists.
+        dtype = np.asarray(samples[..., :0]).dtype
+        scale = 1.0 / (np.iinfo(dtype).max + 1) if dtype.kind == "i" else 1.0
+
+        block_size = max(bucket, block_size - block_size % bucket)
+        for start in range(0, length, block_size):
+            block = np.asarray(samples[..., start : start + block_size], np.float32)
+            block = np.atleast_2d(block)  # (channels, frames)
+            if scale != 1.0:
+                block = block * np.float32(scale)
+            channels, n = block.shape
+            first = start // bucket
+            full = n // bucket
+            if full:
+                chunks = block[:, : full * bucket].reshape(channels, full, bucket)
+                mins[first : first + full] = chunks.min(axis=(0, 2))
+                maxs[first : first + full] = chunks.max(axis=(0, 2))
+                sumsq[first : first + full] = (
+                    np.einsum("cij,cij->i", chunks, chunks) / channels
+                )
+            if n > full * bucket:
+                tail = block[:, full * bucket :]
+                mins[first + full] = tail.min()
+                maxs[first + full] = tail.max()
+                sumsq[first + full] = np.einsum("ij,ij->", tail, tail) / channels
+        return mins, maxs, sumsq
+
+    @staticmethod
+    def _pairwise(ufunc, values):
+        if len(values) % 2:
+            values = np.append(values, values[-1:] if ufunc is not np.add else 0)
+        return ufunc(values[0::2], values[1::2])
+
+    def level_for(self, samples_per_pixel):
+        # Coarsest level with at least four buckets per pixel column, so column
+        # edges land within a quarter pixel of where they belong
+        best = None
+        for level in self.levels:
+            if level[0] * 4 > samples_per_pixel:
+                break
+            best = level
+        return best
+
+    def columns(self, samples, start_sample, samples_per_pixel, width):
+        """Return per-column (mins, maxs, rms) for up to `width` pixel columns."""
+        edges = start_sample + np.arange(width + 1) * samples_per_pixel
+        edges = np.clip(edges, 0, self.length).astype(np.int64)
+        n_cols = int(np.count_nonzero(edges[:-1] < self.length))
+        if n_cols == 0:
+            empty = np.empty(0, dtype=np.float32)
+            return empty, empty, empty
+        edges = edges[: n_cols + 1]
+
+        level = self.level_for(samples_per_pixel)
+        if level is None:
+            # Zoomed in past the base level: reduce the raw window directly,
+            # which is at most 4 * width * 2^base_level samples. Below one
+            # sample per pixel the last columns can start on the last sample.
+            stop = max(int(edges[-1]), int(edges[-2]) + 1)
+            raw = samples[..., edges[0] : stop]
+            dtype = np.asarray(raw).dtype
+            values = np.atleast_2d(np.asarray(raw, dtype=np.float32))
+            if dtype.kind == "i":
+                values = values / (np.iinfo(dtype).max + 1)
+            mins = values.min(axis=0)
+            maxs = values.max(axis=0)
+            squares = (values.astype(np.float64) ** 2).mean(axis=0)
+            starts = edges[:-1] - edges[0]
+            end = values.shape[1]
+        else:
+            bucket, mins, maxs, rms = level
+            squares = rms.astype(np.float64) ** 2
+            starts = edges[:-1] // bucket
+            end = max(-(-int(edges[-1]) // bucket), int(starts[-1]) + 1)
+
+        # reduceat folds each [starts[i], starts[i + 1]) range and falls back
+        # to the single bucket at starts[i] when a column is narrower than it.
+        col_min = np.minimum.reduceat(mins[:end], starts)
+        col_max = np.maximum.reduceat(maxs[:end], starts)
+        col_sq = np.add.reduceat(squares[:end], starts)
+        counts = np.diff(np.append(starts, end)).clip(min=1)
+        col_rms = np.sqrt(col_sq / counts).astype(np.float32)
+        return col_min, col_max, col_rms
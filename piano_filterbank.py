@@ -0,0 +1,87 @@
+from functools import lru_cache
+
+import numpy as np
+
+NUM_KEYS = 88
+A0_FREQ = 27.5
+
+
+def key_frequencies():
+    return A0_FREQ * 2 ** (np.arange(NUM_KEYS) / 12)
+
+
+def nearest_key_indices(freqs, key_freqs):
+    """Index of the closest entry in the sorted `key_freqs` for each freq."""
+    key_freqs = np.asarray(key_freqs)
+    freqs = np.asarray(freqs)
+    upper = np.clip(np.searchsorted(key_freqs, freqs), 1, len(key_freqs) - 1)
+    lower = upper - 1
+    closer_to_lower = freqs - key_freqs[lower] <= key_freqs[upper] - freqs
+    return np.where(closer_to_lower, lower, upper)
+
+
+class PianoFilterbank:
+    """Sparse (88 x n_bins) matrix mapping rfft magnitudes to piano keys.
+
+    "triangular" weights bins by a triangle one semitone wide on either side
+    of each key, with keys too low to own any bin falling back to their
+    nearest bin. "constant_q" uses triangles `q_width` semitones wide,
+    widened to at least one FFT bin so low keys interpolate between their
+    neighbouring bins instead. Triangles peak at one, so a pure tone on a
+    key reports roughly its own magnitude.
+    """
+
+    def __init__(self, sample_rate, n_fft, weighting="triangular", q_width=0.5):
+        from scipy.sparse import csr_matrix
+
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.weighting = weighting
+        self.n_bins = n_fft // 2 + 1
+
+        bin_freqs = np.arange(self.n_bins) * sample_rate / n_fft
+        with np.errstate(divide="ignore"):
+            bin_pitch = 12 * np.log2(bin_freqs / A0_FREQ)  # In keys above A0
+
+        if weighting == "triangular":
+            width = np.ones(NUM_KEYS)
+        elif weighting == "constant_q":
+            bin_width_in_keys = 12 * np.log2(
+                (key_frequencies() + sample_rate / n_fft) / key_frequencies()
+            )
+            width = np.maximum(q_width, bin_width_in_keys)
+        else:
+            raise ValueError(f"Unknown filterbank weighting: {weighting}")
+
+        rows, cols, weights = [], [], []
+        for key in range(NUM_KEYS):
+            lo = np.searchsorted(bin_pitch, key - width[key], side="right")
+            hi = np.searchsorted(bin_pitch, key + width[key], side="left")
+            bins = np.arange(max(lo, 1), hi)
+            w = 1 - np.abs(bin_pitch[bins] - key) / width[key]
+            if w.sum() <= 0:
+                nearest = np.argmin(np.abs(bin_freqs - key_frequencies()[key]))
+                bins, w = np.array([nearest]), np.array([1.0])
+            rows.append(np.full(len(bins), key))
+            cols.append(bins)
+            weights.append(w)
+
+        self.matrix = csr_matrix(
+            (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(NUM_KEYS, self.n_bins),
+            dtype=np.float32,
+        )
+
+    def apply(self, magnitudes):
+        """Key intensities for one frame (n_bins,) or many (n_frames, n_bins)."""
+        magnitudes = np.asarray(magnitudes)
+        matrix = self.matrix
+        if magnitudes.shape[-1] < self.n_bins:
+            # calculate_fft drops the Nyquist bin
+            matrix = matrix[:, : magnitudes.shape[-1]]
+        return np.asarray(matrix @ magnitudes.T).T
+
+
+@lru_cache(maxsize=16)
+def get_filterbank(sample_rate, n_fft, weighting="triangular"):
+    return PianoFilterbank(sample_rate, n_fft, weighting)
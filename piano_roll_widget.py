@@ -0,0 +1,171 @@
+from PySide6.QtWidgets import QWidget
+from PySide6.QtGui import QPainter, QImage, QColor
+from PySide6.QtCore import QRectF
+import numpy as np
+
+from lookahead import LookaheadAnalyzer
+from piano_filterbank import NUM_KEYS, get_filterbank
+from telemetry import telemetry
+
+COLUMNS_PER_SECOND = 60
+HISTORY_SECONDS = 10
+KEYBOARD_WIDTH = 40
+PEAK_DECAY = 0.995  # Per column, so quiet passages fade back in
+BLACK_KEYS = np.isin(np.arange(NUM_KEYS) % 12, [1, 4, 6, 9, 11])  # From A0
+
+# White through red to dark red, like matplotlib's "Reds"
+_STOPS = np.array([[255, 245, 240], [239, 59, 44], [103, 0, 13]], dtype=np.float64)
+
+
+def _rgb32(r, g, b):
+    return (
+        0xFF000000
+        | (r.astype(np.uint32) << 16)
+        | (g.astype(np.uint32) << 8)
+        | b.astype(np.uint32)
+    )
+
+
+def _make_lut():
+    t = np.linspace(0, 1, 256)
+    r, g, b = (np.interp(t, [0, 0.5, 1], _STOPS[:, c]) for c in range(3))
+    return _rgb32(r, g, b)
+
+
+class PianoRollWidget(QWidget):
+    """Scrolling spectrogram on a piano-key axis, with a lit keyboard strip.
+
+    Key intensities are computed ahead of the playhead by a LookaheadAnalyzer
+    and written one column at a time into a preallocated ring-buffer QImage,
+    so each display frame is a lookup and a blit. Time runs left to right,
+    A0 is at the bottom.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(NUM_KEYS)
+        self.audio = None
+        self.filterbank = None
+        self.lookahead = None
+        self.lut = _make_lut()
+
+        # One pixel row per key; column `head` is the next one written
+        n_columns = COLUMNS_PER_SECOND * HISTORY_SECONDS
+        self.ring = QImage(n_columns, NUM_KEYS, QImage.Format_RGB32)
+        self._pixels = np.frombuffer(self.ring.bits(), np.uint32).reshape(
+            NUM_KEYS, self.ring.bytesPerLine() // 4
+        )[::-1, :n_columns]
+        self.head = 0
+        self.keyboard = QImage(1, NUM_KEYS, QImage.Format_RGB32)
+        self._keys = np.frombuffer(self.keyboard.bits(), np.uint32).reshape(
+            NUM_KEYS, self.keyboard.bytesPerLine() // 4
+        )[::-1, 0]
+        self.intensities = np.zeros(NUM_KEYS, dtype=np.float32)
+        self.column = None  # Frame the last written column ended at
+        self.peak = 0.0
+        self.clear()
+
+    def set_audio(self, audio):
+        """Show `audio`, an AudioBuffer, from its start."""
+        self.shutdown()
+        self.audio = audio
+        self.hop = audio.framerate // COLUMNS_PER_SECOND
+        self.n_fft = audio.framerate // 10  # Same window as play_wave
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        self._frame = np.zeros(self.n_fft, dtype=np.float32)
+        self.filterbank = get_filterbank(audio.framerate, self.n_fft)
+        self.lookahead = LookaheadAnalyzer(
+            self._key_intensities, np.dtype((np.float32, NUM_KEYS)), self.hop
+        )
+        self.clear()
+
+    def shutdown(self):
+        if self.lookahead is not None:
+            self.lookahead.close()
+            self.lookahead = None
+
+    def clear(self):
+        self._pixels[...] = self.lut[0]
+        self.intensities[...] = 0
+        self._update_keyboard()
+        self.head = 0
+        self.column = None
+        self.peak = 0.0
+        self.update()
+
+    def set_position(self, position):
+        """Advance to frame `position`, writing the columns played since."""
+        if self.audio is None:
+            return
+        n_columns = self.ring.width()
+        if self.column is None or not (
+            self.column <= position < self.column + n_columns * self.hop
+        ):
+            # Seeked, or too far behind to catch up: start over from here, on
+            # a multiple of hop since that is where lookahead frames are
+            self.clear()
+            self.column = (position // self.hop - 1) * self.hop
+        if position < self.column + self.hop:
+            return
+        with telemetry.timer("ui.piano_roll"):
+            while self.column + self.hop <= position:
+                self.column += self.hop
+                self._write_column(self.column)
+            self._update_keyboard()
+        self.update()
+
+    def _key_intensities(self, end, out):
+        """Key magnitudes of the window ending at frame `end`, into `out`.
+
+        Runs on the lookahead thread.
+        """
+        start = end - self.n_fft
+        lo, hi = max(0, start), min(end, self.audio.nframes)
+        frame = self._frame
+        frame[...] = 0
+        if hi > lo:
+            self.audio.mono(lo, hi, out=frame[lo - start : hi - start])
+        frame *= self.window
+        out[...] = self.filterbank.apply(np.abs(np.fft.rfft(frame)))
+
+    def _write_column(self, end):
+        keys = self.lookahead.read(end)
+        if keys is None:
+            keys = np.zeros(NUM_KEYS, dtype=np.float32)  # Producer behind
+        self.peak = max(float(keys.max()), self.peak * PEAK_DECAY, 1e-9)
+        self.intensities[...] = np.clip(keys / self.peak, 0, 1)
+        self._pixels[:, self.head] = self.lut[(self.intensities * 255).astype(int)]
+        self.head = (self.head + 1) % self.ring.width()
+
+    def _update_keyboard(self):
+        # White keys tint towards red, black keys light up from black
+        level = self.intensities * 255
+        white = 255 - level
+        zero = np.zeros_like(level)
+        self._keys[...] = np.where(
+            BLACK_KEYS, _rgb32(level, zero, zero), _rgb32(zero + 255, white, white)
+        )
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        height = self.height()
+        painter.drawImage(QRectF(0, 0, KEYBOARD_WIDTH, height), self.keyboard)
+
+        # Oldest columns are those from `head` to the end of the ring
+        n_columns = self.ring.width()
+        left = KEYBOARD_WIDTH
+        scale = (self.width() - left) / n_columns
+        older = n_columns - self.head
+        painter.drawImage(
+            QRectF(left, 0, older * scale, height),
+            self.ring,
+            QRectF(self.head, 0, older, NUM_KEYS),
+        )
+        if self.head:
+            painter.drawImage(
+                QRectF(left + older * scale, 0, self.head * scale, height),
+                self.ring,
+                QRectF(0, 0, self.head, NUM_KEYS),
+            )
+        painter.setPen(QColor(128, 128, 128))
+        painter.drawLine(left, 0, left, height)
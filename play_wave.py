@@ -1,21 +1,37 @@
 import sys
-import wave
 import numpy as np
-import pyaudio
 import threading
 import time
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from matplotlib.patches import Rectangle
-from scipy.fft import fft
-from scipy.signal import find_peaks
-from collections import deque
-from scipy.signal import butter, filtfilt
+
+# The DSP helpers live in Qt/matplotlib/pyaudio-free modules and are
+# re-exported here; pyaudio and matplotlib are only imported once playback
+# or plotting actually starts
+from decimate import Decimator, decimate
+from filters import highpass_filter, rc_high_pass_filter, rc_highpass
+from lookahead import LookaheadAnalyzer
+from notes import (
+    calculate_fft,
+    dominant_key_indices,
+    find_dominant_notes,
+    freq_to_pitch,
+    generate_piano_frequencies,
+    key_name,
+    pitch_to_note,
+)
+from piano_filterbank import NUM_KEYS, get_filterbank
+from stft import STFT
+from telemetry import telemetry
+from wav_file import WavFile
+
+PA_CONTINUE = 0  # pyaudio.paContinue
+SPECTRUM_FFT = 4096  # At the analysis rate, about 370 ms and 2.7 Hz bins
+VIEW_FILTER_MAX_GAP = 10  # Seconds the view may skip and still filter through
 
 
 class AudioPlayer:
-    def __init__(self, mono_samples, sampwidth, framerate):
+    def __init__(self, mono_samples, sampwidth, framerate, filter_stage=None):
         self.mono_samples = mono_samples
+        self.filter_stage = filter_stage  # Applied live, with state across chunks
         self.sampwidth = sampwidth
         self.framerate = framerate
         self.playing = False
@@ -24,6 +40,8 @@ class AudioPlayer:
         self.current_position = 0
 
     def play_audio(self):
+        import pyaudio
+
         self.p = pyaudio.PyAudio()
         self.stream = self.p.open(
             format=self.p.get_format_from_width(self.sampwidth),
@@ -44,11 +62,19 @@ class AudioPlayer:
         self.p.terminate()
 
     def callback(self, in_data, frame_count, time_info, status):
+        started = time.perf_counter()
         data = self.mono_samples[
             self.current_position : self.current_position + frame_count
         ]
         self.current_position += frame_count
-        return (data.tobytes(), pyaudio.paContinue)
+        if self.filter_stage is not None:
+            filtered = self.filter_stage.process(data)
+            info = np.iinfo(data.dtype)
+            data = np.clip(filtered, info.min, info.max).astype(data.dtype)
+        telemetry.audio_callback(
+            status, time.perf_counter() - started, frame_count / self.framerate
+        )
+        return (data.tobytes(), PA_CONTINUE)
 
     def stop(self):
         self.playing = False
@@ -59,48 +85,44 @@ class AudioPlayer:
             self.p.terminate()
 
 
-def generate_piano_frequencies():
-    return [440 * (2 ** ((i - 49) / 12)) for i in range(88)]  # A4 is 49th key
-
-
-def calculate_fft(samples, sample_rate):
-    fft_result = fft(samples)
-    freqs = np.fft.fftfreq(len(samples), 1 / sample_rate)
-    return freqs[: len(freqs) // 2], np.abs(fft_result[: len(fft_result) // 2])
-
-
-def find_dominant_notes(freqs, magnitudes, piano_freqs, num_notes=3):
-    peaks, _ = find_peaks(magnitudes, height=np.max(magnitudes) / 10)
-    dominant_freqs = freqs[peaks]
-    dominant_mags = magnitudes[peaks]
-
-    sorted_indices = np.argsort(dominant_mags)[::-1]
-    top_freqs = dominant_freqs[sorted_indices][:num_notes]
-
-    notes = []
-    for freq in top_freqs:
-        note_index = np.argmin(np.abs(np.array(piano_freqs) - freq))
-        note_name = ["A", "A#", "B", "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#"][
-            note_index % 12
-        ]
-        octave = note_index // 12
-        notes.append(f"{note_name}{octave}")
-
-    return notes
-
-
-def freq_to_pitch(freq):
-    return 12 * np.log2(freq / 440) + 49  # A4 is 49th key
-
-
-def pitch_to_note(pitch):
-    note_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-    octave = (pitch // 12) - 1
-    note = note_names[pitch % 12]
-    return f"{note}{octave}"
+class FilteredView:
+    """Windows of a signal passed through its own copy of the playback filter.
+
+    Samples are filtered once each, in order, as the view reaches them, so
+    the windows are exactly the filtered stream playback produces. Jumping
+    backwards, or more than `max_gap` samples ahead, counts as a seek and
+    restarts the filter there.
+    """
+
+    def __init__(self, samples, filter_stage, max_gap):
+        self.samples = samples
+        self.filter_stage = filter_stage
+        self.max_gap = max_gap
+        self.start = 0  # Sample position of filtered[0]
+        self.filtered = samples[:0]
+
+    def window(self, start, stop):
+        end = self.start + len(self.filtered)
+        if start < self.start or start > end + self.max_gap:
+            self.filter_stage.reset()
+            self.start = end = start
+            self.filtered = self.samples[:0]
+        if stop > end:
+            data = self.samples[end:stop]
+            # Clipped back to the sample type, as playback does
+            info = np.iinfo(data.dtype)
+            filtered = self.filter_stage.process(data)
+            filtered = np.clip(filtered, info.min, info.max).astype(data.dtype)
+            self.filtered = np.concatenate([self.filtered, filtered])
+        # Nothing before the window is needed again short of a seek
+        self.filtered = self.filtered[start - self.start :]
+        self.start = start
+        return self.filtered[: stop - start]
 
 
 def create_piano_keyboard(ax):
+    from matplotlib.patches import Rectangle
+
     white_keys = [0, 2, 4, 5, 7, 9, 11]  # C, D, E, F, G, A, B
     black_keys = [1, 3, 6, 8, 10]  # C#, D#, F#, G#, A#
     key_width = 1
@@ -151,58 +173,70 @@ def create_piano_keyboard(ax):
     return keys
 
 
-def butter_highpass(cutoff, fs, order=5):
-    nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype="high", analog=False)
-    return b, a
-
-
-def highpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_highpass(cutoff, fs, order=order)
-    y = filtfilt(b, a, data)
-    return y
-
-
-def rc_high_pass_filter(data, cutoff, fs):
-    RC = 1.0 / (cutoff * 2 * np.pi)
-    dt = 1.0 / fs
-    alpha = RC / (RC + dt)
+def read_mono(input_file):
+    """Return (int16 mono samples, sampwidth, framerate) of a WAV file."""
+    wav = WavFile(input_file)
+    mono = wav.read_mono(0, wav.nframes)
+    mono_samples = np.clip(mono * 32768, -32768, 32767).astype(np.int16)
+    return mono_samples, 2, wav.framerate
 
-    y = np.zeros_like(data)
-    y[0] = data[0]
-    for i in range(1, len(data)):
-        y[i] = alpha * (y[i - 1] + data[i] - data[i - 1])
 
-    return y
+def create_plot(input_file, mono_samples, framerate, get_position, cutoff=None):
+    """Build the figure; returns (fig, update_plot, close) for a FuncAnimation.
 
-
-def mono_play_and_plot(input_file):
-    with wave.open(input_file, "rb") as wf:
-        nchannels, sampwidth, framerate, nframes, comptype, compname = wf.getparams()
-        frames = wf.readframes(nframes)
-
-    samples = np.frombuffer(frames, dtype=np.int16)
-    if nchannels == 2:
-        samples = samples.reshape(-1, nchannels)
-        mono_samples = samples.mean(axis=1, dtype=np.int16)
-    else:
-        mono_samples = samples
+    update_plot draws the 100 ms around the sample returned by get_position().
+    close() stops the look-ahead producer behind it; closing the figure's
+    window does so too.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
 
     fig, (ax1, ax2, ax3) = plt.subplots(
         3, 1, figsize=(12, 8), gridspec_kw={"height_ratios": [1, 1, 0.5]}
     )
     (line,) = ax1.plot([], [])
     segment_len = framerate // 10  # 100ms of data
+    if cutoff:
+        view = FilteredView(
+            mono_samples,
+            rc_highpass(cutoff, framerate),
+            VIEW_FILTER_MAX_GAP * framerate,
+        )
     ax1.set_xlim(0, segment_len)
     ax1.set_ylim(np.min(mono_samples), np.max(mono_samples))
     ax1.set_title("Real-time Waveform")
     ax1.set_xlabel("Sample")
     ax1.set_ylabel("Amplitude")
 
-    fft_history = deque(maxlen=100)  # Store 10 seconds of FFT data
-    freqs, _ = calculate_fft(mono_samples[:segment_len], framerate)
-    pitches = freq_to_pitch(freqs)
+    # Spectrogram frames for the whole file are computed (or loaded from the
+    # analysis cache) once, and the animation only indexes them. They are
+    # taken at the reduced analysis rate, where the same FFT size covers a
+    # window four times longer, enough to tell the lowest keys apart
+    rate = Decimator(framerate).rate
+    factor = framerate / rate
+    stft = STFT(SPECTRUM_FFT, hop=int(rate) // 40)
+
+    def analysis_signal():
+        # Only decimated when the spectrogram is not cached. At least one
+        # whole window, so that even a file shorter than that has a
+        # spectrogram frame to show
+        analysis, _ = decimate(mono_samples, framerate)
+        return np.pad(analysis, (0, max(0, stft.n_fft - len(analysis))))
+
+    spec = stft.compute_cached(input_file, analysis_signal, "mono", rate)
+    freqs = stft.frequencies(rate)
+    filterbank = get_filterbank(rate, stft.n_fft)
+    history_len = 100  # 10 seconds of 100ms columns
+    history_step = round(rate / 10 / stft.hop)
+
+    def spec_index(position):
+        # The frame centred on `position`, given in samples at `framerate`
+        index = stft.frame_index(max(0, position / factor - stft.n_fft // 2))
+        return min(index, len(spec) - 1)
+
+    with np.errstate(divide="ignore"):
+        pitches = freq_to_pitch(freqs)
+    roll_mask = (pitches >= 0) & (pitches <= 96)
 
     # Filter pitches to show A0 (MIDI note 21) to C8 (MIDI note 108)
     pitch_mask = (pitches >= 21) & (pitches <= 108)
@@ -235,51 +269,73 @@ def mono_play_and_plot(input_file):
     keys = create_piano_keyboard(ax3)
     ax3.set_title("Piano Keyboard Visualization")
 
-    player = AudioPlayer(mono_samples, sampwidth, framerate)
-    play_thread = threading.Thread(target=player.play_audio)
-    play_thread.start()
+    # Note detection and key intensities are computed ahead of the playhead
+    # on a producer thread, so each animation frame only looks them up
+    frame_dtype = np.dtype([("keys", np.float32, NUM_KEYS), ("notes", np.int16, 3)])
+
+    def analyze_frame(position, out):
+        magnitudes = spec[spec_index(position)]
+        normalized_magnitudes = magnitudes / max(np.max(magnitudes), 1e-12)
+        out["keys"] = np.clip(filterbank.apply(normalized_magnitudes), 0, 1)
+        notes = dominant_key_indices(freqs, magnitudes, piano_freqs)
+        out["notes"] = -1
+        out["notes"][: len(notes)] = notes
 
-    cutoff = 100  # Cutoff frequency in Hz
+    lookahead = LookaheadAnalyzer(analyze_frame, frame_dtype, int(stft.hop * factor))
+    fig.canvas.mpl_connect("close_event", lambda event: lookahead.close())
 
     def update_plot(frame):
-        start = player.current_position
+        start = get_position()
         end = start + segment_len
-        segment = mono_samples[start:end]
-        # segment = rc_high_pass_filter(segment, cutoff, framerate)
+        if cutoff:
+            segment = view.window(start, end)
+        else:
+            segment = mono_samples[start:end]
 
         # Update waveform
         line.set_data(range(len(segment)), segment)
 
-        # Calculate and update FFT
-        freqs, magnitudes = calculate_fft(segment, framerate)
-        pitches = freq_to_pitch(freqs)
-        pitch_mask = (pitches >= 0) & (pitches <= 96)
-
-        normalized_magnitudes = magnitudes / np.max(magnitudes)
-        fft_history.append(normalized_magnitudes[pitch_mask])
-
-        # Update spectrogram
-        spectrogram.set_array(np.array(fft_history).T)
+        # Update spectrogram with the last 10 seconds of frames
+        spec_frame = spec_index(start)
+        history = spec_frame - history_step * np.arange(history_len - 1, -1, -1)
+        columns = spec[np.maximum(history, 0)][:, roll_mask]
+        columns /= np.maximum(columns.max(axis=1, keepdims=True), 1e-12)
+        columns[history < 0] = 0
+        spectrogram.set_array(columns.T)
         spectrogram.set_extent([start / framerate - 10, start / framerate, 0, 96])
 
-        # Find and display dominant notes
-        dominant_notes = find_dominant_notes(freqs, magnitudes, piano_freqs)
-        dominant_notes_text.set_text(f"Dominant Notes: {', '.join(dominant_notes)}")
-
-        # Update piano keyboard visualization
-        for i, key in enumerate(keys):
-            pitch = i + 21  # Start from A0 (MIDI note 21)
-            if pitch <= 108:  # Up to C8 (MIDI note 108)
-                freq = 440 * (
-                    2 ** ((pitch - 69) / 12)
-                )  # Calculate frequency for the pitch
-                intensity = normalized_magnitudes[np.argmin(np.abs(freqs - freq))]
+        # Notes and keys keep their last state if the producer is behind
+        analysis = lookahead.read(start)
+        if analysis is not None:
+            dominant_notes = [key_name(i) for i in analysis["notes"] if i >= 0]
+            dominant_notes_text.set_text(f"Dominant Notes: {', '.join(dominant_notes)}")
+
+            # Keyboard keys A0 (MIDI 21) to C8 (MIDI 108)
+            for key, intensity in zip(keys, analysis["keys"]):
                 if isinstance(key, Rectangle) and key.get_height() < 1:  # Black key
                     key.set_facecolor((intensity, 0, 0))
                 else:  # White key
                     key.set_facecolor((1, 1 - intensity, 1 - intensity))
         return line, spectrogram, dominant_notes_text, *keys
 
+    return fig, update_plot, lookahead.close
+
+
+def mono_play_and_plot(input_file, cutoff=None):
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+
+    mono_samples, sampwidth, framerate = read_mono(input_file)
+
+    # With a cutoff (Hz), playback and the waveform view are RC high-passed live
+    filter_stage = rc_highpass(cutoff, framerate) if cutoff else None
+    player = AudioPlayer(mono_samples, sampwidth, framerate, filter_stage)
+    fig, update_plot, close_plot = create_plot(
+        input_file, mono_samples, framerate, lambda: player.current_position, cutoff
+    )
+    play_thread = threading.Thread(target=player.play_audio)
+    play_thread.start()
+
     ani = FuncAnimation(fig, update_plot, interval=100, blit=True)
 
     print(
@@ -287,6 +343,7 @@ def mono_play_and_plot(input_file):
     )
     plt.tight_layout()
     plt.show()
+    close_plot()
 
     player.stop()
     play_thread.join()
@@ -296,4 +353,5 @@ def mono_play_and_plot(input_file):
 
 if __name__ == "__main__":
     input_file = sys.argv[1]
-    mono_play_and_plot(input_file)
+    cutoff = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    mono_play_and_plot(input_file, cutoff)
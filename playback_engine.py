@@ -0,0 +1,420 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pyaudio
+
+from telemetry import telemetry
+from time_stretch import MAX_SPEED, MIN_SPEED, TimeStretcher, render_loop
+
+# A loop region rendered at `speed`; `audio` repeats seamlessly end to start
+Loop = namedtuple("Loop", ["start", "stop", "speed", "audio"])
+LOOP_ENTRY_CROSSFADE = 512
+PREFETCH_SECONDS = 2.0  # Of output at top speed, read ahead of the callback
+PREFETCH_BEHIND = 8192  # Frames kept behind it, for the stretcher's windows
+PREFETCH_POLL = 0.05
+
+
+class PlaybackEngine:
+    """Persistent callback-mode output stream fed straight from a sample array.
+
+    The PyAudio instance and output stream stay open across play/stop and
+    across files with the same format. Seeks are applied by the audio callback
+    at the start of its next buffer, so they take effect within one buffer.
+
+    `position` is how far the callback has read; `playback_position()` is the
+    frame being heard right now, for drawing.
+
+    The callback never touches `samples` itself, which may be a memory map
+    whose pages are not yet read: a prefetch thread keeps a window of the
+    next few seconds in memory and publishes it as one (first frame, array)
+    tuple, and seeks fill it before returning.
+
+    Away from 1x speed, samples go through a TimeStretcher. A loop region is
+    rendered once, on a background thread, at the current speed; when
+    playback reaches its end it switches to repeating that buffer, so there
+    is no gap between repeats. Seeks and loops are handed to the callback
+    the same way, as immutable values it picks up at its next buffer; only
+    the callback changes where it is reading.
+    """
+
+    def __init__(self, frames_per_buffer=1024):
+        self.frames_per_buffer = frames_per_buffer
+        self.p = pyaudio.PyAudio()
+        self.stream = None
+        self.stream_format = None
+        self.samples = None
+        self._out = None
+        self.nchannels = 1
+        self.framerate = 44100
+        self.nframes = 0
+        self.position = 0
+        self.playing = False
+        self._seek = None  # (serial, frame) of the latest seek
+        self._seeks = 0
+        self._seek_done = 0  # Serial of the last seek the callback applied
+        self._window = (0, np.zeros((1, 0), np.float32))
+        self._prefetch_lock = threading.Lock()
+        self._closed = threading.Event()
+        self.output_latency = 0.0
+        # (monotonic time it is heard, frame, first frame since start/seek,
+        # input frames per output frame)
+        self._clock = None
+        self.speed = 1.0
+        self.stretcher = None
+        self._stretching = False
+        self.loop_range = None
+        self.loop = None  # Published by set_loop, clear_loop and the renderer
+        self._loop_lock = threading.Lock()
+        self._loop_generation = 0
+        # The loop the callback is repeating, and where in its audio
+        self._active_loop = None
+        self._loop_offset = 0
+        self._loop_pending = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._prefetch_loop, daemon=True).start()
+
+    def load(self, samples, framerate):
+        """Play from `samples`, a planar (channels, frames) float32 array."""
+        self.stop()
+        nchannels = samples.shape[0]
+        stream_format = (nchannels, framerate, self.frames_per_buffer)
+        if self.stream is not None and self.stream_format != stream_format:
+            self.stream.close()
+            self.stream = None
+        if self.stream is None:
+            self.stream = self.p.open(
+                format=pyaudio.paFloat32,
+                channels=nchannels,
+                rate=framerate,
+                output=True,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self.callback,
+                start=False,
+            )
+            self.stream_format = stream_format
+            self.output_latency = self.stream.get_output_latency()
+
+        with self._prefetch_lock:
+            self.samples = samples
+            self.nchannels = nchannels
+            self.framerate = framerate
+            self.nframes = samples.shape[1]
+            self.position = 0
+            self._seek = None
+            self._window = (0, np.zeros((nchannels, 0), np.float32))
+            self._refill(0)
+        self._clock = None
+        self.stretcher = TimeStretcher(nchannels)
+        self._stretching = False
+        self._active_loop = None
+        self._loop_pending = None
+        self.clear_loop()
+
+    def replace_samples(self, samples):
+        """Go on from `samples`, which must hold the same audio as before.
+
+        For switching a file that plays from its memory map to a copy decoded
+        in memory meanwhile; playback is not interrupted.
+        """
+        with self._prefetch_lock:
+            self.samples = samples
+
+    def callback(self, in_data, frame_count, time_info, status):
+        started = time.perf_counter()
+        # PortAudio knows when this buffer reaches the DAC; fall back to the
+        # latency it reported when the stream was opened
+        delay = time_info.get("output_buffer_dac_time", 0) - time_info.get(
+            "current_time", 0
+        )
+        if not 0 < delay < 1:
+            delay = self.output_latency
+        result = self._fill(frame_count, time.monotonic() + delay)
+        telemetry.audio_callback(
+            status, time.perf_counter() - started, frame_count / self.framerate
+        )
+        return result
+
+    def _fill(self, frame_count, heard_at):
+        seek = self._seek
+        if seek is not None and seek[0] != self._seek_done:
+            self._seek_done = seek[0]
+            self.position = seek[1]
+            self._clock = None
+            self._stretching = False
+            self._active_loop = None
+            self._loop_pending = None
+
+        # One read of the published loop per buffer
+        loop = self.loop
+        if self._active_loop is not None and loop is not self._active_loop:
+            self._switch_loop(loop)
+
+        start = self.position
+        complete = False
+        if self._active_loop is not None:
+            start = loop.start + int(self._loop_offset * loop.speed)
+            speed = loop.speed
+            chunk = self._read_loop(loop, frame_count)
+            self.position = min(start + int(frame_count * speed), loop.stop)
+        elif self._stretching or self.speed != 1:
+            if not self._stretching:
+                # Starts out identical to the raw samples, so no click
+                self.stretcher.reset(start)
+                self._stretching = True
+            speed = self.speed
+            chunk = self._stretch(frame_count, speed)
+            self.position = min(int(self.stretcher.position), self.nframes)
+            complete = self.stretcher.position >= self.nframes
+        else:
+            speed = 1.0
+            end = min(start + frame_count, self.nframes)
+            chunk = self._read(start, end)
+            self.position = end
+            complete = end - start < frame_count
+
+        if (
+            loop is not None
+            and self._active_loop is None
+            and start < loop.stop <= self.position
+        ):
+            chunk = self._enter_loop(loop, chunk, start, speed, frame_count)
+            complete = False
+        origin = start if self._clock is None else self._clock[2]
+        self._clock = (heard_at, start, origin, speed)
+
+        # Interleave into a reused (frames, channels) buffer
+        if self._out is None or self._out.shape != (frame_count, self.nchannels):
+            self._out = np.zeros((frame_count, self.nchannels), dtype=np.float32)
+        out = self._out
+        n = chunk.shape[1]
+        out[:n] = chunk.T
+        if complete:
+            # Pad the final buffer with silence and let the stream wind down
+            out[n:] = 0
+            self.playing = False
+            return (out.tobytes(), pyaudio.paComplete)
+        return (out.tobytes(), pyaudio.paContinue)
+
+    def _switch_loop(self, loop):
+        """Follow a loop that was re-rendered, moved or cleared while in it."""
+        active = self._active_loop
+        if loop is not None and loop[:2] == active[:2]:
+            # Same region at another speed: keep the place within it
+            offset = int(self._loop_offset * active.speed / loop.speed)
+            self._loop_offset = offset % loop.audio.shape[1]
+            self._active_loop = loop
+        else:
+            # Carry on from the place reached instead of the loop end
+            self.position = active.start + int(self._loop_offset * active.speed)
+            self._active_loop = None
+            self._loop_pending = None
+            self._stretching = False
+
+    def _read(self, start, stop):
+        """Frames [start, stop) from the prefetched window, silence if missing."""
+        first, window = self._window
+        if stop <= start or (first <= start and stop <= first + window.shape[1]):
+            return window[:, start - first : stop - first]
+        telemetry.count("audio.prefetch_miss")
+        chunk = np.zeros((self.nchannels, stop - start), np.float32)
+        low, high = max(start, first), min(stop, first + window.shape[1])
+        if low < high:
+            chunk[:, low - start : high - start] = window[:, low - first : high - first]
+        return chunk
+
+    def _stretch(self, frame_count, speed):
+        first, window = self._window
+        position = int(self.stretcher.position)
+        margin = 2 * self.stretcher.n_fft
+        low = max(0, position - margin)
+        high = min(self.nframes, position + int(frame_count * speed) + margin)
+        if not first <= low or high > first + window.shape[1]:
+            telemetry.count("audio.prefetch_miss")
+        return self.stretcher.process(window, frame_count, speed, first)
+
+    def _enter_loop(self, loop, chunk, start, speed, frame_count):
+        """Cut this buffer at the loop end and go on with the rendered repeat.
+
+        Live output and the rendered loop have different phases, so the live
+        audio past the end is crossfaded into the head of the loop.
+        """
+        cut = min(int(round((loop.stop - start) / speed)), chunk.shape[1])
+        crossfade = min(LOOP_ENTRY_CROSSFADE, loop.audio.shape[1])
+        missing = cut + crossfade - chunk.shape[1]
+        if missing > 0:
+            if self._stretching:
+                extra = self._stretch(missing, speed)
+            else:
+                first = start + chunk.shape[1]
+                extra = np.zeros((self.nchannels, missing), np.float32)
+                tail = self._read(first, min(first + missing, self.nframes))
+                extra[:, : tail.shape[1]] = tail
+            chunk = np.concatenate([chunk, extra], axis=1)
+        fade = np.linspace(0, 1, crossfade, dtype=np.float32)
+        live = chunk[:, cut : cut + crossfade] * (1 - fade)
+        self._loop_pending = live + loop.audio[:, :crossfade] * fade
+        self._loop_offset = crossfade % loop.audio.shape[1]
+        self._active_loop = loop
+        rest = self._read_loop(loop, frame_count - cut)
+        return np.concatenate([chunk[:, :cut], rest], axis=1)
+
+    def _read_loop(self, loop, frame_count):
+        parts = []
+        pending = self._loop_pending
+        if pending is not None and pending.shape[1]:
+            parts.append(pending[:, :frame_count])
+            self._loop_pending = pending[:, frame_count:]
+            frame_count -= parts[0].shape[1]
+        if frame_count > 0:
+            length = loop.audio.shape[1]
+            index = (self._loop_offset + np.arange(frame_count)) % length
+            self._loop_offset = (index[-1] + 1) % length
+            parts.append(loop.audio[:, index])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+    def playback_position(self):
+        """Frame at the speaker now, interpolated from the last callback.
+
+        Cheap enough to call on every display frame; between callbacks the
+        position advances smoothly with the monotonic clock.
+        """
+        seek = self._seek
+        if seek is not None and seek[0] != self._seek_done:
+            return seek[1]
+        clock = self._clock
+        if not self.playing or clock is None:
+            return self.position
+        heard_at, frame, origin, speed = clock
+        position = frame + (time.monotonic() - heard_at) * self.framerate * speed
+        # Before `origin` is heard, the audio from before a seek is still
+        # playing out; hold the playhead at the seek target meanwhile
+        return int(max(origin, min(position, self.position)))
+
+    def play(self):
+        with self._lock:
+            if self.stream is None or self.playing:
+                return
+            if self.position >= self.nframes:
+                self.position = 0
+            # A stream that ran to the end is inactive but not yet stopped
+            if not self.stream.is_stopped():
+                self.stream.stop_stream()
+            self._clock = None
+            self._stretching = False
+            with self._prefetch_lock:
+                self._refill(self._resume_position())
+            self.playing = True
+            self.stream.start_stream()
+
+    def stop(self):
+        with self._lock:
+            self.playing = False
+            if self.stream is not None and not self.stream.is_stopped():
+                self.stream.stop_stream()
+
+    def seek(self, position):
+        position = max(0, min(int(position), self.nframes))
+        with self._prefetch_lock:
+            # The target is in memory before the callback can get to it
+            self._refill(position)
+            if self.playing:
+                self._seeks += 1
+                self._seek = (self._seeks, position)
+            else:
+                self._seek = None
+                self.position = position
+                self._clock = None
+
+    def _prefetch_loop(self):
+        while not self._closed.wait(PREFETCH_POLL):
+            with self._prefetch_lock:
+                self._refill(self._resume_position())
+
+    def _resume_position(self):
+        """Where the callback reads next: a pending seek's target, if any."""
+        seek = self._seek
+        if seek is not None and seek[0] != self._seek_done:
+            return seek[1]
+        return self.position
+
+    def _refill(self, position):
+        """Slide the window to cover `position`, reading only what is new.
+
+        Called with the prefetch lock held. Does nothing while at least half
+        of the read-ahead is still in the window.
+        """
+        if self.samples is None:
+            return
+        ahead = int(PREFETCH_SECONDS * MAX_SPEED * self.framerate)
+        low = max(0, position - PREFETCH_BEHIND)
+        high = min(self.nframes, position + ahead)
+        first, window = self._window
+        last = first + window.shape[1]
+        if first <= low and min(high, position + ahead // 2) <= last:
+            return
+        with telemetry.timer("audio.prefetch"):
+            refilled = np.empty((self.nchannels, high - low), np.float32)
+            keep_low, keep_high = max(low, first), min(high, last)
+            if keep_low < keep_high:
+                refilled[:, keep_low - low : keep_high - low] = window[
+                    :, keep_low - first : keep_high - first
+                ]
+                gaps = [(low, keep_low), (keep_high, high)]
+            else:
+                gaps = [(low, high)]
+            for start, stop in gaps:
+                if start < stop:
+                    refilled[:, start - low : stop - low] = self.samples[:, start:stop]
+            self._window = (low, refilled)
+
+    def set_speed(self, speed):
+        """Play at `speed` times the original tempo, keeping the pitch."""
+        self.speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+        if self.loop_range is not None:
+            self._render_loop()
+
+    def set_loop(self, start, stop):
+        """Repeat frames [start, stop) once playback reaches `stop`."""
+        start = max(0, min(int(start), self.nframes))
+        stop = max(0, min(int(stop), self.nframes))
+        if stop <= start:
+            return
+        self.loop_range = (start, stop)
+        with self._loop_lock:
+            self.loop = None
+        self._render_loop()
+
+    def clear_loop(self):
+        # A callback inside the loop carries on from where it is in it
+        with self._loop_lock:
+            self._loop_generation += 1
+            self.loop_range = None
+            self.loop = None
+
+    def _render_loop(self):
+        with self._loop_lock:
+            self._loop_generation += 1
+            generation = self._loop_generation
+        start, stop = self.loop_range
+        samples, speed = self.samples, self.speed
+
+        def render():
+            with telemetry.timer("audio.loop_render"):
+                audio = render_loop(samples, start, stop, speed)
+            # Checked and published together, so a loop cleared meanwhile
+            # stays cleared
+            with self._loop_lock:
+                if generation == self._loop_generation:
+                    self.loop = Loop(start, stop, speed, audio)
+
+        threading.Thread(target=render, daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        self.stop()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.p.terminate()
@@ -0,0 +1,136 @@
+"""Load test for the analysis service.
+
+    python service_load_test.py song.wav [more.wav ...] [-c CLIENTS] [-n REQUESTS]
+        [--ops tempo,spectrogram,notes,loudness] [--spawn]
+
+Each client thread sends its share of the requests over its own connection,
+picking files and ops at random, and the latency of every request is
+reported per op along with the service's own counters: how many requests
+were computed, answered from the cache, or coalesced with one in flight.
+With --spawn a fresh service with an empty cache is started for the run,
+so the first requests for each file show the cold path and coalescing.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from analysis_client import AnalysisClient, AnalysisServiceError
+from service_protocol import DEFAULT_SOCKET
+
+COUNTERS = ["requests", "computed", "cache_hit", "coalesced", "errors"]
+
+
+def spawn_service(directory, workers=None):
+    """Start a service with its own socket and cache; (process, socket path)."""
+    path = os.path.join(directory, "service.sock")
+    env = dict(os.environ, MUSIC2_CACHE_DIR=os.path.join(directory, "cache"))
+    service = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "analysis_service.py"
+    )
+    command = [sys.executable, service, "--socket", path]
+    if workers:
+        command += ["-j", str(workers)]
+    process = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            AnalysisClient(path).close()
+            return process, path
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("analysis service did not start")
+            time.sleep(0.05)
+
+
+def run_client(path, jobs, latencies, errors):
+    with AnalysisClient(path) as client:
+        for op, file in jobs:
+            started = time.perf_counter()
+            try:
+                getattr(client, op)(file)
+            except AnalysisServiceError as e:
+                errors.append(f"{op} {file}: {e}")
+                continue
+            latencies.setdefault(op, []).append(time.perf_counter() - started)
+
+
+def load_test(path, files, clients, requests, ops, seed=0):
+    rng = random.Random(seed)
+    jobs = [(rng.choice(ops), rng.choice(files)) for _ in range(requests)]
+    with AnalysisClient(path) as client:
+        before = client.stats()["counters"]
+
+    per_client = [jobs[i::clients] for i in range(clients)]
+    latencies = [{} for _ in range(clients)]
+    errors = []
+    threads = [
+        threading.Thread(target=run_client, args=(path, j, l, errors))
+        for j, l in zip(per_client, latencies)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with AnalysisClient(path) as client:
+        after = client.stats()["counters"]
+    print(
+        f"{requests} requests from {clients} clients in {elapsed:.2f} s "
+        f"({requests / elapsed:.1f} requests/s)"
+    )
+    for op in ops:
+        times = np.concatenate([l.get(op, []) for l in latencies]) * 1e3
+        if len(times):
+            p50, p90, p99 = np.percentile(times, [50, 90, 99])
+            print(
+                f"  {op:12} n={len(times):<5} p50 {p50:8.2f}  p90 {p90:8.2f}  "
+                f"p99 {p99:8.2f}  max {times.max():8.2f} ms"
+            )
+    counts = {
+        name: after.get(f"service.{name}", 0) - before.get(f"service.{name}", 0)
+        for name in COUNTERS
+    }
+    print("  service: " + ", ".join(f"{n} {v}" for n, v in counts.items()))
+    for error in errors[:10]:
+        print(f"  error: {error}", file=sys.stderr)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-c", "--clients", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("--ops", default="tempo,spectrogram,notes,loudness")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    files = [os.path.abspath(f) for f in args.files]
+    ops = args.ops.split(",")
+
+    if not args.spawn:
+        load_test(args.socket, files, args.clients, args.requests, ops)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        process, path = spawn_service(directory, args.workers)
+        try:
+            load_test(path, files, args.clients, args.requests, ops)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Wire format shared by the analysis service and its clients.
+
+A message is a 4-byte big-endian length, that many bytes of JSON header,
+then the raw bytes of the arrays the header lists under "arrays" as
+[name, dtype, shape], back to back in that order. Arrays travel in their
+native dtype, so a float32 spectrogram costs four bytes per value on the
+wire and is read back without any parsing.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from analysis_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_SOCKET = os.environ.get(
+    "MUSIC2_SERVICE_SOCKET", os.path.join(DEFAULT_CACHE_DIR, "service.sock")
+)
+LENGTH = struct.Struct(">I")
+
+
+def _dtype_spec(dtype):
+    # Structured dtypes (e.g. notes) go by their field list
+    return dtype.descr if dtype.names else dtype.str
+
+
+def _dtype(spec):
+    if isinstance(spec, str):
+        return np.dtype(spec)
+    return np.dtype([tuple(field) for field in spec])
+
+
+def encode(header, arrays=None):
+    """The buffers of one message, to be written in order."""
+    arrays = {name: np.ascontiguousarray(a) for name, a in (arrays or {}).items()}
+    header = dict(header)
+    header["arrays"] = [
+        [name, _dtype_spec(a.dtype), list(a.shape)] for name, a in arrays.items()
+    ]
+    data = json.dumps(header).encode()
+    return [LENGTH.pack(len(data)) + data] + [
+        memoryview(a.reshape(-1).view(np.uint8)) for a in arrays.values() if a.nbytes
+    ]
+
+
+def _decode_arrays(header, read):
+    arrays = {}
+    for name, spec, shape in header.pop("arrays", []):
+        dtype = _dtype(spec)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        arrays[name] = np.frombuffer(read(nbytes), dtype).reshape(shape)
+    return header, arrays
+
+
+def send_message(sock, header, arrays=None):
+    for buffer in encode(header, arrays):
+        sock.sendall(buffer)
+
+
+def recv_message(sock):
+    """(header, arrays) of the next message on a blocking socket."""
+
+    def read(n):
+        buffer = bytearray(n)
+        view = memoryview(buffer)
+        while view:
+            received = sock.recv_into(view)
+            if received == 0:
+                raise ConnectionError("analysis service closed the connection")
+            view = view[received:]
+        return buffer
+
+    (length,) = LENGTH.unpack(read(LENGTH.size))
+    return _decode_arrays(json.loads(read(length)), read)
+
+
+async def read_message(reader):
+    """(header, arrays) of the next message on an asyncio stream."""
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    header = json.loads(await reader.readexactly(length))
+    sizes = [
+        _dtype(spec).itemsize * int(np.prod(shape))
+        for _, spec, shape in header.get("arrays", [])
+    ]
+    payload = await reader.readexactly(sum(sizes))
+    offsets = iter(np.cumsum([0] + sizes))
+
+    def read(n):
+        start = next(offsets)
+        return payload[start : start + n]
+
+    return _decode_arrays(header, read)
+
+
+async def write_message(writer, header, arrays=None):
+    for buffer in encode(header, arrays):
+        writer.write(buffer)
+    await writer.drain()
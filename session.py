@@ -0,0 +1,302 @@
+import os
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from analysis_scheduler import AnalysisScheduler
+from audio_buffer import AudioBuffer
+from telemetry import telemetry
+from wav_file import WavFile
+
+PRELOAD_TRACKS = 2  # Tracks after the current one kept decoded and analyzed
+PRELOAD_WORKERS = 1  # Analysis processes for preloading, apart from the GUI's
+SESSION_BYTES = int(os.environ.get("MUSIC2_SESSION_MB", 1024)) << 20
+
+
+class Track:
+    """A playlist entry with its audio and the analysis results so far.
+
+    `results` maps the analysis scheduler's result kinds to their latest
+    value; `analyzed` is set once all of them are final.
+    """
+
+    def __init__(self, path, wav=None, audio=None):
+        self.path = path
+        self.wav = wav
+        self.audio = audio
+        self.results = {}
+        self.analyzed = False
+
+    @property
+    def nbytes(self):
+        # The samples and the peak data dominate; the rest is a few KiB
+        total = self.audio.data.nbytes if self.audio is not None else 0
+        if "pyramid" in self.results:
+            total += self.results["pyramid"].nbytes
+        if "loudness" in self.results:
+            total += self.results["loudness"].steps.nbytes
+        return total
+
+
+class TrackCache:
+    """LRU of tracks by path, bounded by their total size in bytes.
+
+    Tracks in `keep` (the current one and those being preloaded) are never
+    evicted, so the cache can be over budget while they alone exceed it.
+    """
+
+    def __init__(self, max_bytes=SESSION_BYTES):
+        self.max_bytes = max_bytes
+        self._tracks = OrderedDict()
+
+    def __contains__(self, path):
+        return path in self._tracks
+
+    @property
+    def bytes(self):
+        # Summed on demand: tracks grow as their analysis results arrive
+        return sum(track.nbytes for track in self._tracks.values())
+
+    def get(self, path):
+        track = self._tracks.get(path)
+        if track is not None:
+            self._tracks.move_to_end(path)
+        return track
+
+    def put(self, track, keep=()):
+        self._tracks[track.path] = track
+        self._tracks.move_to_end(track.path)
+        self.evict(keep)
+
+    def evict(self, keep=()):
+        total = self.bytes
+        for path in list(self._tracks):
+            if total <= self.max_bytes:
+                break
+            if path not in keep:
+                total -= self._tracks.pop(path).nbytes
+
+    def has_room(self, nbytes, keep=()):
+        """Whether `nbytes` more fit once everything outside `keep` is evicted."""
+        kept = sum(t.nbytes for p, t in self._tracks.items() if p in keep)
+        return kept + nbytes <= self.max_bytes
+
+    def clear(self):
+        self._tracks.clear()
+
+
+def _decode(wav):
+    # Into memory rather than the cache's mapping, so that switching to the
+    # track later never waits on the disk
+    with telemetry.timer("session.decode"):
+        return AudioBuffer.in_memory(wav)
+
+
+def _decoded_bytes(wav):
+    return 4 * wav.nchannels * wav.nframes
+
+
+class Session(QObject):
+    """A playlist whose next few tracks are decoded and analyzed ahead.
+
+    Selecting a track never decodes it on the caller's thread: a track that
+    is not in memory yet plays from the file's memory map, and is decoded
+    on a thread meanwhile if it fits in the memory budget; `decoded` is
+    emitted with the track once its audio has been swapped for that copy.
+
+    While the current track is playing, the next `preload` tracks are
+    decoded the same way and analyzed by a scheduler of their own, one at a
+    time, as long as they fit next to the current one. Selecting a
+    preloaded track then needs no decoding or analysis. Decoded tracks stay
+    in an LRU, so going back to one is just as quick while it has not been
+    evicted.
+
+    The GUI analyzes the current track itself and records the results in
+    the track; preloading is held back until it calls preload().
+    """
+
+    decoded = Signal(object)
+    _decode_done = Signal()
+
+    def __init__(
+        self,
+        parent=None,
+        preload=PRELOAD_TRACKS,
+        max_bytes=SESSION_BYTES,
+        max_workers=PRELOAD_WORKERS,
+    ):
+        super().__init__(parent)
+        self.preload_tracks = preload
+        self.cache = TrackCache(max_bytes)
+        self.paths = []
+        self.index = -1
+        self.generation = 0
+        self._failed = set()  # Paths that could not be preloaded
+        self._decoding = None  # (track, future) of the decode in flight
+        self._preloading = None  # Track the scheduler is analyzing
+        self._preload_wanted = False
+        self._closed = False
+        self.decoder = ThreadPoolExecutor(1)
+        self._done = queue.SimpleQueue()
+        self._decode_done.connect(self._drain_decoded)
+        self.scheduler = AnalysisScheduler(self, max_workers)
+        self.scheduler.result_ready.connect(self._on_result)
+        self.scheduler.finished.connect(self._on_analyzed)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def set_playlist(self, paths):
+        """Replace the playlist; decoded tracks are kept for reuse."""
+        self._stop_preload()
+        self.paths = list(paths)
+        self.index = -1
+        self._failed.clear()
+
+    def select(self, index):
+        """The track at `index`, playing from its file until it is decoded."""
+        path = self.paths[index]
+        track = self.cache.get(path)
+        if track is None and self._decoding and self._decoding[0].path == path:
+            # Being preloaded; let that decode finish rather than start over
+            track = self._decoding[0]
+        self._stop_preload(keep=track)
+        self.index = index
+        if track is None:
+            telemetry.count("session.miss")
+            track = Track(path, WavFile(path))
+        else:
+            telemetry.count("session.hit")
+        if track.audio is None:
+            track.audio = AudioBuffer.open(track.wav)
+        keep = self._window()
+        self.cache.put(track, keep)
+        if (
+            track.audio.lazy
+            and self._decoding is None
+            and self.cache.has_room(_decoded_bytes(track.wav), keep)
+        ):
+            self._start_decode(track)
+        return track
+
+    def _window(self):
+        return self.paths[max(0, self.index) : self.index + 1 + self.preload_tracks]
+
+    def preload(self):
+        """Start preloading the tracks after the current one."""
+        self._preload_wanted = True
+        self._preload_step()
+
+    def _preload_step(self):
+        # Decode and analyze the next track that is not yet, if it fits
+        if not self._preload_wanted or self.index < 0:
+            return
+        if self._decoding or self._preloading:
+            return
+        keep = self._window()
+        for path in keep[1:]:
+            if path in self._failed:
+                continue
+            track = self.cache.get(path)
+            if track is None:
+                try:
+                    track = Track(path, WavFile(path))
+                except (OSError, ValueError):
+                    self._failed.add(path)
+                    continue
+            if track.audio is None or track.audio.lazy:
+                if not self.cache.has_room(_decoded_bytes(track.wav), keep):
+                    return
+                self._start_decode(track)
+                return
+            if not track.analyzed:
+                self._analyze(track)
+                return
+
+    def _start_decode(self, track):
+        future = self.decoder.submit(_decode, track.wav)
+        self._decoding = (track, future)
+        future.add_done_callback(self._on_decode_done)
+
+    def _on_decode_done(self, future):
+        # Runs on the decoder thread; the GUI thread picks the result up
+        if self._closed:
+            return
+        self._done.put(future)
+        self._decode_done.emit()
+
+    def _drain_decoded(self):
+        while True:
+            try:
+                future = self._done.get_nowait()
+            except queue.Empty:
+                return
+            if self._decoding is None or self._decoding[1] is not future:
+                continue  # Dropped meanwhile
+            track = self._decoding[0]
+            self._decoding = None
+            if future.exception() is not None:
+                # Still plays from the file; it is just not preloaded
+                self._failed.add(track.path)
+            elif track.audio is None:
+                track.audio = future.result()
+                self.cache.put(track, self._window())
+            else:
+                # Playing from the file: swap in the copy, same audio
+                track.audio.data = future.result().data
+                self.cache.put(track, self._window())
+                self.decoded.emit(track)
+            self._preload_step()
+
+    def _analyze(self, track):
+        self._preloading = track
+        self.scheduler.start(track.wav)
+
+    def _preload_next(self):
+        # Later rather than from inside the scheduler's signals: it may still
+        # cancel after emitting, and finishes cached files within start()
+        generation = self.generation
+        QTimer.singleShot(0, lambda: self._resume(generation))
+
+    def _resume(self, generation):
+        if generation == self.generation:
+            self._preload_step()
+
+    def _on_result(self, generation, kind, value):
+        if generation != self.scheduler.generation or self._preloading is None:
+            return
+        if kind == "error":
+            self._failed.add(self._preloading.path)
+            self._preloading = None
+            self._preload_next()
+        else:
+            self._preloading.results[kind] = value
+
+    def _on_analyzed(self, generation):
+        if generation != self.scheduler.generation or self._preloading is None:
+            return
+        self._preloading.analyzed = True
+        self._preloading = None
+        telemetry.count("session.preloaded")
+        # The pyramid has grown the track since it was put in the cache
+        self.cache.evict(self._window())
+        self._preload_next()
+
+    def _stop_preload(self, keep=None):
+        # A decode already running finishes on its own; its result is dropped
+        # unless it is for `keep`, the track being selected
+        self.generation += 1
+        self._preload_wanted = False
+        if self._decoding is not None and self._decoding[0] is not keep:
+            self._decoding[1].cancel()
+            self._decoding = None
+        self._preloading = None
+        self.scheduler.cancel()
+
+    def shutdown(self):
+        self._closed = True
+        self._stop_preload()
+        self.scheduler.shutdown()
+        self.decoder.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,136 @@
+"""Check import time of the analysis core and GUI time-to-window.
+
+    python startup_budget.py [--runs N]
+
+Each measurement runs in a fresh interpreter and the best of N runs is
+compared against its budget. Exits non-zero if a budget is exceeded or if
+importing the core pulls in Qt, matplotlib, pyaudio or scipy.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# The front end and command-line tools; every other top-level module is
+# part of the analysis core, so modules added later are checked unlisted
+NON_CORE_MODULES = {
+    "analysis_scheduler",
+    "analysis_service",
+    "audio_handler",
+    "batch_analyze",
+    "benchmark",
+    "main",
+    "music_explainer",
+    "piano_roll_widget",
+    "play_wave",
+    "playback_engine",
+    "service_load_test",
+    "session",
+    "startup_budget",
+    "waveform_widget",
+}
+# Optional heavy dependencies that must only load on first use
+LAZY_PACKAGES = ["PySide6", "matplotlib", "pyaudio", "scipy"]
+
+CORE_IMPORT_BUDGET = 0.3  # seconds, self-reported by -X importtime
+TIME_TO_WINDOW_BUDGET = 1.0  # seconds, from process launch to first paint
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def core_modules():
+    return sorted(
+        name[:-3]
+        for name in os.listdir(HERE)
+        if name.endswith(".py") and name[:-3] not in NON_CORE_MODULES
+    )
+
+
+_CORE_SCRIPT = """
+import json, sys
+import {modules}
+print(json.dumps(sorted({{m.split(".")[0] for m in sys.modules}} & set({lazy}))))
+"""
+
+_WINDOW_SCRIPT = """
+import sys
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
+from music_explainer import MusicExplainer
+
+app = QApplication(sys.argv)
+window = MusicExplainer()
+window.show()
+QTimer.singleShot(0, lambda: (print("shown", flush=True), app.quit()))
+app.exec()
+"""
+
+
+def measure_core_import():
+    """(seconds, heavy packages loaded) for importing the core modules."""
+    script = _CORE_SCRIPT.format(modules=", ".join(core_modules()), lazy=LAZY_PACKAGES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | package", nesting by indent
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            total_us += int(cumulative)
+    return total_us / 1e6, json.loads(result.stdout.splitlines()[-1])
+
+
+def measure_time_to_window():
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", _WINDOW_SCRIPT],
+        cwd=HERE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - started
+    process.wait()
+    if line.strip() != "shown":
+        raise RuntimeError("main window did not come up")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--skip-gui", action="store_true", help="only measure the core import"
+    )
+    args = parser.parse_args(argv)
+
+    ok = True
+    core = [measure_core_import() for _ in range(args.runs)]
+    core_time = min(seconds for seconds, _ in core)
+    loaded = core[0][1]
+    ok &= core_time <= CORE_IMPORT_BUDGET and not loaded
+    print(f"core import:    {core_time:.3f} s (budget {CORE_IMPORT_BUDGET} s)")
+    if loaded:
+        print(f"  core import loaded {', '.join(loaded)}")
+
+    if not args.skip_gui:
+        window_time = min(measure_time_to_window() for _ in range(args.runs))
+        ok &= window_time <= TIME_TO_WINDOW_BUDGET
+        print(f"time to window: {window_time:.3f} s (budget {TIME_TO_WINDOW_BUDGET} s)")
+
+    print("OK" if ok else "OVER BUDGET")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
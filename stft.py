@@ -0,0 +1,128 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from analysis_cache import artifact_key, default_cache, file_fingerprint
+
+
+class STFT:
+    """Batched short-time Fourier transform over a whole signal.
+
+    Frame i covers samples [i * hop, i * hop + n_fft). Frames are strided
+    views into the signal and are transformed `chunk_frames` at a time, so
+    memory stays bounded regardless of signal length.
+    """
+
+    def __init__(self, n_fft, hop=None, window="hann", chunk_frames=512):
+        # scipy.signal takes over a second to import, so the analysis modules
+        # only pull in scipy when they first need it, keeping them cheap to
+        # import for the GUI and for scripts
+        from scipy.signal import get_window
+
+        self.n_fft = n_fft
+        self.hop = hop or n_fft // 4
+        self.window_name = window
+        self.window = get_window(window, n_fft).astype(np.float32)
+        self.chunk_frames = chunk_frames
+
+    @property
+    def n_bins(self):
+        return self.n_fft // 2 + 1
+
+    def frequencies(self, sample_rate):
+        from scipy.fft import rfftfreq
+
+        return rfftfreq(self.n_fft, 1 / sample_rate)
+
+    def num_frames(self, n_samples):
+        if n_samples < self.n_fft:
+            return 0
+        return 1 + (n_samples - self.n_fft) // self.hop
+
+    def frame_index(self, sample_position):
+        return max(0, int(sample_position) // self.hop)
+
+    def compute(self, samples, out=None):
+        """Return an (n_frames, n_bins) float32 magnitude spectrogram."""
+        from scipy.fft import rfft
+
+        n_frames = self.num_frames(len(samples))
+        if out is None:
+            out = np.empty((n_frames, self.n_bins), dtype=np.float32)
+
+        dtype = np.asarray(samples[:0]).dtype
+        scale = 1.0 / (np.iinfo(dtype).max + 1) if dtype.kind == "i" else 1.0
+
+        for first in range(0, n_frames, self.chunk_frames):
+            last = min(first + self.chunk_frames, n_frames)
+            start = first * self.hop
+            stop = (last - 1) * self.hop + self.n_fft
+            chunk = np.asarray(samples[start:stop], dtype=np.float32)
+            frames = sliding_window_view(chunk, self.n_fft)[:: self.hop]
+            spectrum = rfft(frames * (self.window * scale), axis=-1)
+            out[first:last] = np.abs(spectrum)
+        return out
+
+    def compute_cached(self, audio_path, samples, signal, sample_rate, cache=None):
+        """Like compute(), but stored in the analysis cache and memory-mapped.
+
+        Entries are keyed by the content of `audio_path`, so renamed or
+        copied files still hit the cache. `signal` names which signal derived
+        from the file `samples` is (e.g. "mono", or "left" after a filter),
+        and together with `sample_rate` identifies it. `samples` may also be
+        a function returning the signal, called only on a miss, so that
+        deriving it costs nothing when the spectrogram is cached.
+        """
+        cache = cache or default_cache()
+        key = artifact_key(
+            file_fingerprint(audio_path),
+            "stft",
+            signal=signal,
+            sample_rate=sample_rate,
+            n_fft=self.n_fft,
+            hop=self.hop,
+            window=self.window_name,
+        )
+        cached = cache.load(key)
+        if cached is not None:
+            return cached[1]["spectrogram"]
+
+        if callable(samples):
+            samples = samples()
+        tmp_dir = cache.begin(key)
+        out = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "spectrogram.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(self.num_frames(len(samples)), self.n_bins),
+        )
+        self.compute(samples, out)
+        out.flush()
+        del out
+        cache.commit(key, tmp_dir)
+        return cache.load(key)[1]["spectrogram"]
+
+
+class StreamingSTFT:
+    """Feeds consecutive chunks of a signal through an STFT.
+
+    Samples that do not yet fill a whole frame are carried over, so the
+    frames returned across feed() calls are exactly those of the whole
+    signal.
+    """
+
+    def __init__(self, stft):
+        self.stft = stft
+        self.frames_done = 0
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        samples = np.asarray(samples)
+        chunk = samples.astype(np.float32)
+        if samples.dtype.kind == "i":
+            chunk /= np.iinfo(samples.dtype).max + 1
+        buffer = np.concatenate([self._pending, chunk])
+        spectrogram = self.stft.compute(buffer)
+        self._pending = buffer[len(spectrogram) * self.stft.hop :]
+        self.frames_done += len(spectrogram)
+        return spectrogram
@@ -0,0 +1,132 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# PortAudio callback status flags (pyaudio.paInputUnderflow etc.)
+STATUS_FLAGS = {
+    0x1: "input_underflow",
+    0x2: "input_overflow",
+    0x4: "output_underflow",
+    0x8: "output_overflow",
+}
+
+
+class Histogram:
+    """Counts of values in log-spaced buckets, from 10 us to about 40 s.
+
+    Recording is O(log buckets) and allocation-free, so it is safe to call
+    from the audio callback. Percentiles are the upper bound of their
+    bucket, so they are accurate to a factor of sqrt(2).
+    """
+
+    BOUNDS = [1e-5 * 2 ** (i / 2) for i in range(44)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0-100)."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return (
+                    min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+                )
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Telemetry:
+    """Named counters and duration histograms shared by the whole app.
+
+    Everything can be recorded from any thread; a snapshot is taken under
+    the same lock.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def audio_callback(self, status, seconds, deadline):
+        """Record one audio callback that took `seconds` of a `deadline` budget."""
+        self.record("audio.callback", seconds)
+        if seconds > deadline:
+            self.count("audio.deadline_missed")
+        for flag, name in STATUS_FLAGS.items():
+            if status & flag:
+                self.count(f"audio.{name}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "histograms": {k: h.summary() for k, h in self.histograms.items()},
+            }
+
+    def format(self, snapshot=None):
+        """Multi-line text summary, durations in milliseconds."""
+        snapshot = snapshot or self.snapshot()
+        lines = []
+        for name, h in sorted(snapshot["histograms"].items()):
+            lines.append(
+                f"{name:22} n={h['count']:<6} p50 {h['p50'] * 1e3:7.2f}  "
+                f"p99 {h['p99'] * 1e3:7.2f}  max {h['max'] * 1e3:7.2f} ms"
+            )
+        for name, n in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:22} {n}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Append a snapshot to `path` as one JSON line."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+
+telemetry = Telemetry()
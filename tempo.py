@@ -0,0 +1,135 @@
+from collections import namedtuple
+
+import numpy as np
+
+from stft import STFT, StreamingSTFT
+
+Tempo = namedtuple("Tempo", ["bpm", "beats"])  # beats in seconds
+MIN_BPM, MAX_BPM = 30.0, 240.0
+PRIOR_BPM = 120.0  # Centre of the preference that resolves octave errors
+
+
+def onset_strength(spectrogram, previous=None):
+    """Spectral flux of an (n_frames, n_bins) magnitude spectrogram.
+
+    `previous` is the log spectrum of the frame before the first row, for
+    continuing an envelope across chunks. Returns (envelope, last log frame).
+    """
+    log_spec = np.log1p(100 * np.asarray(spectrogram, dtype=np.float32))
+    if len(log_spec) == 0:
+        return np.zeros(0, dtype=np.float32), previous
+    if previous is None:
+        previous = log_spec[:1]
+    flux = np.diff(log_spec, axis=0, prepend=previous.reshape(1, -1))
+    envelope = np.maximum(flux, 0).mean(axis=1)
+    return envelope, log_spec[-1]
+
+
+def estimate_tempo(
+    envelope, frame_rate, min_bpm=MIN_BPM, max_bpm=MAX_BPM, prior_bpm=PRIOR_BPM
+):
+    from scipy.fft import irfft, rfft
+
+    if len(envelope) < 4:
+        return 0.0
+    env = envelope - envelope.mean()
+    # Autocorrelation via the power spectrum, zero-padded to avoid wrap-around
+    n = 1 << int(np.ceil(np.log2(2 * len(env))))
+    acf = irfft(np.abs(rfft(env, n)) ** 2, n)[: len(env)]
+
+    min_lag = max(1, int(60 * frame_rate / max_bpm))
+    max_lag = min(len(acf) - 2, int(np.ceil(60 * frame_rate / min_bpm)))
+    if max_lag <= min_lag:
+        return 0.0
+    lags = np.arange(min_lag, max_lag + 1)
+    bpms = 60 * frame_rate / lags
+    # Log-normal preference for moderate tempi resolves octave ambiguity
+    weight = np.exp(-0.5 * np.log2(bpms / prior_bpm) ** 2)
+    best = int(np.argmax(acf[lags] * weight))
+
+    lag = float(lags[best])
+    if 0 < best < len(lags) - 1:
+        # Parabolic interpolation between neighbouring lags
+        a, b, c = acf[lags[best] - 1 : lags[best] + 2]
+        denom = a - 2 * b + c
+        if denom != 0:
+            lag += 0.5 * (a - c) / denom
+    return 60 * frame_rate / lag
+
+
+def beat_grid(envelope, frame_rate, bpm):
+    """Beat times (seconds) of the evenly spaced grid best aligned with onsets."""
+    if bpm <= 0 or len(envelope) == 0:
+        return np.zeros(0)
+    period = 60 * frame_rate / bpm
+    offsets = np.arange(int(np.ceil(period)))
+    beats = np.arange(int(len(envelope) / period) + 1) * period
+    index = np.round(offsets[:, None] + beats[None, :]).astype(np.int64)
+    valid = index < len(envelope)
+    scores = np.where(valid, envelope[np.minimum(index, len(envelope) - 1)], 0)
+    best = int(np.argmax(scores.sum(axis=1)))
+    frames = (offsets[best] + beats)[valid[best]]
+    return frames / frame_rate
+
+
+def onset_times(envelope, frame_rate, min_interval=0.05):
+    """Times (seconds) of clear peaks in an onset envelope."""
+    from scipy.signal import find_peaks
+
+    if len(envelope) == 0:
+        return np.zeros(0)
+    peaks, _ = find_peaks(
+        envelope,
+        height=envelope.mean() + envelope.std(),
+        distance=max(1, int(min_interval * frame_rate)),
+    )
+    return peaks / frame_rate
+
+
+class TempoEstimator:
+    """Incremental tempo estimation over a mono signal fed in chunks.
+
+    feed() may be called with consecutive chunks of any size; result() gives
+    the estimate for everything seen so far and sharpens as more arrives.
+    """
+
+    def __init__(
+        self,
+        sample_rate,
+        n_fft=1024,
+        hop=512,
+        min_bpm=MIN_BPM,
+        max_bpm=MAX_BPM,
+        prior_bpm=PRIOR_BPM,
+    ):
+        self.sample_rate = sample_rate
+        self.bpm_range = (min_bpm, max_bpm, prior_bpm)
+        self.stft = StreamingSTFT(STFT(n_fft, hop))
+        self.frame_rate = sample_rate / hop
+        self._previous = None
+        self._envelopes = []
+        self.samples_seen = 0
+
+    @property
+    def envelope(self):
+        if len(self._envelopes) > 1:
+            self._envelopes = [np.concatenate(self._envelopes)]
+        return self._envelopes[0] if self._envelopes else np.zeros(0, np.float32)
+
+    def feed(self, samples):
+        self.samples_seen += len(samples)
+        spectrogram = self.stft.feed(samples)
+        envelope, self._previous = onset_strength(spectrogram, self._previous)
+        self._envelopes.append(envelope)
+
+    def result(self):
+        envelope = self.envelope
+        bpm = estimate_tempo(envelope, self.frame_rate, *self.bpm_range)
+        return Tempo(bpm, beat_grid(envelope, self.frame_rate, bpm))
+
+
+def analyze_tempo(samples, sample_rate):
+    """Global tempo and beat grid of a whole mono signal."""
+    estimator = TempoEstimator(sample_rate)
+    estimator.feed(samples)
+    return estimator.result()
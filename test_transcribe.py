@@ -0,0 +1,71 @@
+"""Regression tests for transcribe.py on synthetic piano-like tones."""
+
+import wave
+
+import numpy as np
+
+from transcribe import transcribe
+
+SAMPLE_RATE = 44100
+
+
+def _write_notes(path, notes, seconds):
+    """16-bit mono WAV of decaying 8-harmonic tones, (midi, start, duration)."""
+    out = np.zeros(int(seconds * SAMPLE_RATE))
+    for pitch, start, duration in notes:
+        freq = 440 * 2 ** ((pitch - 69) / 12)
+        t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+        envelope = np.exp(-1.5 * t) * np.minimum(1, t * 200)
+        envelope *= np.minimum(1, (duration - t) * 100)
+        tone = sum(
+            0.7 ** (h - 1) * np.sin(2 * np.pi * h * freq * t) for h in range(1, 9)
+        )
+        first = int(start * SAMPLE_RATE)
+        out[first : first + len(t)] += 0.15 * envelope * tone
+    with wave.open(str(path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes((np.clip(out, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def _notes_by_pitch(path):
+    notes = {}
+    for note in transcribe(str(path)):
+        notes.setdefault(note.pitch, []).append(note)
+    return notes
+
+
+def test_sustained_note_survives_notes_sharing_its_harmonics(tmp_path):
+    # C3 held while E4, C4, G3 and C5 come and go over it
+    melody = [(64, 0.5, 0.5), (60, 1.0, 0.5), (55, 1.5, 0.5), (72, 2.0, 0.5)]
+    path = tmp_path / "sustained.wav"
+    _write_notes(path, [(48, 0.0, 3.0)] + melody, 3.5)
+    notes = _notes_by_pitch(path)
+
+    assert sorted(notes) == [48, 55, 60, 64, 72]
+    [c3] = notes[48]
+    assert c3.start < 0.1 and c3.end > 2.9
+    for pitch, start, duration in melody:
+        [note] = notes[pitch]
+        assert abs(note.start - start) < 0.06
+
+
+def test_adjacent_low_keys_are_both_found(tmp_path):
+    path = tmp_path / "low.wav"
+    _write_notes(path, [(21, 0.5, 1.5), (22, 0.5, 1.5)], 2.5)
+    notes = _notes_by_pitch(path)
+
+    assert sorted(notes) == [21, 22]
+    for pitch in 21, 22:
+        [note] = notes[pitch]
+        assert abs(note.start - 0.5) < 0.06 and note.end > 1.9
+
+
+def test_repeated_note_is_struck_twice(tmp_path):
+    path = tmp_path / "repeated.wav"
+    _write_notes(path, [(60, 0.2, 0.6), (60, 0.8, 0.6)], 1.8)
+    notes = _notes_by_pitch(path)
+
+    assert sorted(notes) == [60]
+    assert [round(note.start, 1) for note in notes[60]] == [0.2, 0.8]
@@ -0,0 +1,130 @@
+import numpy as np
+
+MIN_SPEED = 0.25
+MAX_SPEED = 2.0
+RENDER_CHUNK = 1 << 14  # Output frames per batch when rendering offline
+
+
+class TimeStretcher:
+    """Streaming phase vocoder that changes speed without changing pitch.
+
+    Every synthesis hop reads an analysis frame at the current input
+    position and one exactly `hop` samples earlier; their phase difference is
+    how far each bin turns in `hop` output samples. Speed only changes how
+    far the input position moves per hop, so it can change between calls
+    without a discontinuity. At speed 1 the output reproduces the input
+    exactly, which lets playback switch from the raw samples to the stretcher
+    seamlessly. All frames of one call are transformed as a batch, and the
+    phases and overlap-add tail are carried to the next call.
+    """
+
+    def __init__(self, nchannels, n_fft=2048, hop=256):
+        self.nchannels = nchannels
+        self.n_fft = n_fft
+        self.hop = hop
+        n = np.arange(n_fft)
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * n / n_fft)).astype(np.float32)
+        # Overlap-added squared windows sum to this constant
+        self.gain = np.float32(hop / np.sum(self.window**2))
+        self.reset(0)
+
+    def reset(self, position):
+        """Continue from input frame `position`, as if playing it at 1x."""
+        self.position = float(position)
+        self._phase = None
+        self._tail = np.zeros((self.nchannels, self.n_fft - self.hop), np.float32)
+        self._pending = np.zeros((self.nchannels, 0), np.float32)
+        self._primed = False
+
+    def process(self, samples, frame_count, speed, offset=0):
+        """Next `frame_count` output frames as a planar float32 array.
+
+        `samples` holds the input from frame `offset` on, so a window of a
+        longer signal can be passed; frames outside it read as silence.
+        """
+        if not self._primed:
+            # Run the frames that overlap the first output hop and drop what
+            # they emit, so output starts exactly at `position`
+            self._primed = True
+            steps = self.n_fft // self.hop - 1
+            self.position -= steps * self.hop
+            self._synthesize(samples, steps, 1.0, offset)
+        missing = frame_count - self._pending.shape[1]
+        if missing > 0:
+            steps = -(-missing // self.hop)
+            self._pending = np.concatenate(
+                [self._pending, self._synthesize(samples, steps, speed, offset)],
+                axis=1,
+            )
+        out = self._pending[:, :frame_count]
+        self._pending = self._pending[:, frame_count:]
+        return out
+
+    def _spectra(self, samples, starts, offset):
+        # (steps, channels, bins); frames reaching outside the input are
+        # zero padded
+        index = starts[:, None] + np.arange(self.n_fft) - offset
+        if samples.shape[1]:
+            inside = (index >= 0) & (index < samples.shape[1])
+            frames = samples[:, np.clip(index, 0, samples.shape[1] - 1)]
+            frames *= inside * self.window
+        else:
+            frames = np.zeros((self.nchannels,) + index.shape, np.float32)
+        return np.fft.rfft(frames.swapaxes(0, 1), axis=-1)
+
+    def _synthesize(self, samples, steps, speed, offset):
+        advance = speed * self.hop
+        starts = np.round(self.position + advance * np.arange(steps)).astype(np.int64)
+        self.position += advance * steps
+
+        spectra = self._spectra(
+            samples, np.concatenate([starts, starts - self.hop]), offset
+        )
+        current, previous = spectra[:steps], np.angle(spectra[steps:])
+        if self._phase is None:
+            self._phase = previous[0]
+        phase = self._phase + np.cumsum(np.angle(current) - previous, axis=0)
+        self._phase = np.mod(phase[-1], np.float32(2 * np.pi))
+        magnitude = np.abs(current)
+        # Built from parts to stay in complex64
+        spectrum = np.empty(current.shape, np.complex64)
+        spectrum.real = magnitude * np.cos(phase)
+        spectrum.imag = magnitude * np.sin(phase)
+        frames = np.fft.irfft(spectrum, self.n_fft)
+        frames *= self.window * self.gain
+
+        # Overlap-add onto the tail left by the previous call
+        total = np.zeros((self.nchannels, steps * self.hop + self.n_fft), np.float32)
+        total[:, : self._tail.shape[1]] = self._tail
+        for k in range(steps):
+            total[:, k * self.hop : k * self.hop + self.n_fft] += frames[k]
+        done = steps * self.hop
+        self._tail = total[:, done : done + self.n_fft - self.hop]
+        return total[:, :done]
+
+
+def render_loop(samples, start, stop, speed, crossfade=1024):
+    """Stretched [start, stop) as a buffer that repeats without a gap.
+
+    The audio just past `stop` is crossfaded into the head of the buffer, so
+    playing its end straight into its start stays continuous.
+    """
+    stretcher = TimeStretcher(samples.shape[0])
+    stretcher.reset(start)
+    length = max(1, int(round((stop - start) / speed)))
+    crossfade = min(crossfade, length)
+    # Only the region the stretcher reads, as one array, whatever `samples` is
+    margin = 2 * stretcher.n_fft
+    offset = max(0, start - margin)
+    region = np.asarray(
+        samples[:, offset : stop + int(crossfade * speed) + margin], np.float32
+    )
+    rendered = np.empty((samples.shape[0], length + crossfade), np.float32)
+    for first in range(0, rendered.shape[1], RENDER_CHUNK):
+        n = min(RENDER_CHUNK, rendered.shape[1] - first)
+        rendered[:, first : first + n] = stretcher.process(region, n, speed, offset)
+    loop = rendered[:, :length]
+    fade = np.linspace(0, 1, crossfade, dtype=np.float32)
+    loop[:, :crossfade] *= fade
+    loop[:, :crossfade] += rendered[:, length:] * fade[::-1]
+    return loop
@@ -0,0 +1,355 @@
+"""Polyphonic note transcription of a WAV file, exported as a MIDI file.
+
+    python transcribe.py song.wav -o song.mid [-j WORKERS]
+
+The file is read once, in blocks. Each STFT frame is log-compressed and
+whitened, then turned into a pitch salience per piano key by a sparse
+harmonic-sum matrix; keys that are only an octave above a louder one, or
+clearly weaker than a neighbouring key, are dropped. The lowest two octaves
+are a semitone apart by less than a bin, so a four times longer window of
+the decimated signal must also pick them out. Notes are then tracked over
+the whole salience matrix with hysteresis thresholds, and repeated notes are
+split where a key rises well above its own earlier level. With -j, long
+files are split into chunks whose reads overlap by one window, so every
+frame is exactly the one a single pass would compute.
+"""
+
+import argparse
+import multiprocessing
+import struct
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from piano_filterbank import NUM_KEYS, key_frequencies
+
+Note = namedtuple("Note", ["pitch", "start", "end", "velocity"])  # MIDI, seconds
+
+WINDOW_SECONDS = 0.09  # Rounded up to a power of two, 4096 at 44.1 kHz
+HOP_DIVISOR = 8
+BLOCK_FRAMES = 2048
+N_HARMONICS = 8
+HARMONIC_DECAY = 0.6
+WHITEN_BINS = 12  # Half-width of the local spectral mean subtracted
+OCTAVE_PENALTY = 0.5  # Share of the octave below's salience removed
+NEIGHBOUR_RATIO = 0.9  # Keys weaker than this share of a neighbour are dropped
+ON_RATIO = 0.7  # Of the frame's strongest salience
+OFF_RATIO = 0.3
+FUNDAMENTAL_RATIO = 0.2  # Rejects sub-octave ghosts with no fundamental
+LEVEL_RATIO = 0.25  # Of the file's reference salience; below is silence
+ONSET_RATIO = 0.1  # Salience jump, of the reference, that restarts a note
+RESTRIKE_RATIO = 1.5  # And of it and its fundamental, over their recent low
+MIN_NOTE_SECONDS = 0.1
+A0_MIDI = 21
+LOW_KEYS = 24  # A0 to G#2, a semitone apart by less than a bin
+LOW_FACTOR = 4  # Their window is this much longer, at this fraction of the rate
+LOW_AGREEMENT = 0.5  # Of a low key's salience the long window must confirm
+
+
+def frame_params(sample_rate):
+    n_fft = 1 << int(np.ceil(np.log2(sample_rate * WINDOW_SECONDS)))
+    return n_fft, n_fft // HOP_DIVISOR
+
+
+@lru_cache(maxsize=8)
+def harmonic_matrix(sample_rate, n_fft, n_harmonics=N_HARMONICS):
+    """Sparse (88 x n_bins) sums of each key's harmonics, weighted by decay.
+
+    Each harmonic is a triangle around its frequency, half a semitone but at
+    least one bin wide, normalized so every harmonic counts equally.
+    """
+    from scipy.sparse import csr_matrix
+
+    n_bins = n_fft // 2 + 1
+    bin_hz = sample_rate / n_fft
+    rows, cols, weights = [], [], []
+    for key, freq in enumerate(key_frequencies()):
+        for h in range(1, n_harmonics + 1):
+            center = h * freq / bin_hz
+            if center >= n_bins - 1:
+                break
+            width = max(1.0, center * (2 ** (0.5 / 12) - 1))
+            bins = np.arange(int(np.ceil(center - width)), int(center + width) + 1)
+            bins = bins[(bins >= 0) & (bins < n_bins)]
+            w = np.maximum(0.0, 1 - np.abs(bins - center) / width)
+            rows.append(np.full(len(bins), key))
+            cols.append(bins)
+            weights.append(HARMONIC_DECAY ** (h - 1) * w / w.sum())
+    return csr_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(NUM_KEYS, n_bins),
+        dtype=np.float32,
+    )
+
+
+def salience(wav, first, last):
+    """(harmonic salience, fundamental strength) for frames [first, last).
+
+    Each frame only depends on its own samples, so any split of the frames
+    gives the same result.
+
+    Both are (frames, 88) float32. Samples are read BLOCK_FRAMES frames at a
+    time, so memory does not grow with the file. The lowest LOW_KEYS keys
+    are checked against a second spectrogram, of the signal decimated by
+    LOW_FACTOR, whose frames are as many samples long and centred on the same
+    instants.
+    """
+    from stft import STFT
+
+    n_fft, hop = frame_params(wav.framerate)
+    low_rate = wav.framerate / LOW_FACTOR
+    stft = STFT(n_fft, hop)
+    low_stft = STFT(n_fft, hop // LOW_FACTOR)
+    harmonics = harmonic_matrix(wav.framerate, n_fft)
+    fundamentals = harmonic_matrix(wav.framerate, n_fft, n_harmonics=1)
+    low_harmonics = harmonic_matrix(low_rate, n_fft)[: LOW_KEYS + 1]
+    # Only the bins those keys use, and enough above them to whiten alike
+    low_bins = low_harmonics.indices.max() + 1 + WHITEN_BINS
+    low_harmonics = low_harmonics[:, :low_bins]
+    low_fundamentals = harmonic_matrix(low_rate, n_fft, n_harmonics=1)
+    low_fundamentals = low_fundamentals[:LOW_KEYS, :low_bins]
+
+    out = np.empty((last - first, NUM_KEYS), dtype=np.float32)
+    out_fundamental = np.empty_like(out)
+    for block in range(first, last, BLOCK_FRAMES):
+        block_end = min(block + BLOCK_FRAMES, last)
+        rows = slice(block - first, block_end - first)
+        mono = wav.read_mono(block * hop, (block_end - 1) * hop + n_fft)
+        spectrogram = _whiten(np.log1p(stft.compute(mono)))
+        low = _low_band(wav, block, block_end, n_fft, hop)
+        low_spectrogram = _whiten(np.log1p(low_stft.compute(low)[:, :low_bins]))
+        strength = _suppress_overtones((harmonics @ spectrogram.T).T)
+        low_strength = (low_harmonics @ low_spectrogram.T).T
+        strength[:, :LOW_KEYS] *= _resolved(strength[:, :LOW_KEYS], low_strength)
+        out[rows] = strength
+        fundamental = (fundamentals @ spectrogram.T).T
+        np.minimum(
+            fundamental[:, :LOW_KEYS],
+            (low_fundamentals @ low_spectrogram.T).T,
+            out=fundamental[:, :LOW_KEYS],
+        )
+        out_fundamental[rows] = fundamental
+    return out, out_fundamental
+
+
+def _resolved(short, long):
+    """Which of the low keys the long window confirms, frame by frame.
+
+    `long` has one key more than `short`, for the last one's neighbour. A key
+    must stand out from its neighbours there, and be at least LOW_AGREEMENT
+    as strong as in the short window; the long window reaches further in
+    time, so it is not asked for more.
+    """
+    padded = np.pad(long, ((0, 0), (1, 0))) * NEIGHBOUR_RATIO
+    long = long[:, :-1]
+    return (
+        (long >= padded[:, :-2])
+        & (long >= padded[:, 2:])
+        & (long >= LOW_AGREEMENT * short)
+    )
+
+
+def _low_band(wav, first, last, n_fft, hop):
+    """Mono decimated by LOW_FACTOR for the long windows of frames [first, last).
+
+    Window i is centred on frame first + i. Samples outside the file read as
+    zero, and each output only depends on the samples around it, so this too
+    is the same for any split of the frames.
+    """
+    from decimate import Decimator
+
+    decimator = Decimator(wav.framerate, wav.framerate / LOW_FACTOR)
+    span = LOW_FACTOR * n_fft
+    # Whole filter windows on both sides, so no output sees the zeros the
+    # decimator assumes before its first sample
+    start = first * hop + (n_fft - span) // 2 - decimator.delay
+    stop = (last - 1) * hop + (n_fft + span) // 2 + decimator.delay
+    mono = np.zeros(stop - start, dtype=np.float32)
+    a, b = max(start, 0), min(stop, wav.nframes)
+    if a < b:
+        mono[a - start : b - start] = wav.read_mono(a, b)
+    low = np.concatenate([decimator.feed(mono), decimator.flush()])
+    skip = decimator.delay // LOW_FACTOR
+    return low[skip : skip + (stop - start - 2 * decimator.delay) // LOW_FACTOR]
+
+
+def _whiten(spectrogram):
+    """Keep only what rises above the local spectral mean, i.e. the peaks.
+
+    Broadband energy such as attacks would otherwise light up every key.
+    """
+    w = WHITEN_BINS
+    total = np.cumsum(np.pad(spectrogram, ((0, 0), (w + 1, w))), axis=1)
+    local_mean = (total[:, 2 * w + 1 :] - total[:, : -2 * w - 1]) / (2 * w + 1)
+    return np.maximum(spectrogram - local_mean, 0)
+
+
+def _suppress_overtones(strength):
+    # A key's even harmonics are all harmonics of the key an octave up
+    strength[:, 12:] -= OCTAVE_PENALTY * strength[:, :-12].copy()
+    np.maximum(strength, 0, out=strength)
+    # Leakage into the next key is clearly weaker; a semitone is not
+    padded = np.pad(strength, ((0, 0), (1, 1))) * NEIGHBOUR_RATIO
+    peak = (strength >= padded[:, :-2]) & (strength >= padded[:, 2:])
+    return np.where(peak, strength, 0)
+
+
+def _salience_chunk(path, first, last):
+    from wav_file import WavFile
+
+    return salience(WavFile(path), first, last)
+
+
+def _runs(mask):
+    """(starts, ends) of the True runs in a 1-D boolean array."""
+    edges = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def track_notes(strength, fundamental, frame_seconds, offset_seconds=0.0):
+    """Turn (frames, 88) salience into a time-ordered list of Notes.
+
+    A note starts where a key clears the ON thresholds and lasts while it
+    stays above the OFF ones, or at least audible for less than a note's
+    length, as when other notes take over the frame. It is only struck again
+    where its salience jumps and both it and the key's fundamental rise well
+    above their lowest over the note's length before, so notes sharing its
+    harmonics do not split it.
+    """
+    if len(strength) == 0:
+        return []
+    loud = strength[strength > 0]
+    reference = np.percentile(loud, 99.5) if len(loud) else 1.0
+    frame_max = strength.max(axis=1, keepdims=True)
+    fundamental_max = fundamental.max(axis=1, keepdims=True)
+    voiced = fundamental >= FUNDAMENTAL_RATIO * fundamental_max
+    on = voiced & (strength >= ON_RATIO * frame_max)
+    on &= strength >= LEVEL_RATIO * reference
+    audible = strength >= OFF_RATIO / ON_RATIO * LEVEL_RATIO * reference
+    keep = audible & voiced & (strength >= OFF_RATIO * frame_max)
+    min_frames = max(1, int(round(MIN_NOTE_SECONDS / frame_seconds)))
+    strikes = np.diff(strength, axis=0, prepend=0) >= ONSET_RATIO * reference
+    strikes &= on
+    # Each key against its own quietest over the note's length before it
+    for level in strength, fundamental:
+        before = np.pad(level, ((min_frames, 0), (0, 0)), mode="edge")[:-1]
+        before = sliding_window_view(before, min_frames, axis=0).min(axis=-1)
+        strikes &= level >= RESTRIKE_RATIO * before
+
+    notes = []
+    for key in range(NUM_KEYS):
+        held = keep[:, key].copy()
+        for start, end in zip(*_runs(~held)):
+            if end - start < min_frames and audible[start:end, key].all():
+                held[start:end] = True
+        on_count = np.concatenate([[0], np.cumsum(on[:, key])])
+        for start, end in zip(*_runs(held)):
+            if on_count[end] == on_count[start] or end - start < min_frames:
+                continue  # Never loud or long enough to count as a note
+            bounds = [start]
+            for split in start + 1 + np.flatnonzero(strikes[start + 1 : end, key]):
+                if split - bounds[-1] >= min_frames and end - split >= min_frames:
+                    bounds.append(split)
+            bounds.append(end)
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                peak = strength[a:b, key].max() / reference
+                notes.append(
+                    Note(
+                        A0_MIDI + key,
+                        float(offset_seconds + a * frame_seconds),
+                        float(offset_seconds + b * frame_seconds),
+                        int(np.clip(40 + 87 * peak, 1, 127)),
+                    )
+                )
+    notes.sort(key=lambda note: (note.start, note.pitch))
+    return notes
+
+
+def transcribe(path, workers=1, chunk_seconds=60):
+    """Notes in the WAV file at `path`; workers > 1 splits it across processes."""
+    from wav_file import WavFile
+
+    wav = WavFile(path)
+    n_fft, hop = frame_params(wav.framerate)
+    n_frames = 0 if wav.nframes < n_fft else 1 + (wav.nframes - n_fft) // hop
+    if workers > 1:
+        chunk = max(1, int(chunk_seconds * wav.framerate / hop))
+        bounds = [(f, min(f + chunk, n_frames)) for f in range(0, n_frames, chunk)]
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [executor.submit(_salience_chunk, path, a, b) for a, b in bounds]
+            parts = [f.result() for f in futures]
+        empty = np.zeros((0, NUM_KEYS), dtype=np.float32)
+        strength = np.concatenate([p[0] for p in parts] or [empty])
+        fundamental = np.concatenate([p[1] for p in parts] or [empty])
+    else:
+        strength, fundamental = salience(wav, 0, n_frames)
+    # Frame i is centred half a window after its first sample
+    frame_seconds = hop / wav.framerate
+    return track_notes(strength, fundamental, frame_seconds, n_fft / 2 / wav.framerate)
+
+
+def _varlen(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def write_midi(path, notes, ticks_per_beat=480, bpm=120):
+    """Write `notes` as a single-track standard MIDI file (format 0)."""
+    ticks_per_second = ticks_per_beat * bpm / 60
+    events = []
+    for note in notes:
+        # Note offs sort before note ons at the same tick
+        events.append((round(note.start * ticks_per_second), 1, 0x90, note))
+        events.append((round(note.end * ticks_per_second), 0, 0x80, note))
+    events.sort(key=lambda e: e[:2])
+
+    track = bytearray()
+    track += b"\x00\xff\x51\x03" + (60_000_000 // bpm).to_bytes(3, "big")
+    tick = 0
+    for event_tick, _, status, note in events:
+        velocity = note.velocity if status == 0x90 else 0
+        track += _varlen(event_tick - tick) + bytes([status, note.pitch, velocity])
+        tick = event_tick
+    track += b"\x00\xff\x2f\x00"
+    with open(path, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, ticks_per_beat))
+        f.write(b"MTrk" + struct.pack(">I", len(track)) + track)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("input")
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--chunk-seconds", type=float, default=60)
+    args = parser.parse_args(argv)
+    output = args.output or args.input.rsplit(".", 1)[0] + ".mid"
+
+    from wav_file import WavFile
+
+    started = time.perf_counter()
+    notes = transcribe(args.input, args.workers, args.chunk_seconds)
+    write_midi(output, notes)
+    elapsed = time.perf_counter() - started
+    wav = WavFile(args.input)
+    duration = wav.nframes / wav.framerate
+    print(
+        f"{len(notes)} notes from {duration:.1f} s of audio in {elapsed:.2f} s "
+        f"({duration / max(elapsed, 1e-9):.0f}x real time) -> {output}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
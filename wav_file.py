@@ -0,0 +1,190 @@
+import struct
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Raw sample dtype per (format, container bytes); 24-bit is handled apart
+RAW_DTYPES = {
+    (WAVE_FORMAT_PCM, 1): np.uint8,
+    (WAVE_FORMAT_PCM, 2): np.dtype("<i2"),
+    (WAVE_FORMAT_PCM, 4): np.dtype("<i4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): np.dtype("<f4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 8): np.dtype("<f8"),
+}
+DECODE_CHUNK_FRAMES = 1 << 16
+
+
+class WavFile:
+    """A WAV file whose data chunk is exposed as a read-only memory map.
+
+    Only the RIFF header is read when opening; samples are paged in by the OS
+    as they are touched, and float conversion happens per requested window.
+    Integer PCM of 8, 16, 24 and 32 bits and 32/64-bit float are supported,
+    including WAVE_FORMAT_EXTENSIBLE headers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parse_header()
+        if (self.format_tag, self.sampwidth) in RAW_DTYPES:
+            dtype = RAW_DTYPES[self.format_tag, self.sampwidth]
+            shape = (self.nframes, self.nchannels)
+        else:
+            dtype = np.uint8
+            shape = (self.nframes, self.nchannels, self.sampwidth)
+        if self.nframes:
+            # (frames, channels) as stored, interleaved
+            self.frames = np.memmap(
+                path, dtype=dtype, mode="r", offset=self.data_offset, shape=shape
+            )
+        else:
+            self.frames = np.zeros(shape, dtype=dtype)
+
+    def _parse_header(self):
+        with open(self.path, "rb") as f:
+            riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave_id != b"WAVE":
+                raise ValueError(f"{self.path} is not a RIFF/WAVE file")
+
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{self.path} has no data chunk")
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(chunk_size)
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        raise ValueError(f"{self.path} has data before fmt chunk")
+                    self.data_offset = f.tell()
+                    data_size = chunk_size
+                    break
+                else:
+                    f.seek(chunk_size, 1)
+                # Chunks are padded to an even number of bytes
+                if chunk_size % 2:
+                    f.seek(1, 1)
+
+            f.seek(0, 2)
+            # Some writers leave the data size unset (0 or 0xFFFFFFFF) when
+            # streaming; trust the file length in that case.
+            available = f.tell() - self.data_offset
+            if data_size == 0 or data_size > available:
+                data_size = available
+
+        format_tag, nchannels, framerate, _, block_align, bits = struct.unpack(
+            "<HHIIHH", fmt[:16]
+        )
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            # The real format is the first two bytes of the SubFormat GUID
+            (format_tag,) = struct.unpack("<H", fmt[24:26])
+        sampwidth = block_align // max(1, nchannels)
+        if (format_tag, sampwidth) not in RAW_DTYPES and (
+            format_tag != WAVE_FORMAT_PCM or sampwidth != 3
+        ):
+            raise ValueError(
+                f"Unsupported WAV format (tag {format_tag:#06x}, {bits}-bit)"
+            )
+
+        self.format_tag = format_tag
+        self.nchannels = nchannels
+        # Container width; 20-bit samples in 3 bytes decode like 24-bit ones
+        self.sampwidth = sampwidth
+        self.bits = bits
+        self.framerate = framerate
+        self.nframes = data_size // block_align
+
+    def __len__(self):
+        return self.nframes
+
+    def _convert(self, raw, out):
+        """Write (frames, channels) raw samples into planar float32 `out`."""
+        raw = raw.swapaxes(0, 1)  # Planar view, no copy
+        if self.sampwidth == 3:
+            # Place the 3 bytes in the top of an int32 to keep the sign
+            widened = np.zeros(raw.shape[:2] + (4,), dtype=np.uint8)
+            widened[..., 1:] = raw
+            np.multiply(widened.view("<i4")[..., 0], np.float32(2.0**-31), out=out)
+        elif self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            out[...] = raw
+        elif self.sampwidth == 1:
+            # 8-bit PCM is unsigned around 128
+            np.subtract(raw, np.float32(128), out=out, dtype=np.float32)
+            out *= np.float32(1 / 128)
+        else:
+            scale = np.float32(2.0 ** (1 - 8 * self.sampwidth))
+            np.multiply(raw, scale, out=out, dtype=np.float32)
+
+    def decode(self, start_frame, stop_frame, out=None):
+        """Frames [start_frame, stop_frame) as planar (channels, n) float32.
+
+        Samples are converted `DECODE_CHUNK_FRAMES` at a time straight into
+        `out` (allocated if not given), so no full-size intermediate exists.
+        """
+        start_frame = max(0, start_frame)
+        stop_frame = max(start_frame, min(stop_frame, self.nframes))
+        if out is None:
+            out = np.empty((self.nchannels, stop_frame - start_frame), np.float32)
+        for first in range(start_frame, stop_frame, DECODE_CHUNK_FRAMES):
+            last = min(first + DECODE_CHUNK_FRAMES, stop_frame)
+            self._convert(
+                self.frames[first:last],
+                out[:, first - start_frame : last - start_frame],
+            )
+        return out
+
+    def read_mono(self, start_frame, stop_frame):
+        """Return frames [start_frame, stop_frame) mixed down to float32 mono."""
+        window = self.decode(start_frame, stop_frame)
+        if self.nchannels == 1:
+            return window[0]
+        return window.mean(axis=0)
+
+
+class PlanarView:
+    """Read-only planar (channels, frames) float32 view of a WavFile.
+
+    Indexing converts only the frames asked for, so a whole file can be
+    handed to code that slices planar arrays without decoding it first.
+    Frames are taken as a single index or a contiguous slice.
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 2
+    nbytes = 0  # Samples stay in the file's memory map
+
+    def __init__(self, wav):
+        self.wav = wav
+        self.shape = (wav.nchannels, wav.nframes)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if Ellipsis in index:
+            at = index.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim + 1 - len(index))
+            index = index[:at] + fill + index[at + 1 :]
+        if len(index) > self.ndim:
+            raise IndexError("too many indices for a planar view")
+        channels, frames = index + (slice(None),) * (self.ndim - len(index))
+        if isinstance(frames, slice):
+            start, stop, step = frames.indices(self.shape[1])
+            if step != 1:
+                raise IndexError("frames must be a contiguous slice")
+            return self.wav.decode(start, stop)[channels]
+        frame = int(frames)
+        if frame < 0:
+            frame += self.shape[1]
+        if not 0 <= frame < self.shape[1]:
+            raise IndexError(f"frame {frames} out of range")
+        return self.wav.decode(frame, frame + 1)[:, 0][channels]
+
+    def __array__(self, dtype=None, copy=None):
+        # Decodes the whole file
+        return self.wav.decode(0, self.shape[1]).astype(dtype or self.dtype, copy=False)
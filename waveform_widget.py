@@ -1,30 +1,243 @@
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from PySide6.QtWidgets import QWidget
-from PySide6.QtGui import QPainter, QPen, QColor
-from PySide6.QtCore import Qt, Signal, QPointF
+from PySide6.QtGui import QPainter, QPen, QColor, QImage, QPixmap, QPolygonF
+from PySide6.QtCore import Qt, Signal, QPointF, QLineF, QRect
 import numpy as np
 
+from peak_pyramid import PeakPyramid
+from telemetry import telemetry
+
+TILE_WIDTH = 256
+PREFETCH_TILES = 4  # On either side of the visible ones
+TILE_CACHE_BYTES = 64 << 20
+LOUDNESS_TRACK_HEIGHT = 0.25  # Share of the widget, along the bottom
+LOUDNESS_FLOOR = -60.0  # LUFS at the bottom of the track; 0 is at the top
+TRUE_PEAK_WARNING = -1.0  # dBTP
+
+
+def render_tile(pyramid, samples, samples_per_pixel, index, height, vertical_zoom):
+    """Draw waveform tile `index` (TILE_WIDTH pixel columns) into a QImage.
+
+    Painting into a QImage is allowed off the GUI thread, unlike a QPixmap.
+    """
+    image = QImage(TILE_WIDTH, height, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.white)
+    mid_height = height // 2
+
+    # One min/max column per pixel, with the RMS band on top
+    mins, maxs, rms = pyramid.columns(
+        samples, index * TILE_WIDTH * samples_per_pixel, samples_per_pixel, TILE_WIDTH
+    )
+    scale = mid_height * vertical_zoom
+    xs = np.arange(len(mins))
+    y_top = (mid_height - maxs * scale).astype(np.int32)
+    y_bottom = (mid_height - mins * scale).astype(np.int32)
+    rms_top = (mid_height - rms * scale).astype(np.int32)
+    rms_bottom = (mid_height + rms * scale).astype(np.int32)
+
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor(120, 150, 255), 1))
+    painter.drawLines([QLineF(x, a, x, b) for x, a, b in zip(xs, y_top, y_bottom)])
+    painter.setPen(QPen(Qt.blue, 1))
+    painter.drawLines([QLineF(x, a, x, b) for x, a, b in zip(xs, rms_top, rms_bottom)])
+    painter.end()
+    return image
+
+
+class TileCache:
+    """LRU cache of rendered tiles, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._tiles = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def get(self, key):
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        if key in self._tiles:
+            self.bytes -= self._size(self._tiles.pop(key))
+        self._tiles[key] = pixmap
+        self.bytes += self._size(pixmap)
+        while self.bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self.bytes -= self._size(evicted)
+
+    def clear(self):
+        self._tiles.clear()
+        self.bytes = 0
+
+    @staticmethod
+    def _size(pixmap):
+        return pixmap.width() * pixmap.height() * 4
+
+
+class PlayheadOverlay(QWidget):
+    """Transparent layer over the waveform that only draws the playhead.
+
+    Moving it repaints the old and new playhead columns; the waveform under
+    them is blitted back from the tile cache.
+    """
+
+    PEN_WIDTH = 2
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.x = None
+
+    def move_to(self, x):
+        """Draw the playhead at pixel column `x`, or hide it for None."""
+        if x == self.x:
+            return
+        for column in (self.x, x):
+            if column is not None:
+                self.update(self._column_rect(column))
+        self.x = x
+
+    def _column_rect(self, x):
+        return QRect(x - self.PEN_WIDTH, 0, 2 * self.PEN_WIDTH, self.height())
+
+    def paintEvent(self, event):
+        if self.x is None:
+            return
+        painter = QPainter(self)
+        painter.setPen(QPen(Qt.red, self.PEN_WIDTH))
+        painter.drawLine(self.x, 0, self.x, self.height())
+
+
+class LoudnessOverlay(QWidget):
+    """Translucent loudness track along the bottom of the waveform.
+
+    Momentary loudness is filled and short-term loudness drawn as a line,
+    each the loudest step under a pixel column; columns whose true-peak
+    comes within TRUE_PEAK_WARNING of full scale are marked at the top.
+    Only the columns in the dirty rect are drawn, so playhead moves stay
+    cheap.
+    """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.loudness = None
+        self.view = None  # (scroll position, samples per pixel)
+
+    def set_loudness(self, loudness):
+        self.loudness = loudness
+        self.update()
+
+    def set_view(self, scroll_position, samples_per_pixel):
+        view = (scroll_position, samples_per_pixel)
+        if view != self.view:
+            self.view = view
+            self.update()
+
+    def _columns(self, left, right):
+        # Loudest step under each pixel column in [left, right], up to the
+        # last step
+        scroll_position, samples_per_pixel = self.view
+        steps = self.loudness.steps
+        xs = np.arange(left, right + 1)
+        firsts = (scroll_position + xs) * samples_per_pixel // self.loudness.step
+        firsts = firsts.astype(np.int64)
+        keep = firsts < len(steps)
+        xs, firsts = xs[keep], firsts[keep]
+        if len(xs) == 0:
+            return xs, None
+        return xs, {
+            name: np.maximum.reduceat(steps[name][: firsts[-1] + 1], firsts)
+            for name in ("momentary", "short_term", "true_peak")
+        }
+
+    def paintEvent(self, event):
+        if self.loudness is None or self.view is None:
+            return
+        rect = event.rect()
+        # One column either side so the edges join up with the neighbours
+        xs, columns = self._columns(max(0, rect.left() - 1), rect.right() + 1)
+        if columns is None:
+            return
+        height = self.height()
+
+        def ys(levels):
+            level = np.clip(levels / -LOUDNESS_FLOOR + 1, 0, 1)
+            return height * (1 - level)
+
+        painter = QPainter(self)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(255, 140, 0, 90))
+        momentary = ys(columns["momentary"])
+        outline = [QPointF(x, y) for x, y in zip(xs, momentary)]
+        outline += [QPointF(xs[-1], height), QPointF(xs[0], height)]
+        painter.drawPolygon(QPolygonF(outline))
+
+        painter.setPen(QPen(QColor(200, 80, 0), 1))
+        short_term = ys(columns["short_term"])
+        painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs, short_term)]))
+
+        hot = xs[columns["true_peak"] > TRUE_PEAK_WARNING]
+        if len(hot):
+            painter.setPen(QPen(Qt.red, 1))
+            painter.drawLines([QLineF(x, 0, x, 3) for x in hot])
+
 
 class WaveformWidget(QWidget):
     playhead_changed = Signal(int)
     zoom_changed = Signal(float, float)  # Emit horizontal and vertical zoom factors
     scroll_changed = Signal(int)  # Signal to inform when scrolling occurs
+    _tiles_ready = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.waveform = None
+        self.pyramid = None
         self.horizontal_zoom_factor = 1
         self.vertical_zoom_factor = 1
         self.scroll_position = 0
         self.playhead_position = 0
         self.setMouseTracking(True)
+        self.loudness_overlay = LoudnessOverlay(self)
+        self.playhead_overlay = PlayheadOverlay(self)
 
-    def set_waveform(self, waveform):
+        # Rendered waveform tiles, so scrolling and playhead ticks only blit
+        self.tiles = TileCache()
+        self.pending_tiles = {}
+        self.tile_generation = 0
+        self.tile_executor = None
+        self._rendered = queue.SimpleQueue()
+        self._tiles_ready.connect(self._collect_tiles)
+
+    def set_waveform(self, waveform, pyramid=None):
+        # 1-D samples or a planar (channels, frames) array; positions are
+        # indices along the last axis
         self.waveform = waveform
+        if pyramid is None and waveform is not None:
+            pyramid = PeakPyramid(waveform)
+        self.pyramid = pyramid
+        self._invalidate_tiles()
+        self._place_playhead()
+        self._place_loudness()
         self.update()
 
+    def set_loudness(self, loudness):
+        """Show a loudness.Loudness along the bottom, or nothing for None."""
+        self.loudness_overlay.set_loudness(loudness)
+
     def set_horizontal_zoom(self, factor):
         self.horizontal_zoom_factor = max(1, factor)
         self.zoom_changed.emit(self.horizontal_zoom_factor, self.vertical_zoom_factor)
+        self._place_playhead()
+        self._place_loudness()
         self.update()
 
     def set_vertical_zoom(self, factor):
@@ -32,25 +245,23 @@ class WaveformWidget(QWidget):
         self.zoom_changed.emit(self.horizontal_zoom_factor, self.vertical_zoom_factor)
         self.update()
 
-    def set_scroll(self, position):
-        self.scroll_position = max(0, min(position, self.get_max_scroll()))
-        self.update()
-
     def set_playhead(self, position):
         self.playhead_position = max(
-            0, min(position, len(self.waveform) - 1 if self.waveform is not None else 0)
+            0,
+            min(
+                position,
+                self.waveform.shape[-1] - 1 if self.waveform is not None else 0,
+            ),
         )
+        # Only the overlay repaints, unless the view has to scroll
         self.ensure_playhead_visible()
-        self.update()
+        self._place_playhead()
 
     def ensure_playhead_visible(self):
         if self.waveform is None:
             return
 
-        samples_per_pixel = max(
-            1, int(len(self.waveform) / (self.width() * self.horizontal_zoom_factor))
-        )
-        playhead_pixel = self.playhead_position // samples_per_pixel
+        playhead_pixel = int(self.playhead_position / self.get_samples_per_pixel())
 
         # Check if playhead is outside the visible area
         if (
@@ -66,67 +277,133 @@ class WaveformWidget(QWidget):
 
     def set_scroll(self, position):
         self.scroll_position = max(0, min(position, self.get_max_scroll()))
+        self._place_playhead()
+        self._place_loudness()
         self.update()
 
+    def _place_playhead(self):
+        x = None
+        if self.waveform is not None:
+            x = int(self.playhead_position / self.get_samples_per_pixel())
+            x -= self.scroll_position
+            if not 0 <= x < self.width():
+                x = None
+        self.playhead_overlay.move_to(x)
+
+    def _place_loudness(self):
+        if self.waveform is not None:
+            self.loudness_overlay.set_view(
+                self.scroll_position, self.get_samples_per_pixel()
+            )
+
+    def resizeEvent(self, event):
+        self.playhead_overlay.resize(self.size())
+        self._place_playhead()
+        track = int(self.height() * LOUDNESS_TRACK_HEIGHT)
+        self.loudness_overlay.setGeometry(0, self.height() - track, self.width(), track)
+        self._place_loudness()
+        super().resizeEvent(event)
+
     def get_max_scroll(self):
         if self.waveform is None:
             return 0
-        return max(
-            0, int(len(self.waveform) * self.horizontal_zoom_factor - self.width())
+        return max(0, int(self.width() * self.horizontal_zoom_factor - self.width()))
+
+    def get_samples_per_pixel(self):
+        # Scroll position is measured in pixels of the zoomed waveform
+        return self.waveform.shape[-1] / max(
+            1, self.width() * self.horizontal_zoom_factor
         )
 
     def paintEvent(self, event):
         if self.waveform is None:
             return
 
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
+        with telemetry.timer("ui.paint"):
+            self._paint(event.rect())
 
-        width = self.width()
-        height = self.height()
-        mid_height = height // 2
+    def _tile_key(self, index):
+        # Tiles are valid for one scale and size of the drawing
+        spp = self.get_samples_per_pixel()
+        return (spp, self.vertical_zoom_factor, self.height(), index)
 
-        painter.fillRect(self.rect(), Qt.white)
+    def _render_tile_args(self, key):
+        # Bound now, so a render already running when the waveform changes
+        # keeps drawing the waveform it was queued for
+        spp, vertical_zoom, height, index = key
+        return self.pyramid, self.waveform, spp, index, height, vertical_zoom
 
-        # Draw waveform
-        pen = QPen(Qt.blue)
-        pen.setWidth(1)
-        painter.setPen(pen)
+    def _paint(self, rect):
+        painter = QPainter(self)
 
-        samples_per_pixel = max(
-            1, int(len(self.waveform) / (width * self.horizontal_zoom_factor))
-        )
-        start_sample = int(self.scroll_position / self.horizontal_zoom_factor)
-        end_sample = min(len(self.waveform), start_sample + width * samples_per_pixel)
-
-        for x in range(width):
-            sample_start = start_sample + x * samples_per_pixel
-            sample_end = min(sample_start + samples_per_pixel, end_sample)
-            if sample_start >= sample_end:
-                break
-            chunk = self.waveform[sample_start:sample_end]
-            if len(chunk) > 0:
-                y = int(
-                    np.mean(chunk) * mid_height * self.vertical_zoom_factor + mid_height
-                )
-                painter.drawLine(x, mid_height, x, y)
-
-        # Draw playhead
-        if start_sample <= self.playhead_position < end_sample:
-            playhead_x = int(
-                (self.playhead_position - start_sample) / samples_per_pixel
+        # Composite the tiles under the dirty rect, which is just a couple of
+        # columns when only the playhead moved; only misses are rendered
+        # here, and the tiles around them are rendered ahead in the background
+        first = (self.scroll_position + rect.left()) // TILE_WIDTH
+        last = (self.scroll_position + rect.right()) // TILE_WIDTH
+        for index in range(first, last + 1):
+            key = self._tile_key(index)
+            pixmap = self.tiles.get(key)
+            if pixmap is None:
+                telemetry.count("ui.tile_miss")
+                pixmap = QPixmap.fromImage(render_tile(*self._render_tile_args(key)))
+                self.tiles.put(key, pixmap)
+            painter.drawPixmap(index * TILE_WIDTH - self.scroll_position, 0, pixmap)
+        self._prefetch(first - PREFETCH_TILES, last + PREFETCH_TILES)
+
+    def _prefetch(self, first, last):
+        n_tiles = -(-int(self.width() * self.horizontal_zoom_factor) // TILE_WIDTH)
+        for index in range(max(0, first), min(last, n_tiles - 1) + 1):
+            key = self._tile_key(index)
+            if key in self.tiles or key in self.pending_tiles:
+                continue
+            if self.tile_executor is None:
+                self.tile_executor = ThreadPoolExecutor(1)
+            generation = self.tile_generation
+            future = self.tile_executor.submit(
+                render_tile, *self._render_tile_args(key)
+            )
+            future.add_done_callback(
+                lambda f, key=key: self._on_tile_rendered(generation, key, f)
             )
-            painter.setPen(QPen(Qt.red, 2))
-            painter.drawLine(playhead_x, 0, playhead_x, height)
+            self.pending_tiles[key] = future
+
+    def _on_tile_rendered(self, *tile):
+        # Runs on the render thread; same hand-over as the analysis scheduler
+        if tile[0] != self.tile_generation:
+            return
+        self._rendered.put(tile)
+        try:
+            self._tiles_ready.emit()
+        except RuntimeError:
+            pass  # The widget was deleted while the tile rendered
+
+    def _collect_tiles(self):
+        while True:
+            try:
+                generation, key, future = self._rendered.get_nowait()
+            except queue.Empty:
+                return
+            if generation != self.tile_generation or future.cancelled():
+                continue
+            self.pending_tiles.pop(key, None)
+            if future.exception() is None:
+                self.tiles.put(key, QPixmap.fromImage(future.result()))
+
+    def _invalidate_tiles(self):
+        # Called when what the tiles show changes, not just the zoom
+        self.tile_generation += 1
+        for future in self.pending_tiles.values():
+            future.cancel()
+        self.pending_tiles = {}
+        self.tiles.clear()
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton and self.waveform is not None:
-            samples_per_pixel = max(
-                1,
-                int(len(self.waveform) / (self.width() * self.horizontal_zoom_factor)),
+            samples_per_pixel = self.get_samples_per_pixel()
+            clicked_sample = int(
+                (self.scroll_position + event.position().x()) * samples_per_pixel
             )
-            start_sample = int(self.scroll_position / self.horizontal_zoom_factor)
-            clicked_sample = start_sample + event.x() * samples_per_pixel
             self.set_playhead(clicked_sample)
             self.playhead_changed.emit(self.playhead_position)
 